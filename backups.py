@@ -0,0 +1,652 @@
+"""
+Online backups for the Meal Planner database.
+Snapshots are taken with the SQLite backup API a few hundred pages at a
+time, pausing between steps so the app keeps serving writes, and checked
+with PRAGMA integrity_check before they are written out.
+
+Compressed full backups of databases up to BACKUP_MEMORY_LIMIT_MB are
+streamed into gzip straight from an in-memory snapshot. Larger ones are
+snapshotted into an uncompressed spool file first, which needs as much
+free disk as the database.
+
+Incremental backups store only the pages that changed since the previous
+one, and any of them can be rebuilt as a point in time. Restores go
+through a verified staging database and the backup API, so they are safe
+while the app is serving.
+"""
+
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import queue
+import shutil
+import sqlite3
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BACKUP_PAGES = int(os.environ.get('BACKUP_PAGES', 512))
+BACKUP_PAUSE = float(os.environ.get('BACKUP_PAUSE', 0.005))
+# Databases larger than this are snapshotted into an uncompressed spool file
+# next to the backup instead of memory. The backup API can only copy into
+# another database, and Python cannot serialise one that lives on disk
+# without reading it back, so there is no way to stream these into gzip.
+BACKUP_MEMORY_LIMIT = int(os.environ.get('BACKUP_MEMORY_LIMIT_MB', 64)) * 1024 * 1024
+# After this many restarts the rest of the copy is done in a single step
+MAX_RESTARTS = 2
+CHUNK_SIZE = 1024 * 1024
+
+
+class BackupError(Exception):
+    """A snapshot that could not be taken or failed verification"""
+
+
+class _Restarted(Exception):
+    pass
+
+
+def take_snapshot(db_path, target, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+    """Copy db_path into the target connection with the backup API.
+
+    Copies pages at a time and sleeps for pause seconds between steps, so
+    writers are never held up for long. A write through another connection
+    starts the copy over. After MAX_RESTARTS the copy is finished in one
+    step instead, so a busy database cannot keep it from ever finishing.
+    Under WAL that step still does not block writers. Returns how often
+    the copy restarted.
+    """
+    state = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] >= MAX_RESTARTS:
+                raise _Restarted()
+        state['remaining'] = remaining
+        if remaining and pause:
+            time.sleep(pause)
+
+    source = sqlite3.connect(db_path, timeout=30)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except _Restarted:
+            source.backup(target)
+    finally:
+        source.close()
+    return state['restarts']
+
+
+def _open_target(path):
+    # Nothing else reads the target until it has been verified, but an
+    # aborted copy still has to roll back
+    target = sqlite3.connect(path)
+    target.execute('PRAGMA journal_mode = MEMORY')
+    target.execute('PRAGMA synchronous = OFF')
+    return target
+
+
+def verify_snapshot(conn):
+    """Raise BackupError unless PRAGMA integrity_check passes"""
+    problems = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    if problems != ['ok']:
+        raise BackupError('Integrity check failed: ' + '; '.join(problems[:5]))
+
+
+def _file_chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _snapshot_chunks(db_path, spool_path, pages, pause):
+    """Take a verified snapshot; return the restart count and an iterator over its bytes"""
+    if os.path.getsize(db_path) <= BACKUP_MEMORY_LIMIT:
+        target = sqlite3.connect(':memory:')
+        try:
+            restarts = take_snapshot(db_path, target, pages, pause)
+            verify_snapshot(target)
+            data = memoryview(target.serialize())
+        finally:
+            target.close()
+        chunks = (data[offset:offset + CHUNK_SIZE] for offset in range(0, len(data), CHUNK_SIZE))
+        return restarts, chunks
+
+    # Fail before copying rather than filling the disk halfway through
+    needed = os.path.getsize(db_path)
+    free = shutil.disk_usage(os.path.dirname(os.path.abspath(spool_path))).free
+    if free < needed:
+        raise BackupError(f'Snapshot needs {needed / 1024 / 1024:.0f} MB of free disk, '
+                          f'only {free / 1024 / 1024:.0f} MB available')
+    target = _open_target(spool_path)
+    try:
+        restarts = take_snapshot(db_path, target, pages, pause)
+        verify_snapshot(target)
+    finally:
+        target.close()
+    return restarts, _file_chunks(spool_path)
+
+
+def create_backup(db_path, backup_path, compress=None, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+    """Write a verified online backup of db_path to backup_path.
+
+    The backup is gzipped when compress is true, which defaults to whether
+    backup_path ends in .gz. It appears under its final name only once
+    complete. Returns a summary dict.
+    """
+    if not os.path.exists(db_path):
+        raise BackupError(f'Database not found: {db_path}')
+    if compress is None:
+        compress = backup_path.endswith('.gz')
+    started = time.perf_counter()
+    partial_path = backup_path + '.partial'
+    spool_path = backup_path + '.snapshot'
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        if compress:
+            restarts, chunks = _snapshot_chunks(db_path, spool_path, pages, pause)
+            with gzip.open(partial_path, 'wb', compresslevel=6) as out:
+                for chunk in chunks:
+                    out.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+        else:
+            target = _open_target(partial_path)
+            try:
+                restarts = take_snapshot(db_path, target, pages, pause)
+                verify_snapshot(target)
+            finally:
+                target.close()
+            for chunk in _file_chunks(partial_path):
+                digest.update(chunk)
+                size += len(chunk)
+        os.replace(partial_path, backup_path)
+    finally:
+        for path in (partial_path, spool_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    return {
+        'path': backup_path,
+        'size': size,
+        'stored_size': os.path.getsize(backup_path),
+        'sha256': digest.hexdigest(),
+        'restarts': restarts,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+# Incremental backups
+#
+# Backups in database_backups/incremental/ form chains. The first link of a
+# chain is a base holding every page of a snapshot; each later link holds
+# only the pages whose hash differs from the state before it. A link is a
+# gzip stream of (page number, page) records plus a JSON manifest with the
+# hashes of those pages, the page count and the SHA-256 of the whole
+# snapshot, so any link can be rebuilt and verified as a point in time.
+
+INCREMENTAL_DIR = 'incremental'
+# A new base is started once a chain has this many links, or once its
+# increments take more space than its base
+MAX_CHAIN_LENGTH = int(os.environ.get('BACKUP_MAX_CHAIN', 48))
+PAGE_NUMBER = struct.Struct('>I')
+
+
+def _page_hash(page):
+    return hashlib.blake2b(page, digest_size=16).hexdigest()
+
+
+def _split_pages(chunks):
+    """Return the page size and an iterator of (page number, page) over snapshot chunks"""
+    chunks = iter(chunks)
+    first = next(chunks)
+    page_size = int.from_bytes(first[16:18], 'big')
+    if page_size == 1:
+        page_size = 65536
+
+    def pages():
+        number = 1
+        for chunk in itertools.chain([first], chunks):
+            for offset in range(0, len(chunk), page_size):
+                yield number, bytes(chunk[offset:offset + page_size])
+                number += 1
+    return page_size, pages()
+
+
+def _chain_dirs(root):
+    if not os.path.isdir(root):
+        return []
+    return sorted(os.path.join(root, name) for name in os.listdir(root)
+                  if os.path.isdir(os.path.join(root, name)) and not name.startswith('.'))
+
+
+def _load_links(chain_dir):
+    """Manifests of the committed links of a chain, in order"""
+    links = []
+    for name in sorted(os.listdir(chain_dir)):
+        if name.endswith('.json'):
+            with open(os.path.join(chain_dir, name)) as f:
+                link = json.load(f)
+            link['path'] = os.path.join(chain_dir, name[:-5] + '.pages.gz')
+            links.append(link)
+    return links
+
+
+def _links_from_base(links, seq):
+    """The links needed to rebuild link seq: its latest base and what follows"""
+    upto = [link for link in links if link['seq'] <= seq]
+    start = max(index for index, link in enumerate(upto) if link['base'])
+    return upto[start:]
+
+
+def _page_hashes(links):
+    hashes = {}
+    for link in links:
+        hashes.update(link['pages'])
+    return hashes
+
+
+def _write_link(chain_dir, seq, pages, page_size, created, previous=None):
+    """Write the pages that differ from previous (all of them for a base) and the manifest"""
+    prefix = os.path.join(chain_dir, f'{seq:05d}')
+    digest = hashlib.sha256()
+    stored = {}
+    page_count = 0
+    with gzip.open(prefix + '.pages.gz.partial', 'wb', compresslevel=6) as out:
+        for number, page in pages:
+            digest.update(page)
+            page_count = number
+            page_hash = _page_hash(page)
+            if previous is None or previous.get(str(number)) != page_hash:
+                out.write(PAGE_NUMBER.pack(number))
+                out.write(page)
+                stored[str(number)] = page_hash
+    os.replace(prefix + '.pages.gz.partial', prefix + '.pages.gz')
+
+    link = {
+        'chain': os.path.basename(chain_dir),
+        'seq': seq,
+        'base': previous is None,
+        'created': created,
+        'page_size': page_size,
+        'page_count': page_count,
+        'sha256': digest.hexdigest(),
+        'changed_pages': len(stored),
+        'stored_size': os.path.getsize(prefix + '.pages.gz'),
+        'pages': stored,
+    }
+    with open(prefix + '.json.partial', 'w') as f:
+        json.dump(link, f)
+    os.replace(prefix + '.json.partial', prefix + '.json')
+    link['path'] = prefix + '.pages.gz'
+    return link
+
+
+def create_incremental_backup(db_path, backup_dir, pages=BACKUP_PAGES, pause=BACKUP_PAUSE, base=False):
+    """Snapshot db_path and store it as the next link of the latest chain.
+
+    A new chain is started when base is true, when there is no chain yet,
+    when the page size changed or when the latest chain is due for a new
+    base. Returns the new link's manifest without its page hashes.
+    """
+    if not os.path.exists(db_path):
+        raise BackupError(f'Database not found: {db_path}')
+    started = time.perf_counter()
+    root = os.path.join(backup_dir, INCREMENTAL_DIR)
+    os.makedirs(root, exist_ok=True)
+    chains = _chain_dirs(root)
+    links = _load_links(chains[-1]) if chains else []
+    spool_path = os.path.join(root, '.snapshot.db')
+
+    try:
+        restarts, chunks = _snapshot_chunks(db_path, spool_path, pages, pause)
+        page_size, snapshot_pages = _split_pages(chunks)
+        created = datetime.now().isoformat(timespec='microseconds')
+
+        if links:
+            chain = _links_from_base(links, links[-1]['seq'])
+            increments = sum(link['stored_size'] for link in chain[1:])
+            base = (base or len(chain) >= MAX_CHAIN_LENGTH
+                    or increments > chain[0]['stored_size'] or links[-1]['page_size'] != page_size)
+        if not links or base:
+            chain_dir = os.path.join(root, datetime.now().strftime('%Y%m%d_%H%M%S_%f'))
+            os.makedirs(chain_dir)
+            link = _write_link(chain_dir, 0, snapshot_pages, page_size, created)
+        else:
+            link = _write_link(chains[-1], links[-1]['seq'] + 1, snapshot_pages, page_size, created,
+                               previous=_page_hashes(chain))
+    finally:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+    link.pop('pages')
+    link.update(restarts=restarts, seconds=round(time.perf_counter() - started, 3))
+    return link
+
+
+def list_restore_points(backup_dir):
+    """Every link of every chain as a restore point, oldest first"""
+    points = []
+    for chain_dir in _chain_dirs(os.path.join(backup_dir, INCREMENTAL_DIR)):
+        for link in _load_links(chain_dir):
+            link.pop('pages')
+            link['id'] = f"{link['chain']}/{link['seq']:05d}"
+            points.append(link)
+    points.sort(key=lambda point: point['created'])
+    return points
+
+
+def _apply_links(links, output_path):
+    """Write the pages of links, in order, into a fresh file at output_path"""
+    target = links[-1]
+    with open(output_path, 'wb') as out:
+        for link in links:
+            with gzip.open(link['path'], 'rb') as pages:
+                while True:
+                    header = pages.read(PAGE_NUMBER.size)
+                    if not header:
+                        break
+                    page = pages.read(link['page_size'])
+                    if len(page) != link['page_size']:
+                        raise BackupError(f"Truncated page file: {link['path']}")
+                    out.seek((PAGE_NUMBER.unpack(header)[0] - 1) * link['page_size'])
+                    out.write(page)
+        out.truncate(target['page_count'] * target['page_size'])
+
+
+def rebuild_restore_point(backup_dir, output_path, point_id=None, when=None):
+    """Rebuild a database file from a base and its increments.
+
+    Picks the restore point point_id, else the latest one taken at or
+    before when (a datetime or ISO string), else the latest of all. The
+    result must match the snapshot's SHA-256 and pass integrity_check.
+    Returns the restore point.
+    """
+    points = list_restore_points(backup_dir)
+    if point_id:
+        points = [point for point in points if point['id'] == point_id]
+    elif when:
+        if not isinstance(when, datetime):
+            when = datetime.fromisoformat(when)
+        when = when.isoformat(timespec='microseconds')
+        points = [point for point in points if point['created'] <= when]
+    if not points:
+        raise BackupError('No restore point matches')
+    point = points[-1]
+
+    chain_dir = os.path.join(backup_dir, INCREMENTAL_DIR, point['chain'])
+    links = _links_from_base(_load_links(chain_dir), point['seq'])
+    partial_path = output_path + '.partial'
+    try:
+        _apply_links(links, partial_path)
+        digest = hashlib.sha256()
+        for chunk in _file_chunks(partial_path):
+            digest.update(chunk)
+        if digest.hexdigest() != point['sha256']:
+            raise BackupError(f"Rebuilt database does not match restore point {point['id']}")
+        conn = sqlite3.connect(partial_path)
+        try:
+            verify_snapshot(conn)
+        finally:
+            conn.close()
+        os.replace(partial_path, output_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return point
+
+
+def compact_chains(backup_dir, days_to_keep=30):
+    """Drop restore points older than days_to_keep.
+
+    Chains that ended before the cutoff are deleted once a newer chain
+    exists. In the remaining chains, the links before the cutoff are folded
+    into a single new base, which stands in for the newest of them.
+    Returns counts of deleted chains, folded links and freed bytes.
+    """
+    cutoff = (datetime.now() - timedelta(days=days_to_keep)).isoformat()
+    chains = _chain_dirs(os.path.join(backup_dir, INCREMENTAL_DIR))
+    result = {'deleted_chains': 0, 'folded_links': 0, 'freed_bytes': 0}
+
+    for index, chain_dir in enumerate(chains):
+        links = _load_links(chain_dir)
+        old = [link for link in links if link['created'] < cutoff]
+        if not old:
+            continue
+        size_before = sum(os.path.getsize(os.path.join(chain_dir, name)) for name in os.listdir(chain_dir))
+        if len(old) == len(links) and index < len(chains) - 1:
+            shutil.rmtree(chain_dir)
+            result['deleted_chains'] += 1
+            result['freed_bytes'] += size_before
+            continue
+
+        last_old = old[-1]
+        folded = [link for link in links if link['seq'] < last_old['seq']]
+        if last_old['base'] and not folded:
+            continue
+        if not last_old['base']:
+            spool_path = os.path.join(chain_dir, '.compact.db')
+            try:
+                _apply_links(_links_from_base(links, last_old['seq']), spool_path)
+                page_size, pages = _split_pages(_file_chunks(spool_path))
+                _write_link(chain_dir, last_old['seq'], pages, page_size, last_old['created'])
+            finally:
+                if os.path.exists(spool_path):
+                    os.remove(spool_path)
+        for link in folded:
+            for path in (link['path'], link['path'][:-len('.pages.gz')] + '.json'):
+                if os.path.exists(path):
+                    os.remove(path)
+        result['folded_links'] += len(folded)
+        result['freed_bytes'] += size_before - sum(
+            os.path.getsize(os.path.join(chain_dir, name)) for name in os.listdir(chain_dir))
+    return result
+
+
+# Restores
+#
+# A backup is first streamed into a staging database next to the live one,
+# with decompression in its own thread, then verified, and finally copied
+# into the live database with the backup API. The live file is never
+# replaced, so connections the app holds open stay valid. They see the old
+# contents until the copy commits, and the new contents after that.
+
+RESTORE_QUEUE_CHUNKS = 8
+# Tables any restore must contain
+REQUIRED_TABLES = ('users', 'meals', 'meal_plan')
+
+
+def stream_to_staging(backup_path, staging_path):
+    """Decompress a .db or .db.gz backup into staging_path.
+
+    One thread decompresses while this one writes and hashes.
+    Returns the size and SHA-256 of the database.
+    """
+    chunks = queue.Queue(maxsize=RESTORE_QUEUE_CHUNKS)
+    stop = threading.Event()
+    failure = []
+
+    def read():
+        try:
+            opener = gzip.open if backup_path.endswith('.gz') else open
+            with opener(backup_path, 'rb') as f:
+                while not stop.is_set():
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    chunks.put(chunk)
+        except Exception as e:
+            failure.append(e)
+        finally:
+            chunks.put(None)
+
+    reader = threading.Thread(target=read, name='restore-decompress', daemon=True)
+    reader.start()
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(staging_path, 'wb') as out:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                out.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+    finally:
+        stop.set()
+        # Unblock the reader if it is waiting on a full queue
+        while reader.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        reader.join()
+    if failure:
+        raise BackupError(f'Could not read {backup_path}: {failure[0]}')
+    return {'size': size, 'sha256': digest.hexdigest()}
+
+
+def _row_counts(conn):
+    cursor = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")
+    tables = [row[0] for row in cursor.fetchall()]
+    return {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+
+
+def _table_names(db_path):
+    if not os.path.exists(db_path):
+        return set()
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        return {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")}
+    finally:
+        conn.close()
+
+
+def verify_staging(staging_path, required_tables=REQUIRED_TABLES):
+    """Check a staging database and return its row counts per table.
+
+    The integrity check and the row counts run at the same time on separate
+    connections. Every table in required_tables must be present.
+    """
+    conn = sqlite3.connect(staging_path)
+    try:
+        # Staging is read by plain connections, so it must not be left in WAL mode
+        conn.execute('PRAGMA journal_mode = DELETE')
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f'Backup is not a usable database: {e}')
+    finally:
+        conn.close()
+
+    def check_integrity():
+        conn = sqlite3.connect(staging_path)
+        try:
+            verify_snapshot(conn)
+        finally:
+            conn.close()
+
+    def count_rows():
+        conn = sqlite3.connect(staging_path)
+        try:
+            return _row_counts(conn)
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        integrity = pool.submit(check_integrity)
+        counts = pool.submit(count_rows)
+        integrity.result()
+        counts = counts.result()
+
+    missing = sorted(set(required_tables) - set(counts))
+    if missing:
+        raise BackupError(f"Backup is missing tables: {', '.join(missing)}")
+    return counts
+
+
+def swap_in(staging_path, db_path, timeout=30):
+    """Copy a verified staging database into the live one in a single transaction.
+
+    The meals cache version is moved past its value before the restore, so
+    every worker drops its cached meals and no old ETag matches restored
+    plans. The live database must pass quick_check afterwards. The app may
+    write as soon as the copy commits, so row counts are checked on staging
+    rather than here.
+    """
+    staging = sqlite3.connect(staging_path)
+    live = sqlite3.connect(db_path, timeout=timeout)
+    try:
+        try:
+            previous_version = live.execute('SELECT MAX(version) FROM cache_versions').fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            previous_version = 0
+
+        staging.backup(live)
+
+        try:
+            live.execute('UPDATE cache_versions SET version = MAX(version, ?) + 1', (previous_version,))
+            live.commit()
+        except sqlite3.OperationalError:
+            pass
+        problems = [row[0] for row in live.execute('PRAGMA quick_check')]
+    finally:
+        staging.close()
+        live.close()
+
+    if problems != ['ok']:
+        raise BackupError('Restored database failed quick_check: ' + '; '.join(problems[:5]))
+
+
+def _restore_staged(staging_path, db_path, started, summary, allow_older_schema):
+    # Swapping in a backup that lacks tables the running app already uses
+    # would break it until every worker restarts and upgrades the schema
+    required = set(REQUIRED_TABLES) if allow_older_schema else set(REQUIRED_TABLES) | _table_names(db_path)
+    summary['counts'] = verify_staging(staging_path, required)
+    swap_in(staging_path, db_path)
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def _remove_staging(staging_path):
+    for path in (staging_path, staging_path + '-journal', staging_path + '-wal', staging_path + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def restore_database(backup_path, db_path, allow_older_schema=False):
+    """Restore a .db or .db.gz backup into db_path, which may be in use.
+
+    Unless allow_older_schema is set, the backup must have every table the
+    live database has. Returns the backup's size and SHA-256, the row counts
+    of the restored database and the time taken.
+    """
+    if not os.path.exists(backup_path):
+        raise BackupError(f'Backup not found: {backup_path}')
+    started = time.perf_counter()
+    staging_path = db_path + '.restore'
+    try:
+        summary = stream_to_staging(backup_path, staging_path)
+        return _restore_staged(staging_path, db_path, started, summary, allow_older_schema)
+    finally:
+        _remove_staging(staging_path)
+
+
+def restore_point_in_time(backup_dir, db_path, point_id=None, when=None, allow_older_schema=False):
+    """Rebuild a restore point of the incremental backups and restore it into db_path"""
+    started = time.perf_counter()
+    staging_path = db_path + '.restore'
+    try:
+        point = rebuild_restore_point(backup_dir, staging_path, point_id=point_id, when=when)
+        return _restore_staged(staging_path, db_path, started, {'point': point}, allow_older_schema)
+    finally:
+        _remove_staging(staging_path)
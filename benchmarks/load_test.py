@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Multi-user Load Generator for Meal Planner
+Logs in synthetic users (see seed_data.py) and replays weighted journeys:
+browsing meals, editing calendar slots, generating shopping lists and
+viewing friends. Concurrency is ramped through stages, and each stage
+reports throughput, tail latency and error rates per endpoint. Database
+lock timeouts are answered with 503 by the app and counted as busy.
+
+Uses only the standard library, so it can run from any machine.
+
+Examples:
+    python benchmarks/load_test.py --start --scale small --workers 4
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --stages 1,4,16 --duration 60
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from run_benchmarks import DATA_DIR, percentile
+from seed_data import BENCH_PASSWORD, SCALES, build_database
+
+SEARCH_TERMS = ['chicken', 'rice', 'pasta', 'tomato', 'egg', 'cheese', 'beef', 'tofu']
+FRIEND_ID_RE = re.compile(r'id="monthly-(\d+)"')
+
+
+class Session:
+    """One synthetic user with its own cookies"""
+
+    def __init__(self, base_url, username, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.rng = random.Random(username)
+        self.community_ids = []
+        self.friend_ids = []
+
+    def send(self, method, path, json_body=None, form=None):
+        """Return (status, body, seconds). Network failures have status 0."""
+        data = None
+        headers = {}
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode()
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                body = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            status = e.code
+        except (urllib.error.URLError, OSError):
+            body = b''
+            status = 0
+        return status, body, time.perf_counter() - started
+
+    def login(self):
+        status, body, _ = self.send('POST', '/login', form={'username': self.username, 'password': BENCH_PASSWORD})
+        # A successful login redirects to the dashboard
+        return status == 200 and b'Invalid username or password' not in body
+
+
+class Stats:
+    """Latency and outcome counts per endpoint, shared by the user threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, status, seconds):
+        if status == 503:
+            outcome = 'busy'
+        elif status == 0:
+            outcome = 'network'
+        elif status >= 500:
+            outcome = 'server_error'
+        elif status >= 400:
+            outcome = 'client_error'
+        else:
+            outcome = 'ok'
+        with self.lock:
+            entry = self.endpoints.setdefault(endpoint, {'latencies': [], 'outcomes': {}})
+            entry['latencies'].append(seconds * 1000)
+            entry['outcomes'][outcome] = entry['outcomes'].get(outcome, 0) + 1
+
+    def summary(self, elapsed):
+        def describe(latencies, outcomes):
+            latencies = sorted(latencies)
+            total = len(latencies)
+            return {
+                'requests': total,
+                'throughput_rps': round(total / elapsed, 2),
+                'p50_ms': round(percentile(latencies, 50), 2),
+                'p95_ms': round(percentile(latencies, 95), 2),
+                'p99_ms': round(percentile(latencies, 99), 2),
+                'max_ms': round(latencies[-1], 2),
+                'busy_rate': round(outcomes.get('busy', 0) / total, 4),
+                'error_rate': round((total - outcomes.get('ok', 0)) / total, 4),
+                'outcomes': outcomes,
+            }
+
+        with self.lock:
+            endpoints = {name: describe(entry['latencies'], entry['outcomes'])
+                         for name, entry in sorted(self.endpoints.items())}
+            all_latencies = [value for entry in self.endpoints.values() for value in entry['latencies']]
+            all_outcomes = {}
+            for entry in self.endpoints.values():
+                for outcome, count in entry['outcomes'].items():
+                    all_outcomes[outcome] = all_outcomes.get(outcome, 0) + count
+        overall = describe(all_latencies, all_outcomes) if all_latencies else {'requests': 0}
+        return {'overall': overall, 'endpoints': endpoints}
+
+
+# Journeys: the requests one user sends for a task, recorded under endpoint
+# labels with ids replaced by placeholders
+
+def _call(session, stats, endpoint, method, path, json_body=None):
+    status, body, seconds = session.send(method, path, json_body)
+    stats.record(endpoint, status, seconds)
+    return status, body
+
+
+def browse_meals(session, stats):
+    _call(session, stats, '/meals', 'GET', '/meals')
+    status, body = _call(session, stats, '/community_meals', 'GET', '/community_meals')
+    if status == 200:
+        data = json.loads(body)
+        session.community_ids = [meal['id'] for meal in data['meals']] or session.community_ids
+        if data.get('next_cursor'):
+            _call(session, stats, '/community_meals', 'GET',
+                  '/community_meals?cursor=' + urllib.parse.quote(data['next_cursor']))
+    _call(session, stats, '/community_meals?q', 'GET',
+          '/community_meals?q=' + session.rng.choice(SEARCH_TERMS))
+    if session.community_ids:
+        meal_id = session.rng.choice(session.community_ids)
+        _call(session, stats, '/get_meal_details/<id>', 'GET', f'/get_meal_details/{meal_id}')
+        if session.rng.random() < 0.3:
+            _call(session, stats, '/toggle_favorite/<id>', 'POST', f'/toggle_favorite/{meal_id}',
+                  {'favorited': session.rng.random() < 0.5})
+
+
+def edit_calendar(session, stats):
+    today = date.today()
+    _call(session, stats, '/calendar', 'GET', '/calendar')
+    _call(session, stats, '/api/plan/<year>/<month>', 'GET', f'/api/plan/{today.year}/{today.month}')
+    if not session.community_ids:
+        return
+    rng = session.rng
+    day = today + timedelta(days=rng.randint(0, 27))
+    slots = [{'date': (day + timedelta(days=offset)).isoformat(),
+              'meal_type': rng.choice(('breakfast', 'lunch', 'dinner')),
+              'meal_id': rng.choice(session.community_ids)}
+             for offset in range(rng.randint(1, 3))]
+    _call(session, stats, '/save_meal_plan_batch', 'POST', '/save_meal_plan_batch', {'slots': slots})
+    if rng.random() < 0.3:
+        _call(session, stats, '/delete_planned_meal', 'POST', '/delete_planned_meal',
+              {'date': slots[0]['date'], 'meal_type': slots[0]['meal_type']})
+
+
+def shop(session, stats):
+    _call(session, stats, '/generate_shopping_list', 'POST', '/generate_shopping_list',
+          {'period': session.rng.choice(('week', 'month'))})
+    _call(session, stats, '/shopping_list', 'GET', '/shopping_list')
+    _call(session, stats, '/set_purchased', 'POST', '/set_purchased', {'is_purchased': session.rng.random() < 0.5})
+
+
+def view_friends(session, stats):
+    status, body = _call(session, stats, '/friends', 'GET', '/friends')
+    if status == 200:
+        session.friend_ids = [int(friend_id) for friend_id in FRIEND_ID_RE.findall(body.decode(errors='replace'))]
+    if session.friend_ids:
+        friend_id = session.rng.choice(session.friend_ids)
+        _call(session, stats, '/friend_meals/<id>', 'GET', f'/friend_meals/{friend_id}')
+
+
+JOURNEYS = {
+    'browse_meals': (browse_meals, 40),
+    'edit_calendar': (edit_calendar, 25),
+    'shop': (shop, 20),
+    'view_friends': (view_friends, 15),
+}
+
+
+def run_stage(sessions, duration, think_time):
+    """Run every session in its own thread for duration seconds"""
+    stats = Stats()
+    names = list(JOURNEYS)
+    weights = [JOURNEYS[name][1] for name in names]
+    deadline = time.monotonic() + duration
+
+    def user(session):
+        while time.monotonic() < deadline:
+            journey = JOURNEYS[session.rng.choices(names, weights)[0]][0]
+            journey(session, stats)
+            if think_time:
+                time.sleep(session.rng.expovariate(1 / think_time))
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=user, args=(session,), daemon=True) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats.summary(time.monotonic() - started)
+
+
+def start_server(scale, workers, threads, port, reseed):
+    """Start gunicorn as in the Procfile, on a fresh copy of a seeded database"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    seed_path = os.path.join(DATA_DIR, f'{scale}.db')
+    if reseed or not os.path.exists(seed_path):
+        if not build_database(seed_path, scale):
+            raise RuntimeError(f'Could not build the {scale} database')
+    work_path = os.path.join(DATA_DIR, f'{scale}.load.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(work_path + suffix):
+            os.remove(work_path + suffix)
+    shutil.copyfile(seed_path, work_path)
+
+    command = [sys.executable, '-m', 'gunicorn', 'planner:app', '--workers', str(workers),
+               '--threads', str(threads), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    print(f"🚀 Starting gunicorn with {workers} worker(s) x {threads} thread(s) on port {port}")
+    server = subprocess.Popen(command, cwd=ROOT_DIR, env=dict(os.environ, MEAL_PLANNER_DB=work_path))
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(600):
+        if server.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            urllib.request.urlopen(url + '/login', timeout=1).close()
+            return server, url
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start within 5 minutes')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay weighted user journeys against a running Meal Planner.')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='server to test (default: %(default)s)')
+    parser.add_argument('--start', action='store_true', help='start a local gunicorn on a seeded database')
+    parser.add_argument('--scale', choices=SCALES, default='small', help='data size with --start (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='gunicorn workers with --start (default: %(default)s)')
+    parser.add_argument('--threads', type=int, default=1, help='threads per gunicorn worker (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=8765, help='port with --start (default: %(default)s)')
+    parser.add_argument('--reseed', action='store_true', help='rebuild the seeded database with --start')
+    parser.add_argument('--stages', default='1,2,4,8,16', help='concurrent users per stage (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per stage (default: %(default)s)')
+    parser.add_argument('--think-time', type=float, default=0.0,
+                        help='mean pause in seconds between journeys (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=30, help='request timeout in seconds (default: %(default)s)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    try:
+        stages = [int(stage) for stage in args.stages.split(',')]
+    except ValueError:
+        parser.error('stages must be a comma separated list of numbers')
+    if not stages or min(stages) < 1 or args.duration <= 0:
+        parser.error('stages and duration must be positive')
+
+    server = None
+    url = args.url
+    if args.start:
+        server, url = start_server(args.scale, args.workers, args.threads, args.port, args.reseed)
+
+    try:
+        users = max(stages)
+        print(f"🔑 Logging in {users} synthetic user(s) at {url}")
+        sessions = [Session(url, f'bench_user_{n}', args.timeout) for n in range(1, users + 1)]
+        failed = [session.username for session in sessions if not session.login()]
+        if failed:
+            print(f"❌ Could not log in as {', '.join(failed[:5])}"
+                  f"{' ...' if len(failed) > 5 else ''}; seed the server with benchmarks/seed_data.py")
+            sys.exit(1)
+
+        results = {'url': url, 'duration': args.duration, 'think_time': args.think_time, 'stages': []}
+        if args.start:
+            results['server'] = {'scale': args.scale, 'workers': args.workers, 'threads': args.threads}
+        for concurrency in stages:
+            print(f"\n📈 {concurrency} concurrent user(s) for {args.duration:g}s")
+            summary = run_stage(sessions[:concurrency], args.duration, args.think_time)
+            summary['concurrency'] = concurrency
+            results['stages'].append(summary)
+
+            overall = summary['overall']
+            if not overall['requests']:
+                print("  no requests completed")
+                continue
+            print(f"  {overall['throughput_rps']:.1f} req/s  p50 {overall['p50_ms']:.1f} ms  "
+                  f"p95 {overall['p95_ms']:.1f} ms  p99 {overall['p99_ms']:.1f} ms  "
+                  f"busy {overall['busy_rate']:.2%}  errors {overall['error_rate']:.2%}")
+            for endpoint, entry in summary['endpoints'].items():
+                print(f"    {endpoint:28} {entry['requests']:6d}  p95 {entry['p95_ms']:8.1f} ms  "
+                      f"p99 {entry['p99_ms']:8.1f} ms  busy {entry['busy_rate']:6.2%}  errors {entry['error_rate']:6.2%}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    output = args.output
+    if output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Results saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
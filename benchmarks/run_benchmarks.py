@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Route Benchmarks for Meal Planner
+Drives every route in planner.py through the Flask test client against
+synthetic databases built by seed_data.py, and reports p50/p95/p99 latency,
+SQL statements per request and peak memory per request. Each scale runs in
+its own process on a fresh copy of the seeded database.
+
+Examples:
+    python benchmarks/run_benchmarks.py                         # tiny and small
+    python benchmarks/run_benchmarks.py --scales medium,large --iterations 100
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/before.json
+"""
+
+import argparse
+import json
+import math
+import os
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from seed_data import BENCH_PASSWORD, SCALES, build_database
+
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+WARMUP = 3
+
+# Endpoints that are not benchmarked
+SKIPPED_ENDPOINTS = {'static'}
+
+
+class Route:
+    """One benchmarked request.
+
+    url, json, data and headers may be callables taking the context. before
+    runs untimed ahead of each request and its result is ctx.fixture; after
+    runs untimed with the response.
+    """
+
+    def __init__(self, label, method, url, json=None, data=None, headers=None,
+                 before=None, after=None, iterations=None):
+        self.label = label
+        self.method = method
+        self.url = url
+        self.json = json
+        self.data = data
+        self.headers = headers
+        self.before = before
+        self.after = after
+        self.iterations = iterations
+
+    def request(self, ctx):
+        resolve = lambda value: value(ctx) if callable(value) else value
+        kwargs = {}
+        for name in ('json', 'data', 'headers'):
+            value = resolve(getattr(self, name))
+            if value is not None:
+                kwargs[name] = value
+        return resolve(self.url), kwargs
+
+
+# Untimed fixtures, written straight to the database
+
+def _insert(ctx, sql, params):
+    cursor = ctx.db.execute(sql, params)
+    ctx.db.commit()
+    return cursor.lastrowid
+
+
+def _new_meal(ctx):
+    return _insert(ctx, '''
+        INSERT INTO meals (name, ingredients, instructions, prep_time, cook_time, servings, category, user_id, is_community)
+        VALUES (?, '1 cup rice, 2 eggs', 'Cook.', 5, 10, 2, 'lunch', ?, FALSE)
+    ''', (f'Bench Meal {next(ctx.serial)}', ctx.user_id))
+
+
+def _new_ingredient(ctx):
+    return _insert(ctx, '''
+        INSERT INTO ingredients (name, quantity, unit, category, user_id) VALUES ('Bench Flour', 1, 'kg', 'Pantry', ?)
+    ''', (ctx.user_id,))
+
+
+def _new_shopping_item(ctx):
+    return _insert(ctx, '''
+        INSERT INTO shopping_list (name, quantity, unit, category, user_id) VALUES ('Bench Milk', 1, 'l', 'General', ?)
+    ''', (ctx.user_id,))
+
+
+def _forget_stranger(ctx, response=None):
+    ctx.db.execute('DELETE FROM friendships WHERE (user_id = ? AND friend_id = ?) OR (user_id = ? AND friend_id = ?)',
+                   (ctx.user_id, ctx.fixture, ctx.fixture, ctx.user_id))
+    ctx.db.commit()
+
+
+def _stranger(ctx, status=None):
+    """A user with no friendship to the benchmark user, optionally given one"""
+    ctx.fixture = ctx.strangers[next(ctx.serial) % len(ctx.strangers)]
+    _forget_stranger(ctx)
+    if status == 'pending':
+        ctx.db.execute("INSERT INTO friendships (user_id, friend_id, status) VALUES (?, ?, 'pending')",
+                       (ctx.fixture, ctx.user_id))
+    elif status == 'accepted':
+        ctx.db.executemany("INSERT INTO friendships (user_id, friend_id, status) VALUES (?, ?, 'accepted')",
+                           [(ctx.fixture, ctx.user_id), (ctx.user_id, ctx.fixture)])
+    ctx.db.commit()
+    return ctx.fixture
+
+
+def _planned_slot(ctx):
+    day = (date(2099, 1, 1) + timedelta(days=next(ctx.serial) % 3000)).isoformat()
+    _insert(ctx, '''
+        INSERT OR REPLACE INTO meal_plan (user_id, date, meal_type, meal_id) VALUES (?, ?, 'dinner', ?)
+    ''', (ctx.user_id, day, ctx.community_ids[0]))
+    return day
+
+
+def _plan_etag(ctx):
+    return ctx.client.get(f'/api/plan/{ctx.today.year}/{ctx.today.month}').headers.get('ETag')
+
+
+def _login(ctx, response=None):
+    ctx.client.post('/login', data={'username': ctx.username, 'password': BENCH_PASSWORD})
+
+
+def _community_id(ctx):
+    return ctx.community_ids[next(ctx.serial) % len(ctx.community_ids)]
+
+
+def _week_slots(ctx):
+    offset = next(ctx.serial) % 300
+    return {'slots': [{'date': (ctx.today + timedelta(days=offset + day)).isoformat(), 'meal_type': meal_type,
+                       'meal_id': ctx.community_ids[(day + offset) % len(ctx.community_ids)]}
+                      for day in range(7) for meal_type in ('breakfast', 'lunch', 'dinner')]}
+
+
+def _next_month(ctx):
+    month_index = ctx.today.year * 12 + ctx.today.month
+    return {'year': month_index // 12, 'month': month_index % 12 + 1, 'seed': next(ctx.serial)}
+
+
+ROUTES = [
+    Route('index', 'GET', '/'),
+    Route('register', 'POST', '/register', iterations=5,
+          data=lambda ctx: {'username': f'bench_new_{os.getpid()}_{next(ctx.serial)}',
+                            'email': f'bench_new_{os.getpid()}_{next(ctx.serial)}@example.com',
+                            'password': BENCH_PASSWORD}),
+    Route('login', 'POST', '/login', iterations=5,
+          data=lambda ctx: {'username': ctx.username, 'password': BENCH_PASSWORD}),
+    Route('logout', 'GET', '/logout', iterations=5, after=_login),
+    Route('dashboard', 'GET', '/dashboard'),
+    Route('meals', 'GET', '/meals'),
+    Route('add_meal', 'POST', '/add_meal',
+          json=lambda ctx: {'name': f'Bench Added {next(ctx.serial)}', 'ingredients': '200g pasta, 2 tomatoes, 1 tbsp olive oil',
+                            'instructions': 'Cook.', 'prep_time': 5, 'cook_time': 10, 'servings': 2,
+                            'category': 'dinner', 'is_community': False}),
+    Route('delete_meal', 'DELETE', lambda ctx: f'/delete_meal/{ctx.fixture}', before=_new_meal),
+    Route('add_to_my_meals', 'POST', lambda ctx: f'/add_to_my_meals/{_community_id(ctx)}'),
+    Route('community_meals', 'GET', '/community_meals'),
+    Route('community_meals?q', 'GET', '/community_meals?q=chicken%20rice'),
+    Route('community_meals?sort=popular', 'GET', '/community_meals?sort=popular'),
+    Route('community_meals?sort=trending', 'GET', '/community_meals?sort=trending'),
+    Route('my_meals/personal', 'GET', '/my_meals/personal'),
+    Route('my_meals/favorites', 'GET', '/my_meals/favorites'),
+    Route('makeable_meals', 'GET', '/makeable_meals'),
+    Route('friends', 'GET', '/friends'),
+    Route('add_friend', 'POST', '/add_friend', before=_stranger, after=_forget_stranger,
+          json=lambda ctx: {'friend': str(ctx.fixture)}),
+    Route('accept_friend', 'POST', lambda ctx: f'/accept_friend/{ctx.fixture}',
+          before=lambda ctx: _stranger(ctx, 'pending'), after=_forget_stranger),
+    Route('remove_friend', 'POST', lambda ctx: f'/remove_friend/{ctx.fixture}',
+          before=lambda ctx: _stranger(ctx, 'accepted')),
+    Route('friend_meals', 'GET', lambda ctx: f'/friend_meals/{ctx.friend_id}'),
+    Route('ingredients', 'GET', '/ingredients'),
+    Route('add_ingredient', 'POST', '/add_ingredient',
+          json={'name': 'Bench Rice', 'quantity': 1, 'unit': 'kg', 'category': 'Pantry', 'expiry_date': None}),
+    Route('delete_ingredient', 'DELETE', lambda ctx: f'/delete_ingredient/{ctx.fixture}', before=_new_ingredient),
+    Route('calendar', 'GET', '/calendar'),
+    Route('api_plan', 'GET', lambda ctx: f'/api/plan/{ctx.today.year}/{ctx.today.month}'),
+    Route('api_plan (304)', 'GET', lambda ctx: f'/api/plan/{ctx.today.year}/{ctx.today.month}',
+          before=_plan_etag, headers=lambda ctx: {'If-None-Match': ctx.fixture}),
+    Route('get_day_meals', 'GET', lambda ctx: f'/get_day_meals/{ctx.today.isoformat()}'),
+    Route('get_meal_details', 'GET', lambda ctx: f'/get_meal_details/{_community_id(ctx)}'),
+    Route('save_meal_plan', 'POST', '/save_meal_plan',
+          json=lambda ctx: {'date': (ctx.today + timedelta(days=next(ctx.serial) % 300)).isoformat(),
+                            'meal_type': 'lunch', 'meal_id': _community_id(ctx)}),
+    Route('save_meal_plan_batch', 'POST', '/save_meal_plan_batch', json=_week_slots),
+    Route('delete_planned_meal', 'POST', '/delete_planned_meal', before=_planned_slot,
+          json=lambda ctx: {'date': ctx.fixture, 'meal_type': 'dinner'}),
+    Route('toggle_favorite', 'POST', lambda ctx: f'/toggle_favorite/{_community_id(ctx)}'),
+    Route('get_favorites', 'GET', '/get_favorites'),
+    Route('get_meal_details_by_name', 'POST', '/get_meal_details_by_name',
+          json=lambda ctx: {'meal_name': ctx.personal_meal, 'user_id': ctx.user_id}),
+    Route('shopping_list', 'GET', '/shopping_list'),
+    Route('generate_shopping_list', 'POST', '/generate_shopping_list', json={'period': 'week'}),
+    Route('add_shopping_item', 'POST', '/add_shopping_item',
+          json={'name': 'Bench Bread', 'quantity': 1, 'unit': 'loaf', 'category': 'Bakery'}),
+    Route('toggle_purchased', 'POST', lambda ctx: f'/toggle_purchased/{ctx.fixture}', before=_new_shopping_item),
+    Route('set_purchased', 'POST', '/set_purchased', json={'is_purchased': False}),
+    Route('mark_as_purchased', 'POST', lambda ctx: f'/mark_as_purchased/{ctx.fixture}', before=_new_shopping_item),
+    Route('delete_shopping_item', 'DELETE', lambda ctx: f'/delete_shopping_item/{ctx.fixture}',
+          before=_new_shopping_item),
+    Route('auto_generate_plan', 'POST', '/auto_generate_plan', json=_next_month),
+    Route('db_stats', 'GET', '/db_stats'),
+    Route('cache_stats', 'GET', '/cache_stats'),
+]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+
+def _context(client, db_path):
+    from database import connect
+
+    db = connect(db_path)
+    users = db.execute("SELECT COUNT(*) FROM users WHERE username LIKE 'bench_user_%'").fetchone()[0]
+    user_id, username = db.execute('''
+        SELECT id, username FROM users WHERE username LIKE 'bench_user_%'
+        ORDER BY id LIMIT 1 OFFSET ?
+    ''', (users // 2,)).fetchone()
+    community_ids = [row[0] for row in db.execute(
+        'SELECT id FROM meals WHERE is_community = TRUE ORDER BY id LIMIT 200')]
+    friend_id = db.execute("SELECT friend_id FROM friendships WHERE user_id = ? AND status = 'accepted'",
+                           (user_id,)).fetchone()
+    personal_meal = db.execute('SELECT name FROM meals WHERE user_id = ? AND is_community = FALSE',
+                               (user_id,)).fetchone()
+    # Users with no friendship either way, for the friend request routes
+    strangers = [row[0] for row in db.execute('''
+        SELECT id FROM users
+        WHERE id != ? AND id NOT IN (SELECT friend_id FROM friendships WHERE user_id = ?)
+                      AND id NOT IN (SELECT user_id FROM friendships WHERE friend_id = ?)
+        ORDER BY id LIMIT 1000
+    ''', (user_id, user_id, user_id))]
+    counter = iter(range(1, 10 ** 9))
+    return SimpleNamespace(client=client, db=db, user_id=user_id, username=username,
+                           community_ids=community_ids, friend_id=friend_id[0] if friend_id else 0,
+                           personal_meal=personal_meal[0] if personal_meal else '',
+                           strangers=strangers, serial=counter, today=date.today(), fixture=None)
+
+
+def _send(ctx, route):
+    """Prepare and send one request, returning (url, response, seconds, statements)"""
+    ctx.fixture = route.before(ctx) if route.before else None
+    url, kwargs = route.request(ctx)
+    ctx.statements = 0
+    started = time.perf_counter()
+    response = ctx.client.open(url, method=route.method, **kwargs)
+    elapsed = time.perf_counter() - started
+    response.close()
+    if route.after:
+        route.after(ctx, response)
+    return url, response, elapsed, ctx.statements
+
+
+def run_worker(db_path, iterations, memory_iterations):
+    """Benchmark every route against db_path in this process and return the results"""
+    started = time.perf_counter()
+    import planner  # runs init_db against MEAL_PLANNER_DB
+    from database import get_db
+    init_seconds = time.perf_counter() - started
+
+    # Errors are counted as 500s instead of stopping the run
+    app = planner.app
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    client = app.test_client()
+    ctx = _context(client, db_path)
+
+    def count_statement(statement):
+        # Trigger bodies are reported as comments; only count real statements
+        if not statement.startswith('--'):
+            ctx.statements += 1
+
+    @app.before_request
+    def trace_statements():
+        get_db().set_trace_callback(count_statement)
+
+    _login(ctx)
+    adapter = app.url_map.bind('localhost')
+    results = {}
+    for route in ROUTES:
+        count = min(iterations, route.iterations or iterations)
+        endpoint = None
+        timings = []
+        statements = []
+        statuses = {}
+        for index in range(WARMUP + count):
+            url, response, elapsed, executed = _send(ctx, route)
+            if endpoint is None:
+                endpoint = adapter.match(url.split('?')[0], method=route.method)[0]
+            if index >= WARMUP:
+                timings.append(elapsed * 1000)
+                statements.append(executed)
+                statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+        timings.sort()
+        results[route.label] = {
+            'method': route.method,
+            'endpoint': endpoint,
+            'requests': count,
+            'status': statuses,
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'max_ms': round(timings[-1], 3),
+            'queries_per_request': round(sum(statements) / len(statements), 2),
+        }
+        print(f"  {route.label:32} p50 {results[route.label]['p50_ms']:8.2f} ms  "
+              f"p95 {results[route.label]['p95_ms']:8.2f} ms  "
+              f"{results[route.label]['queries_per_request']:6.1f} queries", file=sys.stderr)
+
+    # A separate pass, since tracing allocations slows every request down
+    tracemalloc.start()
+    for route in ROUTES:
+        peak = 0
+        for _ in range(min(memory_iterations, route.iterations or memory_iterations)):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            _send(ctx, route)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+        results[route.label]['peak_memory_kb'] = round(peak / 1024, 1)
+    tracemalloc.stop()
+
+    covered = {result['endpoint'] for result in results.values()}
+    missing = sorted(rule.endpoint for rule in app.url_map.iter_rules()
+                     if rule.endpoint not in covered and rule.endpoint not in SKIPPED_ENDPOINTS)
+    ctx.db.close()
+    return {
+        'init_seconds': round(init_seconds, 3),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'routes': results,
+        'not_benchmarked': missing,
+    }
+
+
+def _revision():
+    """The git revision being benchmarked, marked if the tree has changes"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return revision + ('-dirty' if dirty else '')
+
+
+def run_scale(scale, iterations, memory_iterations, reseed):
+    """Seed (once) and benchmark one scale in a child process"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    seed_path = os.path.join(DATA_DIR, f'{scale}.db')
+    if reseed or not os.path.exists(seed_path):
+        if not build_database(seed_path, scale):
+            raise RuntimeError(f'Could not build the {scale} database')
+
+    # Routes write, so every run starts from an untouched copy
+    work_path = os.path.join(DATA_DIR, f'{scale}.work.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(work_path + suffix):
+            os.remove(work_path + suffix)
+    shutil.copyfile(seed_path, work_path)
+
+    print(f"\n🚀 Benchmarking '{scale}' ({iterations} requests per route)")
+    env = dict(os.environ, MEAL_PLANNER_DB=work_path)
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', work_path,
+                                '--iterations', str(iterations), '--memory-iterations', str(memory_iterations)],
+                               cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"The '{scale}' benchmark failed")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['scale'] = dict(SCALES[scale])
+    return result
+
+
+def compare(previous, current):
+    """Print how p95 latency and queries per request changed per route"""
+    print(f"\n📊 Compared with {previous['revision']} ({previous['timestamp']})")
+    for scale, result in current['scales'].items():
+        before = previous['scales'].get(scale)
+        if not before:
+            continue
+        print(f"\n  {scale}")
+        for label, route in result['routes'].items():
+            old = before['routes'].get(label)
+            if not old:
+                print(f"    {label:32} new")
+                continue
+            change = (route['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 if old['p95_ms'] else 0.0
+            marker = '🔴' if change > 10 else '🟢' if change < -10 else '  '
+            print(f"    {marker} {label:32} p95 {old['p95_ms']:8.2f} -> {route['p95_ms']:8.2f} ms ({change:+6.1f}%)"
+                  f"  queries {old['queries_per_request']:.1f} -> {route['queries_per_request']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every Meal Planner route at several data scales.')
+    parser.add_argument('--scales', default='tiny,small',
+                        help=f"comma separated scales from {', '.join(SCALES)} (default: %(default)s)")
+    parser.add_argument('--iterations', type=int, default=50, help='timed requests per route (default: %(default)s)')
+    parser.add_argument('--memory-iterations', type=int, default=3,
+                        help='requests per route traced for peak memory (default: %(default)s)')
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<time>_<revision>.json)')
+    parser.add_argument('--compare', metavar='RESULTS', help='earlier results file to compare against')
+    parser.add_argument('--reseed', action='store_true', help='rebuild the seeded databases')
+    parser.add_argument('--worker', metavar='DB', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # Child process: progress goes to stderr, the results to stdout
+        print(json.dumps(run_worker(args.worker, args.iterations, args.memory_iterations)))
+        return
+
+    scales = [scale.strip() for scale in args.scales.split(',') if scale.strip()]
+    unknown = [scale for scale in scales if scale not in SCALES]
+    if unknown or args.iterations < 1 or args.memory_iterations < 0:
+        parser.error(f"unknown scale(s): {', '.join(unknown)}" if unknown else 'iterations must be positive')
+
+    revision = _revision()
+    results = {
+        'revision': revision,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'sqlite': sqlite3.sqlite_version,
+        'iterations': args.iterations,
+        'scales': {},
+    }
+    for scale in scales:
+        results['scales'][scale] = run_scale(scale, args.iterations, args.memory_iterations, args.reseed)
+        missing = results['scales'][scale]['not_benchmarked']
+        if missing:
+            print(f"⚠️  Routes without a benchmark: {', '.join(missing)}")
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✅ Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Synthetic Data Seeder for Meal Planner Benchmarks
+Builds databases at a given scale on top of MealPlannerDB: the regular
+tables, indexes and sample data, then users, meals, plans, favorites,
+pantries, shopping lists and friendships inserted in bulk.
+
+Examples:
+    python benchmarks/seed_data.py --scale small
+    python benchmarks/seed_data.py --scale large --db /tmp/large.db
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_setup import MealPlannerDB
+
+# Every synthetic user signs in with this password
+BENCH_PASSWORD = 'bench123'
+
+# users, community meals, personal meals per user, planned days per user
+# (three slots a day, ending today), favorites, pantry items, shopping list
+# items and accepted friends per user
+SCALES = {
+    'tiny': dict(users=10, community_meals=50, personal_meals=2, plan_days=30,
+                 favorites=5, ingredients=10, shopping_items=10, friends=3),
+    'small': dict(users=1_000, community_meals=500, personal_meals=3, plan_days=90,
+                  favorites=8, ingredients=15, shopping_items=10, friends=5),
+    'medium': dict(users=10_000, community_meals=2_000, personal_meals=3, plan_days=90,
+                   favorites=8, ingredients=15, shopping_items=10, friends=5),
+    'large': dict(users=100_000, community_meals=5_000, personal_meals=3, plan_days=60,
+                  favorites=8, ingredients=15, shopping_items=10, friends=5),
+}
+
+CATEGORIES = ['breakfast', 'lunch', 'dinner', 'snack', 'dessert', 'Italian', 'Asian', 'Mexican']
+INGREDIENT_NAMES = [
+    ('chicken breast', 'g'), ('rice', 'cup'), ('pasta', 'g'), ('tomatoes', ''), ('onion', ''),
+    ('garlic', 'clove'), ('olive oil', 'tbsp'), ('eggs', ''), ('milk', 'cup'), ('flour', 'cup'),
+    ('butter', 'tbsp'), ('cheese', 'g'), ('beef', 'lb'), ('potatoes', ''), ('carrots', ''),
+    ('spinach', 'g'), ('salt', 'tsp'), ('black pepper', 'tsp'), ('sugar', 'tbsp'), ('lemon', ''),
+    ('soy sauce', 'tbsp'), ('ginger', 'tsp'), ('bell pepper', ''), ('mushrooms', 'g'),
+    ('yogurt', 'cup'), ('oats', 'cup'), ('banana', ''), ('tofu', 'g'), ('beans', 'can'), ('corn', 'cup'),
+]
+PANTRY_CATEGORIES = ['Produce', 'Dairy', 'Meat', 'Pantry', 'Frozen', 'Spices']
+BATCH_SIZE = 50_000
+
+
+def _batches(rows, size=BATCH_SIZE):
+    """Yield lists of up to size rows from an iterable"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BenchmarkDB(MealPlannerDB):
+    """MealPlannerDB with a bulk seeder for synthetic data at scale"""
+
+    def __init__(self, db_path, seed=42):
+        super().__init__(db_path)
+        self.rng = random.Random(seed)
+
+    def connect(self):
+        if not super().connect():
+            return False
+        # Nothing else uses the file while it is built
+        self.cursor.execute('PRAGMA journal_mode = OFF')
+        self.cursor.execute('PRAGMA synchronous = OFF')
+        self.cursor.execute('PRAGMA cache_size = -200000')
+        return True
+
+    def _ingredient_text(self):
+        rng = self.rng
+        parts = []
+        for name, unit in rng.sample(INGREDIENT_NAMES, rng.randint(3, 8)):
+            if unit == 'g':
+                parts.append(f"{rng.choice([100, 200, 250, 500])}g {name}")
+            elif unit:
+                parts.append(f"{rng.randint(1, 4)} {unit} {name}")
+            else:
+                parts.append(f"{rng.randint(1, 4)} {name}")
+        return ', '.join(parts)
+
+    def _meal_rows(self, count, user_ids, is_community, prefix):
+        rng = self.rng
+        for index in range(count):
+            user_id = user_ids[index % len(user_ids)] if user_ids else None
+            yield (f'{prefix} {index + 1}', self._ingredient_text(), 'Mix, cook and serve.',
+                   rng.randint(5, 30), rng.randint(0, 60), rng.randint(1, 6),
+                   rng.choice(CATEGORIES), user_id, is_community)
+
+    def _insert(self, sql, rows):
+        total = 0
+        for batch in _batches(rows):
+            self.cursor.executemany(sql, batch)
+            total += len(batch)
+        return total
+
+    def insert_bulk_data(self, users, community_meals, personal_meals, plan_days,
+                         favorites, ingredients, shopping_items, friends):
+        """Insert the sample data, then synthetic rows for the given scale"""
+        if not self.insert_sample_data():
+            return False
+
+        rng = self.rng
+        started = time.perf_counter()
+        try:
+            password_hash = generate_password_hash(BENCH_PASSWORD)
+            self._insert('INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+                         ((f'bench_user_{n}', f'bench_user_{n}@example.com', password_hash)
+                          for n in range(1, users + 1)))
+            self.cursor.execute("SELECT id FROM users WHERE username LIKE 'bench_user_%' ORDER BY id")
+            user_ids = [row[0] for row in self.cursor.fetchall()]
+            print(f"👥 {len(user_ids)} users")
+
+            meal_sql = '''
+                INSERT INTO meals (name, ingredients, instructions, prep_time, cook_time, servings, category, user_id, is_community)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            '''
+            self._insert(meal_sql, self._meal_rows(community_meals, user_ids[:max(1, users // 10)],
+                                                   True, 'Community Meal'))
+            self._insert(meal_sql, self._meal_rows(personal_meals * users, user_ids, False, 'Personal Meal'))
+            self.cursor.execute('SELECT id FROM meals WHERE is_community = TRUE')
+            community_ids = [row[0] for row in self.cursor.fetchall()]
+            self.cursor.execute('SELECT user_id, id FROM meals WHERE is_community = FALSE AND user_id IS NOT NULL')
+            personal_ids = {}
+            for user_id, meal_id in self.cursor.fetchall():
+                personal_ids.setdefault(user_id, []).append(meal_id)
+            print(f"🍽️  {len(community_ids)} community and {personal_meals * users} personal meals")
+
+            first_day = date.today() - timedelta(days=plan_days - 1)
+            days = [(first_day + timedelta(days=offset)).isoformat() for offset in range(plan_days)]
+
+            def plan_rows():
+                for user_id in user_ids:
+                    choices = community_ids + personal_ids.get(user_id, [])
+                    for day in days:
+                        for meal_type in ('breakfast', 'lunch', 'dinner'):
+                            yield (user_id, day, meal_type, rng.choice(choices))
+            planned = self._insert('INSERT INTO meal_plan (user_id, date, meal_type, meal_id) VALUES (?, ?, ?, ?)',
+                                   plan_rows())
+            print(f"📅 {planned} meal plan slots")
+
+            count = min(favorites, len(community_ids))
+            self._insert('INSERT OR IGNORE INTO favorites (user_id, meal_id) VALUES (?, ?)',
+                         ((user_id, meal_id) for user_id in user_ids
+                          for meal_id in rng.sample(community_ids, count)))
+
+            today = date.today()
+            self._insert('''
+                INSERT INTO ingredients (name, quantity, unit, category, expiry_date, user_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', ((name, rng.randint(1, 5), unit, rng.choice(PANTRY_CATEGORIES),
+                   (today + timedelta(days=rng.randint(-3, 30))).isoformat(), user_id)
+                  for user_id in user_ids
+                  for name, unit in rng.sample(INGREDIENT_NAMES, min(ingredients, len(INGREDIENT_NAMES)))))
+            self._insert('''
+                INSERT INTO shopping_list (name, quantity, unit, category, is_purchased, user_id)
+                VALUES (?, ?, ?, 'General', ?, ?)
+            ''', ((name, rng.randint(1, 5), unit, rng.random() < 0.3, user_id)
+                  for user_id in user_ids
+                  for name, unit in rng.sample(INGREDIENT_NAMES, min(shopping_items, len(INGREDIENT_NAMES)))))
+
+            # Accepted friendships are stored once per direction
+            def friendship_rows():
+                for index, user_id in enumerate(user_ids):
+                    for step in range(1, min(friends, len(user_ids) - 1) + 1):
+                        friend_id = user_ids[(index + step) % len(user_ids)]
+                        yield (user_id, friend_id)
+                        yield (friend_id, user_id)
+            self._insert('''
+                INSERT OR IGNORE INTO friendships (user_id, friend_id, status)
+                VALUES (?, ?, 'accepted')
+            ''', friendship_rows())
+
+            self.conn.commit()
+            print(f"✅ Synthetic data inserted in {time.perf_counter() - started:.1f}s")
+            return True
+
+        except Exception as e:
+            print(f"❌ Error inserting synthetic data: {e}")
+            self.conn.rollback()
+            return False
+
+
+def build_database(db_path, scale, seed=42):
+    """Create a fresh database at db_path filled for the named scale"""
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db = BenchmarkDB(db_path, seed)
+    if not db.connect():
+        return False
+    try:
+        print(f"🏗️  Building '{scale}' database: {SCALES[scale]}")
+        return (db.create_tables() and db.create_indexes()
+                and db.insert_bulk_data(**SCALES[scale]))
+    finally:
+        db.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a synthetic Meal Planner database.')
+    parser.add_argument('--scale', choices=SCALES, default='small', help='data size (default: %(default)s)')
+    parser.add_argument('--db', help='output file (default: benchmarks/data/<scale>.db)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default: %(default)s)')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', f'{args.scale}.db')
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    if not build_database(db_path, args.scale, args.seed):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
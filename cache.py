@@ -0,0 +1,111 @@
+"""
+In-process read-through caches for the Meal Planner app.
+Entries are tagged with the meals version counter, which triggers bump on
+every write to the meals table. Each worker compares that counter on read,
+so all gunicorn workers drop stale entries without talking to each other.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_SIZE = int(os.environ.get('MEAL_CACHE_SIZE', 256))
+CACHE_TTL = float(os.environ.get('MEAL_CACHE_TTL', 300))
+
+
+def meals_version(cursor):
+    """Return the current version of the meals table"""
+    cursor.execute("SELECT version FROM cache_versions WHERE name = 'meals'")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+class VersionedCache:
+    """A thread-safe LRU cache whose entries expire after a TTL or a version change"""
+
+    def __init__(self, name, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+        self._expired = 0
+        self._evictions = 0
+
+    def get(self, key, version):
+        """Return (True, value) for a fresh entry, otherwise (False, None)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, entry_version, expires = entry
+                if entry_version != version:
+                    self._stale += 1
+                    del self._entries[key]
+                elif expires < time.monotonic():
+                    self._expired += 1
+                    del self._entries[key]
+                else:
+                    self._hits += 1
+                    self._entries.move_to_end(key)
+                    return True, value
+            self._misses += 1
+            return False, None
+
+    def set(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (value, version, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def get_or_load(self, cursor, key, loader):
+        """Return the cached value for key, calling loader() to fill a miss.
+
+        The version is read before loading, so a write that lands while
+        loading only makes the new entry stale, never wrongly fresh.
+        """
+        version = meals_version(cursor)
+        found, value = self.get(key, version)
+        if not found:
+            value = loader()
+            self.set(key, version, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and the current size"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'name': self.name,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 3) if lookups else 0.0,
+                'stale': self._stale,
+                'expired': self._expired,
+                'evictions': self._evictions,
+            }
+
+
+# Community meal lists are the same for every user; per-user fields such as
+# is_favorited are added after the cached rows are read
+community_meals_cache = VersionedCache('community_meals')
+meal_details_cache = VersionedCache('meal_details', maxsize=CACHE_SIZE * 4)
+
+CACHES = [community_meals_cache, meal_details_cache]
+
+
+def cache_stats():
+    """Return the stats of every cache in this worker"""
+    return {'pid': os.getpid(), 'caches': [cache.stats() for cache in CACHES]}
@@ -0,0 +1,324 @@
+"""
+Shared data-access layer for the Meal Planner app.
+Keeps a per-worker pool of long-lived SQLite connections and hands them out
+scoped to the Flask application context. Connections count the statements,
+time and rows of each request for the metrics module, and hand slow
+statements to the slow-query log.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import g
+
+import slow_queries
+
+DB_PATH = os.environ.get('MEAL_PLANNER_DB', 'meal_planner.db')
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+STATEMENT_CACHE_SIZE = 256
+# SQLITE_BUSY and SQLITE_LOCKED; the sqlite3 module only names them from Python 3.11
+BUSY_RESULT_CODES = (5, 6)
+# Writes use RETURNING (3.35) and UPDATE ... FROM (3.33)
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+# Applied to every new connection. journal_mode is persistent in the file,
+# the rest are per-connection settings.
+PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -16000',      # ~16 MB page cache
+    'PRAGMA mmap_size = 134217728',    # 128 MB memory-mapped I/O
+    'PRAGMA temp_store = MEMORY',
+]
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """No pooled connection became free within the pool timeout"""
+
+
+def is_busy_error(e):
+    """True if an OperationalError means the database is overloaded rather than broken"""
+    if isinstance(e, PoolTimeout):
+        return True
+    code = getattr(e, 'sqlite_errorcode', None)
+    if code is None:
+        # Python < 3.11 does not expose result codes
+        return 'database is locked' in str(e) or 'database table is locked' in str(e)
+    # Extended codes such as SQLITE_BUSY_SNAPSHOT keep the primary code in the low byte
+    return code & 0xff in BUSY_RESULT_CODES
+
+
+class QueryStats:
+    """Running totals of the SQL issued while serving one request"""
+
+    __slots__ = ('statements', 'seconds', 'rows')
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        self.rows = 0
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """A cursor that adds its statements, time and fetched rows to the connection's
+    query_stats and passes statements slower than SLOW_QUERY_MS to the slow-query log"""
+
+    # [sql, parameters, executemany, seconds so far, logged] of the last statement
+    _statement = None
+
+    def execute(self, sql, parameters=()):
+        stats = self.connection.query_stats
+        if stats is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.statements += 1
+            stats.seconds += elapsed
+        if slow_queries.SLOW_QUERY_MS:
+            self._track(sql, parameters, False, elapsed)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        stats = self.connection.query_stats
+        if stats is None:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.statements += 1
+            stats.seconds += elapsed
+        if slow_queries.SLOW_QUERY_MS:
+            self._track(sql, None, True, elapsed)
+        return self
+
+    # SQLite does most of the work of a SELECT while stepping through its
+    # rows, so fetches count towards the statement time as well
+    def fetchone(self):
+        stats = self.connection.query_stats
+        if stats is None:
+            return super().fetchone()
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(stats, time.perf_counter() - started, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        stats = self.connection.query_stats
+        if stats is None:
+            return super().fetchmany(self.arraysize if size is None else size)
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(stats, time.perf_counter() - started, len(rows))
+        return rows
+
+    def fetchall(self):
+        stats = self.connection.query_stats
+        if stats is None:
+            return super().fetchall()
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(stats, time.perf_counter() - started, len(rows))
+        return rows
+
+    def _fetched(self, stats, elapsed, rows):
+        stats.seconds += elapsed
+        stats.rows += rows
+        if self._statement is not None:
+            self._statement[3] += elapsed
+            self._check_slow()
+
+    def _track(self, sql, parameters, many, elapsed):
+        self._statement = [sql, parameters, many, elapsed, False]
+        # Statements without result rows are finished once executed; queries
+        # are checked as their rows are fetched
+        if self.description is None:
+            self._check_slow()
+
+    def _check_slow(self):
+        sql, parameters, many, seconds, logged = self._statement
+        if not logged and seconds * 1000 >= slow_queries.SLOW_QUERY_MS:
+            self._statement[4] = True
+            slow_queries.record(self.connection, sql, parameters, seconds, many)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """A connection whose cursors report into query_stats while it is set"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.query_stats = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+
+def connect(db_path=None):
+    """Open a new tuned connection to the database"""
+    conn = sqlite3.connect(db_path or DB_PATH,
+                           timeout=5,
+                           check_same_thread=False,
+                           factory=InstrumentedConnection,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """A bounded pool of long-lived connections owned by one worker process"""
+
+    def __init__(self, db_path=None, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.db_path = db_path or DB_PATH
+        self.size = size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+
+    def acquire(self):
+        """Check a connection out of the pool, opening one if there is room"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = connect(self.db_path)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(
+                        f'Timed out after {self.timeout}s waiting for a database connection')
+                waited = time.perf_counter() - started
+                with self._lock:
+                    self._waits += 1
+                    self._wait_time += waited
+                    self._max_wait = max(self._max_wait, waited)
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any open transaction"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A broken connection is dropped so that a fresh one replaces it
+            conn.close()
+            with self._lock:
+                self._in_use -= 1
+                self._created -= 1
+            return
+
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        """Return a snapshot of pool usage and wait times"""
+        with self._lock:
+            return {
+                'pid': self.pid,
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'total_wait_ms': round(self._wait_time * 1000, 3),
+                'avg_wait_ms': round(self._wait_time * 1000 / self._waits, 3) if self._waits else 0.0,
+                'max_wait_ms': round(self._max_wait * 1000, 3),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return this worker's pool, creating a new one after a fork"""
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = ConnectionPool()
+    return _pool
+
+
+def get_db():
+    """Return the connection bound to the current application context"""
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+        g.db.query_stats = g.get('query_stats')
+    return g.db
+
+
+def close_db(exception=None):
+    """Hand the application context's connection back to the pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.query_stats = None
+        get_pool().release(conn)
+
+
+def check_sqlite_version():
+    """Raise RuntimeError if the SQLite library is older than the app needs"""
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        required = '.'.join(map(str, MIN_SQLITE_VERSION))
+        raise RuntimeError(f'SQLite {required} or newer is required, '
+                           f'but Python is linked against {sqlite3.sqlite_version}')
+
+
+def init_app(app):
+    """Check the SQLite version and register the connection teardown with a Flask app"""
+    check_sqlite_version()
+    app.teardown_appcontext(close_db)
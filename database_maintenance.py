@@ -4,20 +4,24 @@ Database Maintenance Script for Meal Planner
 Provides backup, optimization, and health check functionality.
 """
 
+import argparse
 import sqlite3
 import os
 import sys
-import shutil
-import gzip
 from datetime import datetime, timedelta
 import json
+from ingredient_parser import backfill_meal_ingredients
+from backups import (compact_chains, create_backup as create_online_backup, create_incremental_backup,
+                     list_restore_points, restore_database, restore_point_in_time)
+from popularity import refresh_popularity
+from slow_queries import SLOW_QUERY_LOG, summarize as summarize_slow_queries
 
 class DatabaseMaintenance:
-    def __init__(self, db_path='meal_planner.db'):
+    def __init__(self, db_path='meal_planner.db', backup_dir='database_backups'):
         self.db_path = db_path
         self.conn = None
         self.cursor = None
-        self.backup_dir = 'database_backups'
+        self.backup_dir = backup_dir
     
     def connect(self):
         """Connect to the database"""
@@ -47,22 +51,15 @@ class DatabaseMaintenance:
             
             # Generate backup filename with timestamp
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_filename = f"meal_planner_backup_{timestamp}.db"
+            backup_filename = f"meal_planner_backup_{timestamp}.db" + ('.gz' if compress else '')
             backup_path = os.path.join(self.backup_dir, backup_filename)
             
-            # Create backup
-            shutil.copy2(self.db_path, backup_path)
-            
-            # Compress if requested
-            if compress:
-                compressed_path = backup_path + '.gz'
-                with open(backup_path, 'rb') as f_in:
-                    with gzip.open(compressed_path, 'wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                
-                # Remove uncompressed backup
-                os.remove(backup_path)
-                backup_path = compressed_path
+            # Online snapshot through the backup API, verified before it is kept
+            print("🔄 Creating backup...")
+            result = create_online_backup(self.db_path, backup_path, compress=compress)
+            if result['restarts']:
+                print(f"🔁 Snapshot restarted {result['restarts']} time(s) because of concurrent writes")
+            print(f"🔍 Snapshot integrity check passed in {result['seconds']:.1f}s")
             
             # Get backup size
             size = os.path.getsize(backup_path)
@@ -117,8 +114,28 @@ class DatabaseMaintenance:
             print(f"❌ Error listing backups: {e}")
             return []
     
-    def restore_backup(self, backup_filename):
-        """Restore database from backup"""
+    def confirm_restore(self, description, confirm=True):
+        """Ask for confirmation unless running non-interactively"""
+        print(f"⚠️  WARNING: This will overwrite the current database!")
+        if not confirm:
+            return True
+        answer = input(f"Type 'RESTORE' to confirm restoration from {description}: ")
+        if answer != 'RESTORE':
+            print("❌ Restoration cancelled")
+            return False
+        return True
+    
+    def print_restore_summary(self, counts, seconds, allow_older_schema=False):
+        """Show the row counts of the restored database"""
+        print(f"🔍 Integrity check and row counts verified in {seconds:.1f}s")
+        for table in ('users', 'meals', 'meal_plan', 'favorites', 'ingredients', 'shopping_list'):
+            if table in counts:
+                print(f"  {table.capitalize()}: {counts[table]} records")
+        if allow_older_schema:
+            print("⚠️  Restart the app so that it upgrades the schema of the restored database")
+    
+    def restore_backup(self, backup_filename, confirm=True, allow_older_schema=False):
+        """Restore database from backup, safely while the app is running"""
         try:
             backup_path = os.path.join(self.backup_dir, backup_filename)
             
@@ -126,45 +143,85 @@ class DatabaseMaintenance:
                 print(f"❌ Backup file not found: {backup_path}")
                 return False
             
-            # Confirm restoration
-            print(f"⚠️  WARNING: This will overwrite the current database!")
-            confirm = input(f"Type 'RESTORE' to confirm restoration from {backup_filename}: ")
-            
-            if confirm != 'RESTORE':
-                print("❌ Restoration cancelled")
+            if not self.confirm_restore(backup_filename, confirm):
                 return False
             
             # Create backup of current database before restoration
             print("🔄 Creating backup of current database...")
-            self.create_backup(compress=False)
+            if not self.create_backup(compress=False):
+                print("❌ Restoration cancelled: could not back up the current database")
+                return False
+            
+            # Stream into a staging database, verify it, then copy it in
+            print(f"🔄 Restoring from {backup_filename}...")
+            result = restore_database(backup_path, self.db_path, allow_older_schema)
+            self.print_restore_summary(result['counts'], result['seconds'], allow_older_schema)
             
-            # Restore from backup
-            if backup_filename.endswith('.gz'):
-                # Decompress first
-                temp_path = backup_path[:-3]  # Remove .gz
-                with gzip.open(backup_path, 'rb') as f_in:
-                    with open(temp_path, 'wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                backup_path = temp_path
+            print(f"✅ Database restored from {backup_filename}")
+            return True
             
-            # Close current connection
-            self.disconnect()
+        except Exception as e:
+            print(f"❌ Error restoring backup: {e}")
+            return False
+    
+    def create_incremental_backup(self, base=False):
+        """Store the pages changed since the last incremental backup"""
+        try:
+            print("🔄 Creating incremental backup...")
+            link = create_incremental_backup(self.db_path, self.backup_dir, base=base)
+            kind = "Base" if link['base'] else "Increment"
+            print(f"✅ {kind} {link['chain']}/{link['seq']:05d}: {link['changed_pages']} of "
+                  f"{link['page_count']} pages, {link['stored_size'] / (1024 * 1024):.2f} MB "
+                  f"in {link['seconds']:.1f}s")
+            return link
+            
+        except Exception as e:
+            print(f"❌ Error creating incremental backup: {e}")
+            return None
+    
+    def list_restore_points(self):
+        """List the points in time incremental backups can restore"""
+        try:
+            points = list_restore_points(self.backup_dir)
+            if not points:
+                print("⚠️  No incremental backups found")
+                return []
+            
+            print("\n📋 RESTORE POINTS")
+            print("=" * 60)
+            for point in points:
+                kind = "base" if point['base'] else f"+{point['changed_pages']} pages"
+                print(f"🕒 {point['created'][:19].replace('T', ' ')}  {point['id']}  ({kind}, "
+                      f"{point['stored_size'] / (1024 * 1024):.2f} MB)")
+            return points
             
-            # Copy backup to main database
-            shutil.copy2(backup_path, self.db_path)
+        except Exception as e:
+            print(f"❌ Error listing restore points: {e}")
+            return []
+    
+    def restore_point_in_time(self, when=None, point_id=None, confirm=True, allow_older_schema=False):
+        """Rebuild the database as of a point in time and restore it"""
+        try:
+            description = point_id or (f"the latest restore point before {when}" if when else "the latest restore point")
+            if not self.confirm_restore(description, confirm):
+                return False
             
-            # Remove temporary file if it was decompressed
-            if backup_filename.endswith('.gz') and os.path.exists(temp_path):
-                os.remove(temp_path)
+            print("🔄 Creating backup of current database...")
+            if not self.create_backup(compress=False):
+                print("❌ Restoration cancelled: could not back up the current database")
+                return False
             
-            # Reconnect
-            self.connect()
+            print("🔄 Rebuilding database from incremental backups...")
+            result = restore_point_in_time(self.backup_dir, self.db_path, point_id=point_id, when=when,
+                                           allow_older_schema=allow_older_schema)
+            point = result['point']
+            self.print_restore_summary(result['counts'], result['seconds'], allow_older_schema)
             
-            print(f"✅ Database restored from {backup_filename}")
+            print(f"✅ Database restored to {point['id']} from {point['created'][:19].replace('T', ' ')}")
             return True
             
         except Exception as e:
-            print(f"❌ Error restoring backup: {e}")
+            print(f"❌ Error restoring point in time: {e}")
             return False
     
     def optimize_database(self):
@@ -279,6 +336,13 @@ class DatabaseMaintenance:
             else:
                 print(f"✅ Cleaned up {deleted_count} old backup(s)")
             
+            # Fold incremental restore points older than the cutoff into new bases
+            result = compact_chains(self.backup_dir, days_to_keep)
+            if result['deleted_chains'] or result['folded_links']:
+                print(f"🗜️  Incremental backups: deleted {result['deleted_chains']} chain(s), "
+                      f"folded {result['folded_links']} link(s), "
+                      f"freed {result['freed_bytes'] / (1024 * 1024):.2f} MB")
+            
             return True
             
         except Exception as e:
@@ -326,12 +390,126 @@ class DatabaseMaintenance:
             print(f"❌ Error exporting data: {e}")
             return False
 
+    def backfill_ingredients(self, rebuild=True):
+        """Parse meal ingredient text into the meal_ingredients table"""
+        try:
+            print("🔄 Parsing meal ingredients...")
+            count = backfill_meal_ingredients(self.cursor, rebuild=rebuild)
+            self.conn.commit()
+            print(f"✅ Parsed ingredients for {count} meal(s)")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Error parsing meal ingredients: {e}")
+            self.conn.rollback()
+            return False
+
+    def refresh_popularity(self, retention_days=90):
+        """Recount meal popularity counters and prune old trending activity"""
+        try:
+            print("🔄 Recounting meal popularity...")
+            result = refresh_popularity(self.cursor, retention_days)
+            self.conn.commit()
+            print(f"✅ Recounted {result['meals']} meal(s), "
+                  f"pruned {result['pruned_activity']} activity row(s) older than {retention_days} days")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Error refreshing popularity: {e}")
+            self.conn.rollback()
+            return False
+
+    def slow_query_report(self, log_path=SLOW_QUERY_LOG, limit=10):
+        """Rank the statements in the slow-query log by total time"""
+        try:
+            if not os.path.exists(log_path):
+                print(f"📭 No slow-query log at {log_path} (set SLOW_QUERY_MS to start one)")
+                return []
+            
+            report = summarize_slow_queries(log_path)
+            print(f"\n🐢 SLOW QUERIES ({len(report)} distinct statements in {log_path})")
+            print("=" * 50)
+            
+            for rank, item in enumerate(report[:limit], 1):
+                flag = f"  ⚠️  FULL SCAN: {', '.join(item['full_scans'])}" if item['full_scans'] else ""
+                print(f"\n{rank}. {item['count']}x, total {item['total_ms']:.1f} ms, "
+                      f"avg {item['avg_ms']:.1f} ms, max {item['max_ms']:.1f} ms{flag}")
+                print(f"   Routes: {', '.join(item['endpoints']) or '-'}")
+                sql = item['sql'] if len(item['sql']) <= 300 else item['sql'][:297] + '...'
+                print(f"   SQL: {sql}")
+                for line in item['plan']:
+                    print(f"     {line}")
+            
+            return report
+            
+        except Exception as e:
+            print(f"❌ Error reading slow-query log: {e}")
+            return []
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Meal Planner database maintenance. Without a command, opens the interactive menu.')
+    parser.add_argument('--db', default=os.environ.get('MEAL_PLANNER_DB', 'meal_planner.db'),
+                        help='database file (default: %(default)s)')
+    parser.add_argument('--backup-dir', default='database_backups', help='backup directory (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command')
+    
+    backup = commands.add_parser('backup', help='create a full backup')
+    backup.add_argument('--no-compress', action='store_true', help='write an uncompressed .db file')
+    
+    incremental = commands.add_parser('incremental', help='create an incremental backup')
+    incremental.add_argument('--base', action='store_true', help='start a new chain with a full base')
+    
+    restore = commands.add_parser('restore', help='restore a backup or a point in time')
+    restore.add_argument('backup', nargs='?', help='backup filename in the backup directory')
+    restore.add_argument('--at', help='restore the incremental backups as of this time (YYYY-MM-DD HH:MM[:SS])')
+    restore.add_argument('--point', help='restore this incremental restore point id')
+    restore.add_argument('--yes', action='store_true', help="restore without asking to type 'RESTORE'")
+    restore.add_argument('--allow-older-schema', action='store_true',
+                         help='restore a backup that lacks tables the current database has')
+    
+    cleanup = commands.add_parser('cleanup', help='delete old backups and compact incremental chains')
+    cleanup.add_argument('--days', type=int, default=30, help='days of backups to keep (default: %(default)s)')
+    
+    args = parser.parse_args()
+    if args.command == 'restore' and not (args.backup or args.at or args.point):
+        parser.error('restore needs a backup filename, --at or --point')
+    return args
+
+def run_command(args):
+    """Run a single operation for scripts and cron jobs; return the exit status"""
+    maintenance = DatabaseMaintenance(args.db, args.backup_dir)
+    if not maintenance.connect():
+        return 1
+    
+    try:
+        if args.command == 'backup':
+            ok = maintenance.create_backup(not args.no_compress) is not None
+        elif args.command == 'incremental':
+            ok = maintenance.create_incremental_backup(args.base) is not None
+        elif args.command == 'restore' and args.backup:
+            ok = maintenance.restore_backup(args.backup, confirm=not args.yes,
+                                            allow_older_schema=args.allow_older_schema)
+        elif args.command == 'restore':
+            ok = maintenance.restore_point_in_time(args.at, args.point, confirm=not args.yes,
+                                                   allow_older_schema=args.allow_older_schema)
+        else:
+            ok = maintenance.cleanup_old_backups(args.days)
+    finally:
+        maintenance.disconnect()
+    
+    return 0 if ok else 1
+
 def main():
     """Main function for database maintenance"""
+    args = parse_args()
+    if args.command:
+        sys.exit(run_command(args))
+    
     print("🔧 MEAL PLANNER DATABASE MAINTENANCE")
     print("=" * 50)
     
-    maintenance = DatabaseMaintenance()
+    maintenance = DatabaseMaintenance(args.db, args.backup_dir)
     
     if not maintenance.connect():
         sys.exit(1)
@@ -346,9 +524,15 @@ def main():
         print("6. Show database statistics")
         print("7. Clean up old backups")
         print("8. Export data to JSON")
+        print("9. Re-parse meal ingredients")
+        print("10. Refresh popularity counters")
+        print("11. Slow query report")
+        print("12. Create incremental backup")
+        print("13. List restore points")
+        print("14. Restore to a point in time")
         print("0. Exit")
         
-        choice = input("\nEnter your choice (0-8): ").strip()
+        choice = input("\nEnter your choice (0-14): ").strip()
         
         if choice == '1':
             compress = input("Compress backup? (y/n): ").strip().lower() == 'y'
@@ -384,6 +568,28 @@ def main():
                 export_path = None
             maintenance.export_data(export_path)
         
+        elif choice == '9':
+            maintenance.backfill_ingredients()
+        
+        elif choice == '10':
+            maintenance.refresh_popularity()
+        
+        elif choice == '11':
+            limit = input("How many statements to show? (default 10): ").strip()
+            maintenance.slow_query_report(limit=int(limit) if limit.isdigit() else 10)
+        
+        elif choice == '12':
+            base = input("Start a new full base? (y/n): ").strip().lower() == 'y'
+            maintenance.create_incremental_backup(base)
+        
+        elif choice == '13':
+            maintenance.list_restore_points()
+        
+        elif choice == '14':
+            if maintenance.list_restore_points():
+                when = input("Restore as of (YYYY-MM-DD HH:MM[:SS], or press Enter for the latest): ").strip()
+                maintenance.restore_point_in_time(when or None)
+        
         elif choice == '0':
             print("👋 Goodbye!")
             break
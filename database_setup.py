@@ -10,6 +10,7 @@ import sys
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash
 import json
+from backups import create_backup
 
 class MealPlannerDB:
     def __init__(self, db_path='meal_planner.db'):
@@ -81,17 +82,17 @@ class MealPlannerDB:
                 )
             ''')
             
-            # Meal plan table
+            # Meal plan table, clustered on one row per (user, date, meal type) slot
             self.cursor.execute('''
                 CREATE TABLE IF NOT EXISTS meal_plan (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
                     date DATE NOT NULL,
+                    meal_type TEXT NOT NULL,
                     meal_id INTEGER,
-                    meal_type TEXT,
-                    user_id INTEGER,
+                    PRIMARY KEY (user_id, date, meal_type),
                     FOREIGN KEY (meal_id) REFERENCES meals (id),
                     FOREIGN KEY (user_id) REFERENCES users (id)
-                )
+                ) WITHOUT ROWID
             ''')
             
             # Favorites table
@@ -122,6 +123,20 @@ class MealPlannerDB:
                 )
             ''')
             
+            # Friendships table
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS friendships (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    friend_id INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    FOREIGN KEY (friend_id) REFERENCES users (id),
+                    UNIQUE(user_id, friend_id)
+                )
+            ''')
+            
             self.conn.commit()
             print("✅ All tables created successfully")
             return True
@@ -138,12 +153,12 @@ class MealPlannerDB:
                 "CREATE INDEX IF NOT EXISTS idx_meals_user_id ON meals(user_id)",
                 "CREATE INDEX IF NOT EXISTS idx_meals_category ON meals(category)",
                 "CREATE INDEX IF NOT EXISTS idx_meal_plan_date ON meal_plan(date)",
-                "CREATE INDEX IF NOT EXISTS idx_meal_plan_user_id ON meal_plan(user_id)",
                 "CREATE INDEX IF NOT EXISTS idx_ingredients_user_id ON ingredients(user_id)",
                 "CREATE INDEX IF NOT EXISTS idx_ingredients_category ON ingredients(category)",
                 "CREATE INDEX IF NOT EXISTS idx_shopping_list_user_id ON shopping_list(user_id)",
                 "CREATE INDEX IF NOT EXISTS idx_shopping_list_category ON shopping_list(category)",
                 "CREATE INDEX IF NOT EXISTS idx_favorites_user_id ON favorites(user_id)",
+                "CREATE INDEX IF NOT EXISTS idx_friendships_friend_id ON friendships(friend_id, status)",
                 "CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)",
                 "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)"
             ]
@@ -328,8 +343,7 @@ class MealPlannerDB:
             backup_path = f"meal_planner_backup_{timestamp}.db"
         
         try:
-            import shutil
-            shutil.copy2(self.db_path, backup_path)
+            create_backup(self.db_path, backup_path)
             print(f"✅ Database backed up to: {backup_path}")
             return True
         except Exception as e:
@@ -339,8 +353,11 @@ class MealPlannerDB:
     def reset_database(self):
         """Reset the database (delete all data)"""
         try:
-            # Drop all tables
-            tables = ['shopping_list', 'favorites', 'meal_plan', 'ingredients', 'meals', 'users']
+            # Drop all tables. The tables the app derives from meals and meal_plan
+            # go first, so that init_db rebuilds them from the new data instead of
+            # keeping rows for reused ids; triggers are dropped with their tables.
+            derived = ['meals_fts', 'meal_ingredients', 'meal_activity', 'meal_stats', 'plan_versions', 'cache_versions']
+            tables = derived + ['friendships', 'shopping_list', 'favorites', 'meal_plan', 'ingredients', 'meals', 'users']
             for table in tables:
                 self.cursor.execute(f'DROP TABLE IF EXISTS {table}')
             
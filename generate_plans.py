@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Bulk Meal Plan Generation for Meal Planner
+Generates monthly meal plans for all or selected users. Plans are computed
+across a pool of worker processes and streamed back to this process, which
+is the only one writing to SQLite and commits them in large batches.
+Generated slots count as planned in the popularity counters but are taken
+back out of the trending activity, and popularity is recounted at the end.
+
+Examples:
+    python generate_plans.py                      # next month for every user
+    python generate_plans.py --year 2025 --month 1 --months 3 --user 4 --user 7
+    python generate_plans.py --workers 8 --batch-size 5000 --seed nightly
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime
+
+from database import DB_PATH, connect
+from plan_generator import (FAVORITE_BOOST, NO_REPEAT_DAYS, generate_month, group_candidates,
+                            load_shared_candidates, save_months, tables_from_groups)
+from popularity import refresh_popularity
+
+# Set in each worker by _init_worker
+_shared_groups = None
+_shared_tables = None
+_shared_categories = None
+_options = None
+
+
+def _init_worker(shared, options):
+    """Group the shared meals once per worker instead of once per user"""
+    global _shared_groups, _shared_tables, _shared_categories, _options
+    _options = options
+    _shared_groups = group_candidates((meal_id, category, False) for meal_id, category in shared)
+    _shared_tables = tables_from_groups(_shared_groups, favorite_boost=options['favorite_boost'])
+    _shared_categories = dict(shared)
+
+
+def _user_tables(personal, favorites):
+    """Sampling tables for one user: the shared meals plus their own, with favorites boosted"""
+    if not personal and not favorites:
+        return _shared_tables
+
+    grouped = {key: list(meal_ids) for key, meal_ids in _shared_groups.items()}
+    for meal_id in favorites:
+        if meal_id in _shared_categories:
+            category = _shared_categories[meal_id]
+            grouped[(category, False)].remove(meal_id)
+            grouped.setdefault((category, True), []).append(meal_id)
+    for meal_id, category in personal:
+        grouped.setdefault((category, meal_id in favorites), []).append(meal_id)
+    return tables_from_groups(grouped, favorite_boost=_options['favorite_boost'])
+
+
+def _generate_user(task):
+    """Generate every requested month for one user"""
+    user_id, personal, favorites, months = task
+    favorites = set(favorites)
+    tables = _user_tables(personal, favorites)
+    if not any(weights for _, weights, _ in tables.values()):
+        return user_id, []
+
+    plans = []
+    seed = _options['seed']
+    for year, month in months:
+        month_seed = None if seed is None else f'{seed}:{user_id}:{year}-{month:02d}'
+        slots = generate_month(None, year, month, seed=month_seed,
+                               no_repeat_days=_options['no_repeat_days'], tables=tables)
+        plans.append((user_id, year, month, slots))
+    return user_id, plans
+
+
+def month_sequence(year, month, count):
+    """Return count consecutive (year, month) pairs starting at year/month"""
+    months = []
+    for offset in range(count):
+        index = (year * 12 + month - 1) + offset
+        months.append((index // 12, index % 12 + 1))
+    return months
+
+
+def load_tasks(cursor, user_ids, months):
+    """Return one (user_id, personal meals, favorites, months) task per user"""
+    if user_ids:
+        placeholders = ','.join('?' * len(user_ids))
+        cursor.execute(f'SELECT id FROM users WHERE id IN ({placeholders}) ORDER BY id', user_ids)
+    else:
+        cursor.execute('SELECT id FROM users ORDER BY id')
+    users = [row[0] for row in cursor.fetchall()]
+
+    personal = {}
+    cursor.execute('''
+        SELECT user_id, id, category FROM meals
+        WHERE is_community = FALSE AND user_id IS NOT NULL
+    ''')
+    for user_id, meal_id, category in cursor.fetchall():
+        personal.setdefault(user_id, []).append((meal_id, category))
+
+    favorites = {}
+    cursor.execute('SELECT user_id, meal_id FROM favorites')
+    for user_id, meal_id in cursor.fetchall():
+        favorites.setdefault(user_id, []).append(meal_id)
+
+    return [(user_id, personal.get(user_id, []), favorites.get(user_id, []), months)
+            for user_id in users]
+
+
+def run(db_path, user_ids, months, workers, batch_size, options):
+    """Generate and write plans, printing progress. Returns (user-months, slots) written."""
+    conn = connect(db_path)
+    cursor = conn.cursor()
+
+    shared = load_shared_candidates(cursor)
+    tasks = load_tasks(cursor, user_ids, months)
+    total = len(tasks) * len(months)
+    print(f"📋 {len(tasks)} user(s) x {len(months)} month(s) = {total} user-months, "
+          f"{len(shared)} shared meals, {workers} worker(s)")
+    if not tasks:
+        conn.close()
+        return 0, 0
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(shared, options))
+        results = pool.imap_unordered(_generate_user, tasks, chunksize=max(1, min(256, len(tasks) // (workers * 8))))
+    else:
+        pool = None
+        _init_worker(shared, options)
+        results = map(_generate_user, tasks)
+
+    started = time.perf_counter()
+    written = 0
+    slots_written = 0
+    skipped = 0
+    batch = []
+
+    def flush():
+        nonlocal written, slots_written, batch
+        if not batch:
+            return
+        save_months(cursor, batch, record_activity=False)
+        conn.commit()
+        written += len(batch)
+        slots_written += sum(len(slots) for _, _, _, slots in batch)
+        batch = []
+        elapsed = time.perf_counter() - started
+        print(f"📦 {written}/{total} user-months written "
+              f"({written / elapsed:,.0f}/s, {slots_written / elapsed:,.0f} slots/s)")
+
+    try:
+        for user_id, plans in results:
+            if not plans:
+                skipped += len(months)
+                continue
+            batch.extend(plans)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+        recount_started = time.perf_counter()
+        summary = refresh_popularity(cursor)
+        conn.commit()
+        print(f"🔢 Recounted popularity of {summary['meals']} meals "
+              f"in {time.perf_counter() - recount_started:.2f}s")
+    except BaseException:
+        # Don't wait for workers to finish tasks nobody will write
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+            pool = None
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Wrote {written} user-months ({slots_written} slots) in {elapsed:.2f}s"
+          + (f", skipped {skipped} with no meals" if skipped else ''))
+    return written, slots_written
+
+
+def main():
+    today = datetime.now()
+    next_year, next_month = month_sequence(today.year, today.month, 2)[1]
+
+    parser = argparse.ArgumentParser(description='Generate monthly meal plans for many users.')
+    parser.add_argument('--db', default=DB_PATH, help='database file (default: %(default)s)')
+    parser.add_argument('--year', type=int, default=next_year, help='first year to fill (default: next month)')
+    parser.add_argument('--month', type=int, default=next_month, help='first month to fill (default: next month)')
+    parser.add_argument('--months', type=int, default=1, help='number of consecutive months (default: 1)')
+    parser.add_argument('--user', type=int, action='append', dest='users',
+                        help='user id to generate for, repeatable (default: all users)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='generator processes (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=2000,
+                        help='user-months per write transaction (default: %(default)s)')
+    parser.add_argument('--seed', help='base seed; the same seed regenerates the same plans')
+    parser.add_argument('--no-repeat-days', type=int, default=NO_REPEAT_DAYS,
+                        help='days before a meal may repeat (default: %(default)s)')
+    parser.add_argument('--favorite-boost', type=float, default=FAVORITE_BOOST,
+                        help='weight multiplier for favorites (default: %(default)s)')
+    args = parser.parse_args()
+
+    if not 1 <= args.month <= 12 or args.months < 1 or args.workers < 1 or args.batch_size < 1:
+        parser.error('month must be 1-12 and months, workers and batch size at least 1')
+    if not os.path.exists(args.db):
+        print(f"❌ Database not found: {args.db}")
+        sys.exit(1)
+
+    months = month_sequence(args.year, args.month, args.months)
+    print(f"🗓️  Generating {months[0][0]}-{months[0][1]:02d}"
+          + (f" to {months[-1][0]}-{months[-1][1]:02d}" if len(months) > 1 else ''))
+    options = {
+        'seed': args.seed,
+        'no_repeat_days': args.no_repeat_days,
+        'favorite_boost': args.favorite_boost,
+    }
+    run(args.db, args.users, months, args.workers, args.batch_size, options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+"""
+Gunicorn settings for the Meal Planner app, read automatically by
+`gunicorn planner:app` (see the Procfile).
+The hooks run in the master process and keep the request metrics of
+metrics.py consistent across worker restarts.
+"""
+
+import metrics
+
+
+def on_starting(server):
+    """Fold in the snapshots of workers from a previous run"""
+    retired = metrics.retire_dead_workers()
+    if retired:
+        server.log.info('Retired metrics of %d exited worker(s)', retired)
+
+
+def child_exit(server, worker):
+    """Fold an exited worker's snapshot into retired.json"""
+    metrics.retire_worker(worker.pid)
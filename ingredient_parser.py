@@ -0,0 +1,113 @@
+"""
+Ingredient parsing for the Meal Planner app.
+Splits a meal's free-text ingredient list into normalized rows once, when the
+meal is written, so shopping lists can be built with a single SQL aggregate.
+"""
+
+import re
+
+from units import is_unit, to_canonical
+
+QUANTITY_RE = re.compile(r'^(\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?|\.\d+)\s*(.*)$')
+
+# Words that look plural but should be left alone by normalize_name
+SINGULAR_EXCEPTIONS = {'asparagus', 'couscous', 'hummus', 'molasses', 'swiss', 'grits'}
+
+
+def _singular(word):
+    if word in SINGULAR_EXCEPTIONS or word.endswith(('ss', 'us')) or len(word) < 4:
+        return word
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith(('oes', 'ches', 'shes', 'xes')):
+        return word[:-2]
+    if word.endswith('s'):
+        return word[:-1]
+    return word
+
+
+def normalize_name(name):
+    """Return the lookup key for an ingredient name, e.g. 'Tomatoes' -> 'tomato'"""
+    words = re.sub(r'\s+', ' ', name).strip().lower().split(' ')
+    words[-1] = _singular(words[-1])
+    return ' '.join(words)
+
+
+def parse_quantity(text):
+    """Parse '2', '1.5', '1/2' or '1 1/2' into a float"""
+    total = 0.0
+    for part in text.split():
+        if '/' in part:
+            numerator, denominator = part.split('/')
+            total += float(numerator) / float(denominator) if float(denominator) else 0.0
+        else:
+            total += float(part)
+    return total
+
+
+def parse_ingredient(text):
+    """Parse one entry such as '2 cups flour' or '400g spaghetti' into name, quantity and unit"""
+    text = text.strip()
+    match = QUANTITY_RE.match(text)
+    if not match or not match.group(2):
+        # No leading number: count the whole entry once
+        return {'name': text, 'quantity': 1.0, 'unit': ''}
+
+    quantity = parse_quantity(match.group(1))
+    rest = match.group(2).strip()
+    words = rest.split(' ')
+
+    # Try two-word units such as 'fl oz' before single words
+    for size in (2, 1):
+        if len(words) > size and is_unit(' '.join(words[:size])):
+            return {'name': ' '.join(words[size:]), 'quantity': quantity,
+                    'unit': ' '.join(words[:size]).rstrip('.')}
+
+    # '2 potatoes' has a quantity but no unit
+    return {'name': rest, 'quantity': quantity, 'unit': ''}
+
+
+def parse_ingredients(ingredients_text):
+    """Parse a comma separated ingredient list, skipping empty entries"""
+    parsed = []
+    for entry in (ingredients_text or '').split(','):
+        if entry.strip():
+            item = parse_ingredient(entry)
+            item['name_key'] = normalize_name(item['name'])
+            item['base_quantity'], item['base_unit'] = to_canonical(
+                item['quantity'], item['unit'], item['name_key'])
+            parsed.append(item)
+    return parsed
+
+
+def save_meal_ingredients(cursor, meal_id, ingredients_text):
+    """Replace the parsed ingredient rows of a meal"""
+    items = parse_ingredients(ingredients_text)
+    # Every row carries the meal's number of distinct ingredients so the
+    # pantry matcher can rank meals from the name_key index alone
+    key_count = len({item['name_key'] for item in items})
+    cursor.execute('DELETE FROM meal_ingredients WHERE meal_id = ?', (meal_id,))
+    cursor.executemany('''
+        INSERT INTO meal_ingredients (meal_id, position, name, name_key, quantity, unit, base_quantity, base_unit, key_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(meal_id, position, item['name'], item['name_key'], item['quantity'], item['unit'],
+           item['base_quantity'], item['base_unit'], key_count)
+          for position, item in enumerate(items)])
+
+
+def backfill_meal_ingredients(cursor, rebuild=False):
+    """Parse meals that have no ingredient rows yet, or every meal when rebuilding.
+
+    Returns the number of meals parsed. The caller commits.
+    """
+    if rebuild:
+        cursor.execute('SELECT id, ingredients FROM meals')
+    else:
+        cursor.execute('''
+            SELECT id, ingredients FROM meals m
+            WHERE NOT EXISTS (SELECT 1 FROM meal_ingredients mi WHERE mi.meal_id = m.id)
+        ''')
+    meals = cursor.fetchall()
+    for meal_id, ingredients_text in meals:
+        save_meal_ingredients(cursor, meal_id, ingredients_text)
+    return len(meals)
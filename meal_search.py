@@ -0,0 +1,283 @@
+"""
+Meal list queries for the Meal Planner app.
+Selects only the columns a caller asks for, searches community meals through
+the meals_fts full-text index and pages through them with keyset cursors, so
+each page costs the same no matter how deep the user scrolls. Popularity
+sorts read the meal_stats counters kept by popularity.py.
+"""
+
+import base64
+import json
+import re
+
+from cache import community_meals_cache
+from popularity import SCORE_SQL, TRENDING_DAYS, trending_since
+
+# Fields a list query can return, and the SQL that produces each one.
+# Queries bind :user_id for the favorite flag.
+MEAL_FIELDS = {
+    'id': 'm.id',
+    'name': 'm.name',
+    'category': 'm.category',
+    'prep_time': 'm.prep_time',
+    'cook_time': 'm.cook_time',
+    'servings': 'm.servings',
+    'ingredients': 'm.ingredients',
+    'instructions': 'm.instructions',
+    'user_id': 'm.user_id',
+    'is_community': 'm.is_community',
+    'username': "COALESCE(u.username, 'System')",
+    'is_favorited': 'EXISTS (SELECT 1 FROM favorites f WHERE f.user_id = :user_id AND f.meal_id = m.id)',
+    'favorites_count': 'COALESCE((SELECT favorites FROM meal_stats WHERE meal_id = m.id), 0)',
+    'planned_count': 'COALESCE((SELECT planned FROM meal_stats WHERE meal_id = m.id), 0)',
+    'copied_count': 'COALESCE((SELECT copied FROM meal_stats WHERE meal_id = m.id), 0)',
+    'popularity': 'COALESCE((SELECT score FROM meal_stats WHERE meal_id = m.id), 0)',
+}
+BOOLEAN_FIELDS = {'is_community', 'is_favorited'}
+# Counters that change without a meals write, so they are never cached
+STATS_FIELDS = {'favorites_count', 'planned_count', 'copied_count', 'popularity'}
+
+# Orders for the community list when there is no search text
+COMMUNITY_SORTS = ('name', 'popular', 'trending')
+
+# What a meal card shows; full text is loaded by the details modal
+CARD_FIELDS = ('id', 'name', 'category', 'prep_time', 'cook_time', 'servings', 'username', 'is_favorited')
+
+# bm25 weights for the meals_fts columns (name, ingredients, category)
+RANK_WEIGHTS = (10.0, 2.0, 5.0)
+
+PHRASE_RE = re.compile(r'"([^"]*)"')
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def parse_fields(text, default=CARD_FIELDS):
+    """Parse a comma separated `fields=` argument into a tuple of field names.
+
+    Raises ValueError naming any field that does not exist.
+    """
+    if not text:
+        return tuple(default)
+    fields = []
+    for field in text.split(','):
+        field = field.strip()
+        if field and field not in fields:
+            fields.append(field)
+    unknown = [field for field in fields if field not in MEAL_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return tuple(fields) or tuple(default)
+
+
+def _projection(fields):
+    """Return the SELECT list and the users join the fields need"""
+    columns = ', '.join(f'{MEAL_FIELDS[field]} AS {field}' for field in fields)
+    join = 'LEFT JOIN users u ON m.user_id = u.id' if 'username' in fields else ''
+    return columns, join
+
+
+def _to_dicts(fields, rows):
+    meals = []
+    for row in rows:
+        meal = dict(zip(fields, row))
+        for field in BOOLEAN_FIELDS.intersection(meal):
+            meal[field] = bool(meal[field])
+        meals.append(meal)
+    return meals
+
+
+def build_match_query(text):
+    """Turn user input into an FTS5 MATCH expression.
+
+    Quoted text is kept as a phrase and every other word becomes a prefix
+    term, so 'chick "olive oil"' matches 'Chicken ... olive oil ...'. All
+    terms must match. Returns None if there is nothing to search for.
+    """
+    terms = []
+    for phrase in PHRASE_RE.findall(text):
+        words = TOKEN_RE.findall(phrase)
+        if words:
+            terms.append('"' + ' '.join(words) + '"')
+    for word in TOKEN_RE.findall(PHRASE_RE.sub(' ', text)):
+        terms.append(f'"{word}"*')
+    return ' '.join(terms) or None
+
+
+def encode_cursor(values):
+    """Pack the sort key of the last row on a page into an opaque token"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(token, text_key=False):
+    """Unpack a cursor token, returning None if it is missing or malformed.
+
+    A cursor is a sort key and a meal id. The key is the meal name when
+    text_key is set and a number otherwise, so a crafted token can never
+    bind anything else.
+    """
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != 2:
+        return None
+    key, meal_id = values
+    key_types = str if text_key else (int, float)
+    if isinstance(key, bool) or not isinstance(key, key_types):
+        return None
+    if isinstance(meal_id, bool) or not isinstance(meal_id, int):
+        return None
+    return values
+
+
+def search_community_meals(cursor, user_id, text='', after=None, limit=20, fields=CARD_FIELDS,
+                           sort='name', days=TRENDING_DAYS):
+    """Return one page of community meals and the cursor for the next page.
+
+    With search text, meals are ranked by bm25 relevance. Without it they
+    are listed by `sort`: 'name', 'popular' (all-time score) or 'trending'
+    (score gained over the last `days` days). `after` is a cursor returned
+    by a previous call with the same arguments.
+    """
+    match = build_match_query(text or '')
+    position = decode_cursor(after, text_key=not match and sort == 'name')
+    columns, join = _projection(fields)
+    params = {'user_id': user_id, 'match': match, 'limit': limit + 1}
+    if position:
+        params['after_key'], params['after_id'] = position
+
+    if match:
+        bm25 = 'bm25(meals_fts, {}, {}, {})'.format(*RANK_WEIGHTS)
+        seek = 'WHERE (sort_key, sort_id) > (:after_key, :after_id)' if position else ''
+        cursor.execute(f'''
+            SELECT * FROM (
+                SELECT {columns}, {bm25} AS sort_key, m.id AS sort_id
+                FROM meals_fts
+                JOIN meals m ON m.id = meals_fts.rowid
+                {join}
+                WHERE meals_fts MATCH :match
+            )
+            {seek}
+            ORDER BY sort_key, sort_id
+            LIMIT :limit
+        ''', params)
+    elif sort == 'popular':
+        # Walks idx_meal_stats_score from the cursor, skipping personal meals;
+        # CROSS JOIN keeps meal_stats as the outer loop so no sort is needed
+        seek = ('AND s.score <= :after_key AND (s.score < :after_key OR s.meal_id > :after_id)'
+                if position else '')
+        cursor.execute(f'''
+            SELECT {columns}, s.score AS sort_key, s.meal_id AS sort_id
+            FROM meal_stats s
+            CROSS JOIN meals m ON m.id = s.meal_id
+            {join}
+            WHERE m.is_community = TRUE {seek}
+            ORDER BY s.score DESC, s.meal_id
+            LIMIT :limit
+        ''', params)
+    elif sort == 'trending':
+        # Only meals with activity inside the window are read
+        params['since'] = trending_since(days)
+        seek = ('WHERE sort_key < :after_key OR (sort_key = :after_key AND sort_id > :after_id)'
+                if position else '')
+        cursor.execute(f'''
+            SELECT * FROM (
+                SELECT {columns}, t.trend AS sort_key, m.id AS sort_id
+                FROM (
+                    SELECT meal_id, SUM({SCORE_SQL}) AS trend
+                    FROM meal_activity
+                    WHERE day >= :since
+                    GROUP BY meal_id
+                    HAVING trend > 0
+                ) t
+                JOIN meals m ON m.id = t.meal_id
+                {join}
+                WHERE m.is_community = TRUE
+            )
+            {seek}
+            ORDER BY sort_key DESC, sort_id
+            LIMIT :limit
+        ''', params)
+    elif sort == 'name':
+        # Walks idx_meals_community_name in order, starting after the cursor
+        seek = 'AND (m.name, m.id) > (:after_key, :after_id)' if position else ''
+        cursor.execute(f'''
+            SELECT {columns}, m.name AS sort_key, m.id AS sort_id
+            FROM meals m
+            {join}
+            WHERE m.is_community = TRUE {seek}
+            ORDER BY m.name, m.id
+            LIMIT :limit
+        ''', params)
+    else:
+        raise ValueError(f'Unknown sort: {sort}')
+
+    rows = cursor.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(list(rows[-1][-2:]))
+    return _to_dicts(fields, [row[:-2] for row in rows]), next_cursor
+
+
+def favorite_ids(cursor, user_id, meal_ids):
+    """Return the subset of meal_ids the user has favorited"""
+    if not meal_ids:
+        return set()
+    cursor.execute('''
+        SELECT meal_id FROM favorites
+        WHERE user_id = ? AND meal_id IN (SELECT value FROM json_each(?))
+    ''', (user_id, json.dumps(list(meal_ids))))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def cached_community_meals(cursor, user_id, text='', after=None, limit=20, fields=CARD_FIELDS,
+                           sort='name', days=TRENDING_DAYS):
+    """search_community_meals through the shared community cache.
+
+    Pages are cached without is_favorited so every user shares them; the
+    flag is filled in with one lookup against the user's favorites.
+    Popularity sorts and counter fields change on every favorite or plan
+    without bumping the meals version, so they always go to the database.
+    """
+    if STATS_FIELDS.intersection(fields) or (sort != 'name' and not build_match_query(text or '')):
+        return search_community_meals(cursor, user_id, text, after, limit, fields, sort, days)
+
+    shared = tuple(field for field in fields if field != 'is_favorited')
+    if 'is_favorited' in fields and 'id' not in shared:
+        shared += ('id',)
+    key = ((text or '').strip(), after or '', limit, shared)
+    meals, next_cursor = community_meals_cache.get_or_load(
+        cursor, key, lambda: search_community_meals(cursor, None, text, after, limit, shared))
+
+    meals = [dict(meal) for meal in meals]
+    if 'is_favorited' in fields:
+        favorites = favorite_ids(cursor, user_id, [meal['id'] for meal in meals])
+        for meal in meals:
+            meal['is_favorited'] = meal['id'] in favorites
+            if 'id' not in fields:
+                del meal['id']
+    return meals, next_cursor
+
+
+def list_user_meals(cursor, user_id, scope, fields=CARD_FIELDS):
+    """Return a user's personal ('personal') or favorite ('favorites') meals by name"""
+    columns, join = _projection(fields)
+    if scope == 'personal':
+        source = 'meals m'
+        where = 'm.user_id = :user_id AND m.is_community = FALSE'
+    elif scope == 'favorites':
+        source = 'favorites fav JOIN meals m ON fav.meal_id = m.id'
+        where = 'fav.user_id = :user_id'
+    else:
+        raise ValueError(f'Unknown meal list: {scope}')
+
+    cursor.execute(f'''
+        SELECT {columns}
+        FROM {source}
+        {join}
+        WHERE {where}
+        ORDER BY m.name
+    ''', {'user_id': user_id})
+    return _to_dicts(fields, cursor.fetchall())
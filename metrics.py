@@ -0,0 +1,340 @@
+"""
+Request metrics for the Meal Planner app, in the Prometheus text format.
+Every request records its latency, status, response size and the SQL it
+issued (statements, time and rows, counted by the instrumented connections
+in database.py), labelled by endpoint. Each worker keeps its own registry
+and writes a snapshot of it to METRICS_DIR about once a second, and
+/metrics adds up the snapshots of all workers, so any gunicorn worker can
+answer a scrape. The gunicorn master folds the snapshot of every worker
+that exits into retired.json (see gunicorn.conf.py), so counters never go
+backwards and the directory does not grow with worker restarts.
+"""
+
+import atexit
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+from glob import glob
+
+from flask import Response, abort, current_app, g, request
+
+from database import DB_PATH, QueryStats
+
+
+def default_metrics_dir(db_path=DB_PATH):
+    """A snapshot directory of its own for every database, so separate
+    deployments, dev servers and benchmark runs never share counters"""
+    db_path = os.path.abspath(db_path)
+    digest = hashlib.sha1(db_path.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), 'meal_planner_metrics',
+                        f'{os.path.basename(db_path)}-{digest}')
+
+
+METRICS_DIR = os.environ.get('MEAL_PLANNER_METRICS_DIR') or default_metrics_dir()
+# Scrapes must send "Authorization: Bearer <token>". Without a token
+# /metrics is only served in debug mode.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+RETIRED_FILE = 'retired.json'
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1.0))
+
+COUNTERS = {
+    'mealplanner_http_requests_total': 'Requests served, by endpoint, method and status',
+    'mealplanner_sql_statements_total': 'SQL statements executed while serving requests',
+    'mealplanner_sql_seconds_total': 'Time spent executing SQL and fetching rows',
+    'mealplanner_sql_rows_fetched_total': 'Rows fetched from SQLite while serving requests',
+}
+
+HISTOGRAMS = {
+    'mealplanner_http_request_duration_seconds': (
+        'Time to serve a request',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    'mealplanner_http_response_size_bytes': (
+        'Size of response bodies',
+        (256, 1024, 4096, 16384, 65536, 262144, 1048576)),
+    'mealplanner_sql_statements_per_request': (
+        'SQL statements executed by one request',
+        (0, 1, 2, 5, 10, 20, 50, 100, 250)),
+    'mealplanner_sql_seconds_per_request': (
+        'Time one request spent in SQL',
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)),
+}
+
+
+class Registry:
+    """Counters and histograms of one worker process, keyed by metric name and labels"""
+
+    def __init__(self, directory=METRICS_DIR):
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, f'worker-{self.pid}.json')
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._next_flush = 0.0
+        self._timer = None
+        # A restarted worker that reuses a pid carries on from the old counts
+        snapshot = read_snapshot(self.path)
+        if snapshot:
+            merge(self._counters, self._histograms, snapshot)
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self):
+        """Return the registry as a JSON-serialisable dict"""
+        with self._lock:
+            return as_snapshot(self._counters, self._histograms)
+
+    def flush(self, force=False):
+        """Write this worker's snapshot, at most once per FLUSH_INTERVAL unless forced.
+
+        A flush that comes too soon is deferred to a timer instead of
+        dropped, so the last requests before a worker goes idle still show.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not force and now < self._next_flush:
+                if self._timer is None:
+                    self._timer = threading.Timer(self._next_flush - now, self._deferred_flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            self._next_flush = now + FLUSH_INTERVAL
+        try:
+            write_snapshot(self.path, self.snapshot())
+        except OSError:
+            # Metrics must never fail a request; this worker's numbers are
+            # still served from memory
+            pass
+
+    def _deferred_flush(self):
+        with self._lock:
+            self._timer = None
+        self.flush(force=True)
+
+
+def as_snapshot(counters, histograms):
+    """Turn counters and histograms dicts into a JSON-serialisable dict"""
+    return {
+        'counters': [[name, dict(labels), value]
+                     for (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels), list(counts), total, count]
+                       for (name, labels), (counts, total, count) in histograms.items()],
+    }
+
+
+def write_snapshot(path, snapshot):
+    """Replace a snapshot file atomically, so readers never see half of one"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path):
+    """Load a worker snapshot, or None if it is missing or half-written"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def merge(counters, histograms, snapshot):
+    """Add a worker snapshot into counters and histograms dicts"""
+    for name, labels, value in snapshot.get('counters', []):
+        key = (name, tuple(sorted(labels.items())))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, counts, total, count in snapshot.get('histograms', []):
+        if name not in HISTOGRAMS or len(counts) != len(HISTOGRAMS[name][1]) + 1:
+            continue
+        key = (name, tuple(sorted(labels.items())))
+        entry = histograms.get(key)
+        if entry is None:
+            entry = histograms[key] = [[0] * len(counts), 0.0, 0]
+        entry[0] = [a + b for a, b in zip(entry[0], counts)]
+        entry[1] += total
+        entry[2] += count
+
+
+def retire_worker(pid, directory=METRICS_DIR):
+    """Fold the snapshot of an exited worker into retired.json.
+
+    Only the gunicorn master calls this, so retired.json has one writer.
+    """
+    path = os.path.join(directory, f'worker-{pid}.json')
+    snapshot = read_snapshot(path)
+    if snapshot:
+        retired_path = os.path.join(directory, RETIRED_FILE)
+        counters, histograms = {}, {}
+        merge(counters, histograms, read_snapshot(retired_path) or {})
+        merge(counters, histograms, snapshot)
+        write_snapshot(retired_path, as_snapshot(counters, histograms))
+    for leftover in (path, f'{path}.tmp'):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def retire_dead_workers(directory=METRICS_DIR):
+    """Retire the snapshots of workers that are no longer running, e.g.
+    those left behind by a previous server; returns how many were retired"""
+    retired = 0
+    for path in glob(os.path.join(directory, 'worker-*.json')):
+        try:
+            pid = int(os.path.basename(path)[len('worker-'):-len('.json')])
+        except ValueError:
+            continue
+        if not _pid_alive(pid):
+            retire_worker(pid, directory)
+            retired += 1
+    return retired
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Return this worker's registry, creating a new one after a fork"""
+    global _registry
+    if _registry is None or _registry.pid != os.getpid():
+        with _registry_lock:
+            if _registry is None or _registry.pid != os.getpid():
+                _registry = Registry()
+                atexit.register(_registry.flush, True)
+    return _registry
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(counters, histograms):
+    """Render merged counters and histograms in the Prometheus text format"""
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                le = bound if bound == '+Inf' else _format_value(float(bound))
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(float(total))}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def collect(directory=METRICS_DIR):
+    """Merge the snapshots of every worker, retired ones included, with this one's latest numbers"""
+    registry = get_registry()
+    registry.flush(force=True)
+    counters, histograms = {}, {}
+    for path in glob(os.path.join(directory, '*.json')):
+        if path == registry.path:
+            continue
+        snapshot = read_snapshot(path)
+        if snapshot:
+            merge(counters, histograms, snapshot)
+    merge(counters, histograms, registry.snapshot())
+    return counters, histograms
+
+
+def start_request():
+    g.metrics_started = time.perf_counter()
+    g.query_stats = QueryStats()
+    if 'db' in g:
+        g.db.query_stats = g.query_stats
+
+
+def record_request(response):
+    started = g.pop('metrics_started', None)
+    stats = g.get('query_stats')
+    if started is None or stats is None:
+        return response
+
+    registry = get_registry()
+    endpoint = request.endpoint or 'unmatched'
+    labels = (('endpoint', endpoint), ('method', request.method))
+    registry.inc('mealplanner_http_requests_total',
+                 labels + (('status', str(response.status_code)),))
+    registry.observe('mealplanner_http_request_duration_seconds', labels,
+                     time.perf_counter() - started)
+    size = response.content_length
+    if size is None and not response.is_streamed:
+        size = response.calculate_content_length()
+    if size is not None:
+        registry.observe('mealplanner_http_response_size_bytes', (('endpoint', endpoint),), size)
+
+    endpoint_label = (('endpoint', endpoint),)
+    registry.inc('mealplanner_sql_statements_total', endpoint_label, stats.statements)
+    registry.inc('mealplanner_sql_seconds_total', endpoint_label, stats.seconds)
+    registry.inc('mealplanner_sql_rows_fetched_total', endpoint_label, stats.rows)
+    registry.observe('mealplanner_sql_statements_per_request', endpoint_label, stats.statements)
+    registry.observe('mealplanner_sql_seconds_per_request', endpoint_label, stats.seconds)
+    registry.flush()
+    return response
+
+
+def metrics_view():
+    """Prometheus scrape endpoint covering every worker"""
+    # Like /db_stats, the numbers are not for anonymous visitors
+    if not METRICS_TOKEN:
+        if not current_app.debug:
+            abort(403)
+    elif not hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                 f'Bearer {METRICS_TOKEN}'.encode()):
+        abort(401)
+    return Response(render(*collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_app(app):
+    """Register the request hooks and the /metrics endpoint with a Flask app"""
+    app.before_request(start_request)
+    app.after_request(record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
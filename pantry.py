@@ -0,0 +1,98 @@
+"""
+Pantry matching for the Meal Planner app.
+Finds meals a user can cook from their ingredient inventory using the
+name_key index on meal_ingredients as an inverted index.
+"""
+
+import json
+
+from ingredient_parser import normalize_name
+from units import to_canonical
+
+
+def load_pantry(cursor, user_id):
+    """Return the user's inventory as {name_key: {canonical unit: quantity}}"""
+    cursor.execute('SELECT name, quantity, unit FROM ingredients WHERE user_id = ?', (user_id,))
+    pantry = {}
+    for name, quantity, unit in cursor.fetchall():
+        name_key = normalize_name(name)
+        amount, canonical = to_canonical(quantity, unit, name_key)
+        stock = pantry.setdefault(name_key, {})
+        stock[canonical] = stock.get(canonical, 0.0) + amount
+    return pantry
+
+
+def find_makeable_meals(cursor, user_id, min_coverage=0.5, limit=50, include_personal=False):
+    """Rank meals by the share of their ingredients found in the user's pantry.
+
+    Only meals sharing at least one ingredient with the pantry are touched.
+    Each result lists the ingredients that are missing and the ones in stock
+    but short of the quantity the recipe needs.
+    """
+    pantry = load_pantry(cursor, user_id)
+    if not pantry:
+        return []
+
+    if include_personal:
+        visible = '(m.is_community = TRUE OR m.user_id = ?)'
+        visible_params = [user_id]
+    else:
+        visible = 'm.is_community = TRUE'
+        visible_params = []
+
+    cursor.execute(f'''
+        SELECT m.id, m.name, m.category, m.prep_time, m.cook_time, m.servings,
+               COALESCE(u.username, 'System'),
+               EXISTS (SELECT 1 FROM favorites f WHERE f.user_id = ? AND f.meal_id = m.id),
+               c.matched, c.total
+        FROM (
+            SELECT meal_id, COUNT(DISTINCT name_key) AS matched, MAX(key_count) AS total
+            FROM meal_ingredients
+            WHERE name_key IN (SELECT value FROM json_each(?))
+            GROUP BY meal_id
+        ) c
+        JOIN meals m ON m.id = c.meal_id
+        LEFT JOIN users u ON m.user_id = u.id
+        WHERE c.matched >= c.total * ? AND {visible}
+        ORDER BY CAST(c.matched AS REAL) / c.total DESC, c.matched DESC, m.name
+        LIMIT ?
+    ''', [user_id, json.dumps(list(pantry)), min_coverage] + visible_params + [limit])
+    meals = cursor.fetchall()
+    if not meals:
+        return []
+
+    # Check quantities for the returned meals only
+    meal_ids = [meal[0] for meal in meals]
+    cursor.execute(f'''
+        SELECT meal_id, name, name_key, base_quantity, base_unit
+        FROM meal_ingredients
+        WHERE meal_id IN ({','.join('?' * len(meal_ids))})
+    ''', meal_ids)
+    missing = {meal_id: [] for meal_id in meal_ids}
+    short = {meal_id: [] for meal_id in meal_ids}
+    for meal_id, name, name_key, base_quantity, base_unit in cursor.fetchall():
+        stock = pantry.get(name_key)
+        if stock is None:
+            missing[meal_id].append(name)
+        elif base_unit in stock and stock[base_unit] < (base_quantity or 0):
+            short[meal_id].append(name)
+
+    results = []
+    for meal_id, name, category, prep_time, cook_time, servings, username, is_favorited, matched, total in meals:
+        results.append({
+            'id': meal_id,
+            'name': name,
+            'category': category,
+            'prep_time': prep_time,
+            'cook_time': cook_time,
+            'servings': servings,
+            'username': username,
+            'is_favorited': bool(is_favorited),
+            'matched': matched,
+            'total': total,
+            'coverage': round(matched / total, 3),
+            'missing': missing[meal_id],
+            'short': short[meal_id],
+            'can_make': not missing[meal_id] and not short[meal_id]
+        })
+    return results
@@ -0,0 +1,206 @@
+"""
+Meal plan generation for the Meal Planner app.
+Fills a month of breakfast, lunch and dinner slots by weighted sampling:
+meals are weighted by how well their category fits the slot, favorites are
+boosted, and a meal is not repeated within a configurable number of days.
+Generation is pure Python over preloaded candidates so it can run in bulk.
+"""
+
+import bisect
+import calendar
+import itertools
+import random
+from collections import Counter
+from datetime import date, timedelta
+
+from popularity import discount_plan_activity
+
+MEAL_TYPES = ('breakfast', 'lunch', 'dinner')
+
+# How well a meal of each category suits each slot. Categories that are not
+# listed (cuisines such as 'Italian') use DEFAULT_FIT.
+CATEGORY_FIT = {
+    'breakfast': {'breakfast': 1.0, 'lunch': 0.1, 'dinner': 0.05},
+    'lunch': {'breakfast': 0.1, 'lunch': 1.0, 'dinner': 0.6},
+    'dinner': {'breakfast': 0.05, 'lunch': 0.6, 'dinner': 1.0},
+    'snack': {'breakfast': 0.3, 'lunch': 0.2, 'dinner': 0.05},
+    'dessert': {'breakfast': 0.05, 'lunch': 0.1, 'dinner': 0.2},
+}
+DEFAULT_FIT = {'breakfast': 0.15, 'lunch': 1.0, 'dinner': 1.0}
+
+FAVORITE_BOOST = 3.0
+NO_REPEAT_DAYS = 3
+
+# Rejection-sampling attempts before falling back to a scan of allowed meals
+MAX_TRIES = 16
+
+
+def load_shared_candidates(cursor):
+    """Return (meal_id, category) for the meals every user can plan.
+
+    The result does not depend on the user, so callers may cache it.
+    """
+    cursor.execute('''
+        SELECT id, category FROM meals
+        WHERE is_community = TRUE OR user_id IS NULL
+    ''')
+    return cursor.fetchall()
+
+
+def load_candidates(cursor, user_id, shared=None):
+    """Return (meal_id, category, is_favorite) for every meal the user can plan.
+
+    `shared` is a preloaded load_shared_candidates() result.
+    """
+    if shared is None:
+        shared = load_shared_candidates(cursor)
+    cursor.execute('''
+        SELECT id, category FROM meals
+        WHERE user_id = ? AND is_community = FALSE
+    ''', (user_id,))
+    personal = cursor.fetchall()
+    cursor.execute('SELECT meal_id FROM favorites WHERE user_id = ?', (user_id,))
+    favorites = {row[0] for row in cursor.fetchall()}
+    return [(meal_id, category, meal_id in favorites)
+            for meal_id, category in itertools.chain(shared, personal)]
+
+
+def group_candidates(candidates):
+    """Group meal ids by (category, is_favorite), the two things that set a weight"""
+    grouped = {}
+    for meal_id, category, is_favorite in candidates:
+        grouped.setdefault((category, bool(is_favorite)), []).append(meal_id)
+    return grouped
+
+
+def tables_from_groups(grouped, meal_types=MEAL_TYPES, favorite_boost=FAVORITE_BOOST):
+    """Build the sampling tables from a group_candidates() result"""
+    keys = [key for key in grouped if grouped[key]]
+    groups = [grouped[key] for key in keys]
+
+    tables = {}
+    for meal_type in meal_types:
+        fallback = DEFAULT_FIT.get(meal_type, 1.0)
+        weights = []
+        for (category, is_favorite), meal_ids in zip(keys, groups):
+            fit = CATEGORY_FIT.get((category or '').strip().lower(), DEFAULT_FIT).get(meal_type, fallback)
+            weights.append(fit * (favorite_boost if is_favorite else 1.0) * len(meal_ids))
+        tables[meal_type] = (groups, weights, list(itertools.accumulate(weights)))
+    return tables
+
+
+def slot_weights(candidates, meal_types=MEAL_TYPES, favorite_boost=FAVORITE_BOOST):
+    """Precompute {meal_type: (groups, weights, cumulative weights)}.
+
+    Meals with the same category and favorite flag share a weight, so they
+    are grouped and a draw picks a group by total weight, then a meal in it
+    uniformly. This keeps the setup to one pass however many meals there are.
+    """
+    return tables_from_groups(group_candidates(candidates), meal_types, favorite_boost)
+
+
+def _pick(rng, table, allowed):
+    """Draw one meal id by weight, skipping meals that allowed() rejects"""
+    groups, weights, cumulative = table
+    total = cumulative[-1]
+    last = len(groups) - 1
+    for _ in range(MAX_TRIES):
+        meal_ids = groups[min(bisect.bisect_right(cumulative, rng.random() * total), last)]
+        meal_id = meal_ids[int(rng.random() * len(meal_ids))]
+        if allowed(meal_id):
+            return meal_id
+
+    # Most candidates were used recently: sample among the ones that were not
+    choices = []
+    choice_weights = []
+    for meal_ids, weight in zip(groups, weights):
+        for candidate in meal_ids:
+            if allowed(candidate):
+                choices.append(candidate)
+                choice_weights.append(weight / len(meal_ids))
+    if not choices:
+        # Fewer meals than the window needs; a repeat is unavoidable
+        return meal_id
+    return rng.choices(choices, choice_weights)[0]
+
+
+def generate_month(candidates, year, month, seed=None, no_repeat_days=NO_REPEAT_DAYS,
+                   favorite_boost=FAVORITE_BOOST, meal_types=MEAL_TYPES, tables=None):
+    """Return [(date, meal_type, meal_id)] filling every slot of the month.
+
+    A meal used on one day is not picked again for no_repeat_days days
+    (1 only prevents repeats within a day, 0 allows them). The same seed and
+    candidates always give the same plan. Pass tables from slot_weights() to
+    reuse them across months; candidates are then not used.
+    """
+    if tables is None:
+        if not candidates:
+            return []
+        tables = slot_weights(candidates, meal_types, favorite_boost)
+    rng = random.Random(seed)
+
+    last_used = {}
+    slots = []
+    first_day = date(year, month, 1)
+    for offset in range(calendar.monthrange(year, month)[1]):
+        day = first_day + timedelta(days=offset)
+        date_str = day.isoformat()
+        allowed = lambda meal_id: offset - last_used.get(meal_id, -no_repeat_days) >= no_repeat_days
+        for meal_type in meal_types:
+            meal_id = _pick(rng, tables[meal_type], allowed)
+            last_used[meal_id] = offset
+            slots.append((date_str, meal_type, meal_id))
+    return slots
+
+
+def month_bounds(year, month):
+    """Return the first and last date of a month"""
+    start_date = date(year, month, 1)
+    end_date = start_date.replace(day=calendar.monthrange(year, month)[1])
+    return start_date, end_date
+
+
+def save_months(cursor, plans, record_activity=True):
+    """Replace whole months of plans given as [(user_id, year, month, slots)].
+
+    Uses one executemany for the deletes and one for the inserts. The caller
+    commits, so many months can share a transaction. With record_activity
+    off, the slots the write adds or removes are taken back out of today's
+    trending activity, so bulk generation does not swamp real planning.
+    """
+    bounds = [(user_id,) + tuple(day.isoformat() for day in month_bounds(year, month))
+              for user_id, year, month, _ in plans]
+    removed = Counter()
+    if not record_activity:
+        for params in bounds:
+            cursor.execute('''
+                SELECT meal_id, COUNT(*) FROM meal_plan
+                WHERE user_id = ? AND date BETWEEN ? AND ? AND meal_id IS NOT NULL
+                GROUP BY meal_id
+            ''', params)
+            removed.update(dict(cursor.fetchall()))
+    cursor.executemany('DELETE FROM meal_plan WHERE user_id = ? AND date BETWEEN ? AND ?', bounds)
+    cursor.executemany('''
+        INSERT INTO meal_plan (user_id, date, meal_type, meal_id)
+        VALUES (?, ?, ?, ?)
+    ''', [(user_id, date_str, meal_type, meal_id)
+          for user_id, _, _, slots in plans
+          for date_str, meal_type, meal_id in slots])
+    if not record_activity:
+        added = Counter(meal_id for _, _, _, slots in plans
+                        for _, _, meal_id in slots if meal_id is not None)
+        added.subtract(removed)
+        discount_plan_activity(cursor, added)
+
+
+def save_month(cursor, user_id, year, month, slots):
+    """Replace the user's plan for the month with the generated slots. The caller commits."""
+    save_months(cursor, [(user_id, year, month, slots)])
+
+
+def generate_plan(cursor, user_id, year, month, shared=None, **options):
+    """Generate and save a month for one user, returning the number of slots filled"""
+    slots = generate_month(load_candidates(cursor, user_id, shared), year, month, **options)
+    if slots:
+        save_month(cursor, user_id, year, month, slots)
+    return len(slots)
@@ -1,17 +1,31 @@
 from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash
-import sqlite3
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import calendar
 import json
 import os
+import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
+from cache import cache_stats, community_meals_cache, meal_details_cache
+from database import connect, get_db, get_pool, init_app, is_busy_error
+from ingredient_parser import backfill_meal_ingredients, normalize_name, save_meal_ingredients
+from metrics import init_app as init_metrics
+from meal_search import COMMUNITY_SORTS, cached_community_meals, list_user_meals, parse_fields
+from pantry import find_makeable_meals
+from profiling import init_app as init_profiling
+from plan_generator import MEAL_TYPES, NO_REPEAT_DAYS, generate_plan, load_shared_candidates, month_bounds
+from popularity import SCORE_SQL, TRENDING_DAYS, record_copy, refresh_popularity
+from popularity import TRIGGERS as POPULARITY_TRIGGERS
+from units import canonical_unit, humanize
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
+init_app(app)
+init_metrics(app)
+init_profiling(app)
 
 # Database initialization
 def init_db():
-    conn = sqlite3.connect('meal_planner.db')
+    conn = connect()
     cursor = conn.cursor()
     
     # Create users table
@@ -58,18 +72,9 @@ def init_db():
         )
     ''')
     
-    # Create meal_plan table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS meal_plan (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date DATE NOT NULL,
-            meal_id INTEGER,
-            meal_type TEXT,
-            user_id INTEGER,
-            FOREIGN KEY (meal_id) REFERENCES meals (id),
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
+    # Create meal_plan table, one row per (user, date, meal type) slot
+    upgrade_meal_plan(cursor)
+    cursor.execute(MEAL_PLAN_SCHEMA.format(table='meal_plan'))
     
     # Create favorites table
     cursor.execute('''
@@ -99,9 +104,244 @@ def init_db():
         )
     ''')
     
+    # Create meal_ingredients table, the parsed form of meals.ingredients
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meal_ingredients (
+            meal_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            name_key TEXT NOT NULL,
+            quantity REAL,
+            unit TEXT NOT NULL DEFAULT '',
+            base_quantity REAL,
+            base_unit TEXT NOT NULL DEFAULT '',
+            key_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (meal_id, position),
+            FOREIGN KEY (meal_id) REFERENCES meals (id)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Add columns introduced after meal_ingredients was first created, then
+    # parse meals written before it existed or by scripts (all meals if the
+    # table changed)
+    cursor.execute("PRAGMA table_info(meal_ingredients)")
+    columns = [column[1] for column in cursor.fetchall()]
+    added_columns = [
+        ('base_quantity', 'REAL'),
+        ('base_unit', "TEXT NOT NULL DEFAULT ''"),
+        ('key_count', 'INTEGER NOT NULL DEFAULT 0')
+    ]
+    added_columns = [(name, definition) for name, definition in added_columns if name not in columns]
+    for name, definition in added_columns:
+        cursor.execute(f'ALTER TABLE meal_ingredients ADD COLUMN {name} {definition}')
+    backfill_meal_ingredients(cursor, rebuild=bool(added_columns))
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS meals_delete_ingredients AFTER DELETE ON meals
+        BEGIN
+            DELETE FROM meal_ingredients WHERE meal_id = OLD.id;
+        END
+    ''')
+    
+    # Create friendships table, one row per direction once accepted
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS friendships (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            friend_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (friend_id) REFERENCES users (id),
+            UNIQUE(user_id, friend_id)
+        )
+    ''')
+
+    # Full-text index over community meals, kept in sync by triggers
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meals_fts'")
+    fts_exists = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS meals_fts USING fts5(
+            name, ingredients, category,
+            content='meals', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    if not fts_exists:
+        cursor.execute('''
+            INSERT INTO meals_fts (rowid, name, ingredients, category)
+            SELECT id, name, ingredients, category FROM meals WHERE is_community = TRUE
+        ''')
+    fts_triggers = [
+        '''
+        CREATE TRIGGER IF NOT EXISTS meals_fts_insert AFTER INSERT ON meals
+        WHEN NEW.is_community = TRUE
+        BEGIN
+            INSERT INTO meals_fts (rowid, name, ingredients, category)
+            VALUES (NEW.id, NEW.name, NEW.ingredients, NEW.category);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS meals_fts_delete AFTER DELETE ON meals
+        WHEN OLD.is_community = TRUE
+        BEGIN
+            INSERT INTO meals_fts (meals_fts, rowid, name, ingredients, category)
+            VALUES ('delete', OLD.id, OLD.name, OLD.ingredients, OLD.category);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS meals_fts_update AFTER UPDATE ON meals
+        BEGIN
+            INSERT INTO meals_fts (meals_fts, rowid, name, ingredients, category)
+            SELECT 'delete', OLD.id, OLD.name, OLD.ingredients, OLD.category
+            WHERE OLD.is_community = TRUE;
+            INSERT INTO meals_fts (rowid, name, ingredients, category)
+            SELECT NEW.id, NEW.name, NEW.ingredients, NEW.category
+            WHERE NEW.is_community = TRUE;
+        END
+        '''
+    ]
+    for trigger in fts_triggers:
+        cursor.execute(trigger)
+
+    # Version counters read by the in-process caches; bumped by triggers so
+    # writes from any worker or script invalidate every worker's cache
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('meals', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS meals_version_{event.lower()} AFTER {event} ON meals
+            BEGIN
+                UPDATE cache_versions SET version = version + 1 WHERE name = 'meals';
+            END
+        ''')
+
+    # Per-user plan versions behind the ETag of /api/plan
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS plan_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    plan_triggers = [
+        '''
+        CREATE TRIGGER IF NOT EXISTS meal_plan_version_insert AFTER INSERT ON meal_plan
+        BEGIN
+            INSERT INTO plan_versions (user_id, version) VALUES (NEW.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS meal_plan_version_update AFTER UPDATE ON meal_plan
+        BEGIN
+            INSERT INTO plan_versions (user_id, version) VALUES (NEW.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+            INSERT INTO plan_versions (user_id, version)
+            SELECT OLD.user_id, 1 WHERE OLD.user_id IS NOT NEW.user_id
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS meal_plan_version_delete AFTER DELETE ON meal_plan
+        BEGIN
+            INSERT INTO plan_versions (user_id, version) VALUES (OLD.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+        END
+        '''
+    ]
+    for trigger in plan_triggers:
+        cursor.execute(trigger)
+
+    # Popularity counters per meal, plus the same counts per day for trending
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meal_stats'")
+    stats_exist = cursor.fetchone() is not None
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS meal_stats (
+            meal_id INTEGER PRIMARY KEY,
+            favorites INTEGER NOT NULL DEFAULT 0,
+            planned INTEGER NOT NULL DEFAULT 0,
+            copied INTEGER NOT NULL DEFAULT 0,
+            score INTEGER GENERATED ALWAYS AS ({SCORE_SQL}) VIRTUAL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meal_activity (
+            day TEXT NOT NULL,
+            meal_id INTEGER NOT NULL,
+            favorites INTEGER NOT NULL DEFAULT 0,
+            planned INTEGER NOT NULL DEFAULT 0,
+            copied INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, meal_id)
+        ) WITHOUT ROWID
+    ''')
+    for trigger in POPULARITY_TRIGGERS:
+        cursor.execute(trigger)
+    if not stats_exist:
+        refresh_popularity(cursor)
+
+    # Create indexes
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS idx_meals_user_id ON meals(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_meals_category ON meals(category)",
+        # Lets the community meal list page through meals in name order
+        "CREATE INDEX IF NOT EXISTS idx_meals_community_name ON meals(is_community, name, id)",
+        # Lets the community meal list page through meals by popularity
+        "CREATE INDEX IF NOT EXISTS idx_meal_stats_score ON meal_stats(score DESC, meal_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ingredients_user_id ON ingredients(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_shopping_list_user_id ON shopping_list(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_favorites_user_id ON favorites(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_friendships_friend_id ON friendships(friend_id, status)",
+        # Inverted index from ingredient to meals, covering the pantry matcher
+        "CREATE INDEX IF NOT EXISTS idx_meal_ingredients_name_key ON meal_ingredients(name_key, meal_id, key_count)"
+    ]
+    for index in indexes:
+        cursor.execute(index)
+    
     conn.commit()
     conn.close()
 
+MEAL_PLAN_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        user_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        meal_type TEXT NOT NULL,
+        meal_id INTEGER,
+        PRIMARY KEY (user_id, date, meal_type),
+        FOREIGN KEY (meal_id) REFERENCES meals (id),
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    ) WITHOUT ROWID
+'''
+
+def upgrade_meal_plan(cursor):
+    """Rebuild an old rowid meal_plan table on the (user_id, date, meal_type) key.
+
+    Duplicate slots keep their most recently written row. Rows without a
+    user or meal type can never be read back and are dropped.
+    """
+    cursor.execute("PRAGMA table_info(meal_plan)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'id' not in columns:
+        return
+    
+    cursor.execute('DROP TABLE IF EXISTS meal_plan_new')
+    cursor.execute(MEAL_PLAN_SCHEMA.format(table='meal_plan_new'))
+    cursor.execute('''
+        INSERT INTO meal_plan_new (user_id, date, meal_type, meal_id)
+        SELECT user_id, date, meal_type, meal_id
+        FROM meal_plan
+        WHERE id IN (
+            SELECT MAX(id) FROM meal_plan
+            WHERE user_id IS NOT NULL AND meal_type IS NOT NULL
+            GROUP BY user_id, date, meal_type
+        )
+    ''')
+    cursor.execute('DROP TABLE meal_plan')
+    cursor.execute('ALTER TABLE meal_plan_new RENAME TO meal_plan')
+
 # Login required decorator
 def login_required(f):
     def decorated_function(*args, **kwargs):
@@ -127,14 +367,13 @@ def register():
         email = request.form['email']
         password = request.form['password']
         
-        conn = sqlite3.connect('meal_planner.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         # Check if user already exists
         cursor.execute('SELECT id FROM users WHERE username = ? OR email = ?', (username, email))
         if cursor.fetchone():
             flash('Username or email already exists!')
-            conn.close()
             return render_template('register.html')
         
         # Create new user
@@ -142,7 +381,6 @@ def register():
         cursor.execute('INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)', 
                       (username, email, password_hash))
         conn.commit()
-        conn.close()
         
         flash('Registration successful! Please log in.')
         return redirect(url_for('login'))
@@ -155,11 +393,10 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        conn = sqlite3.connect('meal_planner.db')
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('SELECT id, username, password_hash FROM users WHERE username = ?', (username,))
         user = cursor.fetchone()
-        conn.close()
         
         if user and check_password_hash(user[2], password):
             session['user_id'] = user[0]
@@ -183,96 +420,16 @@ def dashboard():
 @app.route('/meals')
 @login_required
 def meals():
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Get user's favorites
-    cursor.execute('SELECT meal_id FROM favorites WHERE user_id = ?', (session['user_id'],))
-    user_favorites = {row[0] for row in cursor.fetchall()}
-    
-    # Get personal meals
-    cursor.execute('SELECT * FROM meals WHERE user_id = ? AND is_community = FALSE ORDER BY name', (session['user_id'],))
-    personal_meals = cursor.fetchall()
-    
-    # Get community meals (including former default meals)
-    cursor.execute('''
-        SELECT m.*, COALESCE(u.username, 'System') as username 
-        FROM meals m 
-        LEFT JOIN users u ON m.user_id = u.id 
-        WHERE m.is_community = TRUE 
-        ORDER BY m.name
-    ''')
-    community_meals = cursor.fetchall()
-    
-    # Get favorite meals
-    cursor.execute('''
-        SELECT m.*, COALESCE(u.username, 'System') as username 
-        FROM favorites f
-        JOIN meals m ON f.meal_id = m.id
-        LEFT JOIN users u ON m.user_id = u.id
-        WHERE f.user_id = ?
-        ORDER BY m.name
-    ''', (session['user_id'],))
-    favorite_meals = cursor.fetchall()
-    
-    conn.close()
-    
-    personal_list = []
-    for meal in personal_meals:
-        personal_list.append({
-            'id': meal[0],
-            'name': meal[1],
-            'ingredients': meal[2],
-            'instructions': meal[3],
-            'prep_time': meal[4],
-            'cook_time': meal[5],
-            'servings': meal[6],
-            'category': meal[7],
-            'user_id': meal[8],
-            'is_community': meal[9],
-            'is_favorited': meal[0] in user_favorites,
-            'type': 'personal'
-        })
-    
-    community_list = []
-    for meal in community_meals:
-        community_list.append({
-            'id': meal[0],
-            'name': meal[1],
-            'ingredients': meal[2],
-            'instructions': meal[3],
-            'prep_time': meal[4],
-            'cook_time': meal[5],
-            'servings': meal[6],
-            'category': meal[7],
-            'user_id': meal[8],
-            'is_community': meal[9],
-            'username': meal[10],
-            'is_favorited': meal[0] in user_favorites,
-            'type': 'community'
-        })
-    
-    favorite_list = []
-    for meal in favorite_meals:
-        favorite_list.append({
-            'id': meal[0],
-            'name': meal[1],
-            'ingredients': meal[2],
-            'instructions': meal[3],
-            'prep_time': meal[4],
-            'cook_time': meal[5],
-            'servings': meal[6],
-            'category': meal[7],
-            'user_id': meal[8],
-            'is_community': meal[9],
-            'username': meal[10],
-            'is_favorited': True,
-            'type': 'favorite'
-        })
+    # Cards only need their summary fields; full text is fetched by the details modal
+    personal_list = list_user_meals(cursor, session['user_id'], 'personal')
+    favorite_list = list_user_meals(cursor, session['user_id'], 'favorites')
     
+    # Community meals are paged in by the browser from /community_meals
     return render_template('meals.html', 
                          personal_meals=personal_list, 
-                         community_meals=community_list, 
                          favorite_meals=favorite_list)
 
 @app.route('/add_meal', methods=['POST'])
@@ -280,7 +437,7 @@ def meals():
 def add_meal():
     data = request.get_json()
     
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Always add to personal meals first
@@ -290,6 +447,8 @@ def add_meal():
     ''', (data['name'], data['ingredients'], data['instructions'], 
           data['prep_time'], data['cook_time'], data['servings'], data['category'], 
           session['user_id']))
+    meal_id = cursor.lastrowid
+    save_meal_ingredients(cursor, meal_id, data['ingredients'])
     
     # If user wants to share with community, also add a community version
     if data.get('is_community', False):
@@ -299,20 +458,20 @@ def add_meal():
         ''', (data['name'], data['ingredients'], data['instructions'], 
               data['prep_time'], data['cook_time'], data['servings'], data['category'], 
               session['user_id']))
+        meal_id = cursor.lastrowid
+        save_meal_ingredients(cursor, meal_id, data['ingredients'])
     
     conn.commit()
-    conn.close()
     
-    return jsonify({'success': True, 'id': cursor.lastrowid})
+    return jsonify({'success': True, 'id': meal_id})
 
 @app.route('/delete_meal/<int:meal_id>', methods=['DELETE'])
 @login_required
 def delete_meal(meal_id):
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('DELETE FROM meals WHERE id = ? AND user_id = ?', (meal_id, session['user_id']))
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True})
 
@@ -320,7 +479,7 @@ def delete_meal(meal_id):
 @login_required
 def add_to_my_meals(meal_id):
     """Copy a community meal to user's personal meals"""
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get the meal details
@@ -338,7 +497,6 @@ def add_to_my_meals(meal_id):
         ''', (session['user_id'], meal[0]))
         
         if cursor.fetchone():
-            conn.close()
             return jsonify({'success': False, 'message': 'You already have this meal in your collection'})
         
         # Add the meal to user's personal meals
@@ -346,29 +504,115 @@ def add_to_my_meals(meal_id):
             INSERT INTO meals (name, ingredients, instructions, prep_time, cook_time, servings, category, user_id, is_community)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, FALSE)
         ''', (meal[0], meal[1], meal[2], meal[3], meal[4], meal[5], meal[6], session['user_id']))
-        
+        save_meal_ingredients(cursor, cursor.lastrowid, meal[1])
+        record_copy(cursor, meal_id)
+
         conn.commit()
-        conn.close()
         return jsonify({'success': True, 'message': 'Meal added to your collection'})
     else:
-        conn.close()
         return jsonify({'success': False, 'message': 'Meal not found'})
 
+FRIENDS_PER_PAGE = 12
+COMMUNITY_PAGE_SIZE = 24
+# /get_favorites has always returned full meals unless asked for less
+FAVORITE_FIELDS = ('id', 'name', 'ingredients', 'instructions', 'prep_time', 'cook_time',
+                   'servings', 'category', 'user_id', 'is_community', 'username')
+
+def group_plan_by_date(rows):
+    """Turn (date, meal_type, name) rows into {date: {meal_type: name}}"""
+    plan = {}
+    for date_str, meal_type, name in rows:
+        plan.setdefault(date_str, {})[meal_type] = name
+    return plan
+
+@app.route('/community_meals')
+@login_required
+def community_meals():
+    """One page of community meals, optionally filtered by a full-text search.
+
+    Without a search, `sort` lists them by name, popularity or trending.
+    """
+    query = request.args.get('q', '').strip()
+    sort = request.args.get('sort', 'name')
+    limit = min(max(request.args.get('limit', COMMUNITY_PAGE_SIZE, type=int), 1), 100)
+    days = min(max(request.args.get('days', TRENDING_DAYS, type=int), 1), 90)
+    if sort not in COMMUNITY_SORTS:
+        return jsonify({'success': False, 'message': f'Unknown sort: {sort}'}), 400
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    conn = get_db()
+    cursor = conn.cursor()
+    meals, next_cursor = cached_community_meals(cursor, session['user_id'], query,
+                                                request.args.get('cursor'), limit, fields,
+                                                sort=sort, days=days)
+    
+    return jsonify({'success': True, 'meals': meals, 'next_cursor': next_cursor})
+
+@app.route('/my_meals/<scope>')
+@login_required
+def my_meals(scope):
+    """The user's personal or favorite meals, with only the requested fields"""
+    if scope not in ('personal', 'favorites'):
+        return jsonify({'success': False, 'message': 'Unknown meal list'}), 404
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    meals = list_user_meals(cursor, session['user_id'], scope, fields)
+    
+    return jsonify({'success': True, 'meals': meals})
+
+@app.route('/makeable_meals')
+@login_required
+def makeable_meals():
+    """Community meals ranked by how much of them the user's ingredients cover"""
+    min_coverage = min(max(request.args.get('min_coverage', 0.5, type=float), 0.0), 1.0)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    include_personal = request.args.get('include_personal') == '1'
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    meals = find_makeable_meals(cursor, session['user_id'], min_coverage, limit, include_personal)
+    
+    return jsonify({'success': True, 'meals': meals})
+
 @app.route('/friends')
 @login_required
 def friends():
     """Friends page showing other users' meal plans"""
-    conn = sqlite3.connect('meal_planner.db')
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Get all users except current user
+    # Get one page of accepted friends (one extra row tells us if there is a next page)
     cursor.execute('''
-        SELECT id, username 
-        FROM users 
-        WHERE id != ? 
-        ORDER BY username
-    ''', (session['user_id'],))
+        SELECT u.id, u.username 
+        FROM friendships f 
+        JOIN users u ON f.friend_id = u.id 
+        WHERE f.user_id = ? AND f.status = 'accepted' 
+        ORDER BY u.username
+        LIMIT ? OFFSET ?
+    ''', (session['user_id'], FRIENDS_PER_PAGE + 1, (page - 1) * FRIENDS_PER_PAGE))
     users = cursor.fetchall()
+    has_next = len(users) > FRIENDS_PER_PAGE
+    users = users[:FRIENDS_PER_PAGE]
+    
+    # Get friend requests waiting for this user
+    cursor.execute('''
+        SELECT u.id, u.username 
+        FROM friendships f 
+        JOIN users u ON f.user_id = u.id 
+        WHERE f.friend_id = ? AND f.status = 'pending' 
+        ORDER BY f.created_at
+    ''', (session['user_id'],))
+    pending_requests = [{'id': row[0], 'username': row[1]} for row in cursor.fetchall()]
     
     # Get today's date and week dates
     today = datetime.now().date()
@@ -376,83 +620,165 @@ def friends():
     week_end = week_start + timedelta(days=6)
     
     # Get current month's dates for full month view
-    now = datetime.now()
-    year = now.year
-    month = now.month
-    start_date = datetime(year, month, 1).date()
-    end_date = (datetime(year, month + 1, 1) - timedelta(days=1)).date()
+    year = today.year
+    month = today.month
+    start_date, end_date = month_bounds(year, month)
+    
+    # Fetch the plans of every shown user in one query; the range also
+    # covers a week that straddles the month boundary
+    plans = {user[0]: [] for user in users}
+    if users:
+        placeholders = ','.join('?' * len(users))
+        cursor.execute(f'''
+            SELECT mp.user_id, mp.date, mp.meal_type, m.name 
+            FROM meal_plan mp 
+            JOIN meals m ON mp.meal_id = m.id 
+            WHERE mp.user_id IN ({placeholders}) AND mp.date BETWEEN ? AND ?
+            ORDER BY mp.user_id, mp.date, mp.meal_type
+        ''', [user[0] for user in users] + [min(start_date, week_start), max(end_date, week_end)])
+        for user_id, date_str, meal_type, name in cursor.fetchall():
+            plans[user_id].append((date_str, meal_type, name))
+    
+    today_str = today.isoformat()
+    week_range = (week_start.isoformat(), week_end.isoformat())
+    month_range = (start_date.isoformat(), end_date.isoformat())
     
     friends_data = []
     for user in users:
-        # Get today's meals
-        cursor.execute('''
-            SELECT mp.meal_type, m.name 
-            FROM meal_plan mp 
-            JOIN meals m ON mp.meal_id = m.id 
-            WHERE mp.date = ? AND mp.user_id = ?
-            ORDER BY mp.meal_type
-        ''', (today, user[0]))
-        today_meals = cursor.fetchall()
-        
-        # Get weekly meals
-        cursor.execute('''
-            SELECT mp.date, mp.meal_type, m.name 
-            FROM meal_plan mp 
-            JOIN meals m ON mp.meal_id = m.id 
-            WHERE mp.date BETWEEN ? AND ? AND mp.user_id = ?
-            ORDER BY mp.date, mp.meal_type
-        ''', (week_start, week_end, user[0]))
-        weekly_meals = cursor.fetchall()
-        
-        # Get monthly meals
-        cursor.execute('''
-            SELECT mp.date, mp.meal_type, m.name 
-            FROM meal_plan mp 
-            JOIN meals m ON mp.meal_id = m.id 
-            WHERE mp.date BETWEEN ? AND ? AND mp.user_id = ?
-            ORDER BY mp.date, mp.meal_type
-        ''', (start_date, end_date, user[0]))
-        monthly_meals = cursor.fetchall()
-        
-        # Organize meals by date
-        today_dict = {}
-        for meal in today_meals:
-            today_dict[meal[0]] = meal[1]
-        
-        weekly_dict = {}
-        for meal in weekly_meals:
-            date_str = meal[0]
-            if date_str not in weekly_dict:
-                weekly_dict[date_str] = {}
-            weekly_dict[date_str][meal[1]] = meal[2]
-        
-        monthly_dict = {}
-        for meal in monthly_meals:
-            date_str = meal[0]
-            if date_str not in monthly_dict:
-                monthly_dict[date_str] = {}
-            monthly_dict[date_str][meal[1]] = meal[2]
-        
+        rows = plans[user[0]]
         friends_data.append({
             'id': user[0],
             'username': user[1],
-            'today_meals': today_dict,
-            'weekly_meals': weekly_dict,
-            'monthly_meals': monthly_dict
+            'today_meals': {row[1]: row[2] for row in rows if row[0] == today_str},
+            'weekly_meals': group_plan_by_date(row for row in rows if week_range[0] <= row[0] <= week_range[1]),
+            'days_planned': len({row[0] for row in rows if month_range[0] <= row[0] <= month_range[1]})
         })
     
-    conn.close()
+    return render_template('friends.html', friends=friends_data, month_name=calendar.month_name[month], year=year, today=today,
+                           page=page, has_next=has_next, pending_requests=pending_requests)
+
+def are_friends(cursor, user_id, friend_id):
+    """Check for an accepted friendship between two users"""
+    cursor.execute('''
+        SELECT 1 FROM friendships 
+        WHERE user_id = ? AND friend_id = ? AND status = 'accepted'
+    ''', (user_id, friend_id))
+    return cursor.fetchone() is not None
+
+def accept_friendship(cursor, requester_id, user_id):
+    """Accept a request from requester_id and store the reverse direction"""
+    cursor.execute('''
+        UPDATE friendships SET status = 'accepted' 
+        WHERE user_id = ? AND friend_id = ? AND status = 'pending'
+    ''', (requester_id, user_id))
+    if cursor.rowcount == 0:
+        return False
+    cursor.execute('''
+        INSERT INTO friendships (user_id, friend_id, status) VALUES (?, ?, 'accepted')
+        ON CONFLICT (user_id, friend_id) DO UPDATE SET status = 'accepted'
+    ''', (user_id, requester_id))
+    return True
+
+@app.route('/add_friend', methods=['POST'])
+@login_required
+def add_friend():
+    """Send a friend request by user id or username"""
+    data = request.get_json()
+    friend = str(data.get('friend', '')).strip()
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    if friend.isdigit():
+        cursor.execute('SELECT id, username FROM users WHERE id = ?', (int(friend),))
+    else:
+        cursor.execute('SELECT id, username FROM users WHERE username = ?', (friend,))
+    user = cursor.fetchone()
+    
+    if not user:
+        return jsonify({'success': False, 'message': 'User not found'})
+    if user[0] == session['user_id']:
+        return jsonify({'success': False, 'message': 'You cannot add yourself as a friend'})
+    if are_friends(cursor, session['user_id'], user[0]):
+        return jsonify({'success': False, 'message': f'You are already friends with {user[1]}'})
+    
+    # If they already asked us, adding them back accepts their request
+    if accept_friendship(cursor, user[0], session['user_id']):
+        conn.commit()
+        return jsonify({'success': True, 'status': 'accepted', 'message': f'You are now friends with {user[1]}'})
+    
+    cursor.execute('''
+        INSERT INTO friendships (user_id, friend_id, status) VALUES (?, ?, 'pending')
+        ON CONFLICT (user_id, friend_id) DO NOTHING
+    ''', (session['user_id'], user[0]))
+    conn.commit()
+    
+    return jsonify({'success': True, 'status': 'pending', 'message': f'Friend request sent to {user[1]}'})
+
+@app.route('/accept_friend/<int:friend_id>', methods=['POST'])
+@login_required
+def accept_friend(friend_id):
+    conn = get_db()
+    cursor = conn.cursor()
     
-    return render_template('friends.html', friends=friends_data, month_name=calendar.month_name[month], year=year, today=today)
+    if not accept_friendship(cursor, friend_id, session['user_id']):
+        return jsonify({'success': False, 'message': 'Friend request not found'})
+    
+    conn.commit()
+    return jsonify({'success': True, 'message': 'Friend request accepted'})
+
+@app.route('/remove_friend/<int:friend_id>', methods=['POST'])
+@login_required
+def remove_friend(friend_id):
+    """Remove a friend, or decline or cancel a pending request"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        DELETE FROM friendships 
+        WHERE (user_id = ? AND friend_id = ?) OR (user_id = ? AND friend_id = ?)
+    ''', (session['user_id'], friend_id, friend_id, session['user_id']))
+    conn.commit()
+    
+    return jsonify({'success': True, 'message': 'Friend removed'})
+
+@app.route('/friend_meals/<int:friend_id>')
+@login_required
+def friend_meals(friend_id):
+    """A friend's meal plan for one month, loaded when their monthly view is expanded"""
+    today = datetime.now().date()
+    year = request.args.get('year', today.year, type=int)
+    month = request.args.get('month', today.month, type=int)
+    if not 1 <= month <= 12 or not 1 <= year <= 9999:
+        return jsonify({'error': 'Invalid month'}), 400
+    start_date, end_date = month_bounds(year, month)
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    if not are_friends(cursor, session['user_id'], friend_id):
+        return jsonify({'error': 'Not a friend'}), 403
+    
+    cursor.execute('''
+        SELECT mp.date, mp.meal_type, m.name 
+        FROM meal_plan mp 
+        JOIN meals m ON mp.meal_id = m.id 
+        WHERE mp.user_id = ? AND mp.date BETWEEN ? AND ?
+        ORDER BY mp.date, mp.meal_type
+    ''', (friend_id, start_date, end_date))
+    
+    return jsonify({
+        'year': year,
+        'month': month,
+        'month_name': calendar.month_name[month],
+        'meals': group_plan_by_date(cursor.fetchall())
+    })
 
 @app.route('/ingredients')
 @login_required
 def ingredients():
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM ingredients WHERE user_id = ? ORDER BY name', (session['user_id'],))
     ingredients_data = cursor.fetchall()
-    conn.close()
     
     ingredients_list = []
     for ingredient in ingredients_data:
@@ -465,49 +791,50 @@ def ingredients():
             'expiry_date': ingredient[5]
         })
     
-    return render_template('ingredients.html', ingredients=ingredients_list)
+    return render_template('ingredients.html', ingredients=ingredients_list,
+                           today=date.today().isoformat())
 
 @app.route('/add_ingredient', methods=['POST'])
 @login_required
 def add_ingredient():
     data = request.get_json()
     
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         INSERT INTO ingredients (name, quantity, unit, category, expiry_date, user_id)
         VALUES (?, ?, ?, ?, ?, ?)
     ''', (data['name'], data['quantity'], data['unit'], data['category'], data['expiry_date'], session['user_id']))
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True, 'id': cursor.lastrowid})
 
 @app.route('/delete_ingredient/<int:ingredient_id>', methods=['DELETE'])
 @login_required
 def delete_ingredient(ingredient_id):
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('DELETE FROM ingredients WHERE id = ? AND user_id = ?', (ingredient_id, session['user_id']))
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True})
 
 @app.route('/calendar')
 @login_required
 def calendar_view():
-    # Get current month
+    # Get the requested month, defaulting to the current one
     now = datetime.now()
-    year = now.year
-    month = now.month
+    year = request.args.get('year', now.year, type=int)
+    month = request.args.get('month', now.month, type=int)
+    if not 1 <= month <= 12 or not 1 <= year <= 9999:
+        year, month = now.year, now.month
     
     # Get calendar data
     cal = calendar.monthcalendar(year, month)
     month_name = calendar.month_name[month]
     
     # Get meals for meal planning (personal + community + default meals)
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get personal meals
@@ -518,54 +845,28 @@ def calendar_view():
     ''', (session['user_id'],))
     personal_meals = cursor.fetchall()
     
-    # Get community meals (including former default meals)
-    cursor.execute('''
-        SELECT id, name FROM meals 
-        WHERE is_community = TRUE
-        ORDER BY name
-    ''')
-    community_meals = cursor.fetchall()
+    # Get community meals (including former default meals), shared by every user
+    def load_community_meals():
+        cursor.execute('''
+            SELECT id, name FROM meals 
+            WHERE is_community = TRUE
+            ORDER BY name
+        ''')
+        return cursor.fetchall()
+    community_meals = community_meals_cache.get_or_load(cursor, ('calendar',), load_community_meals)
     
     # Combine all meals for backward compatibility
     meals = personal_meals + community_meals
     
-    # Get ingredients for the user
-    cursor.execute('SELECT * FROM ingredients WHERE user_id = ? ORDER BY name', (session['user_id'],))
-    ingredients_data = cursor.fetchall()
-    
-    ingredients_list = []
-    for ingredient in ingredients_data:
-        ingredients_list.append({
-            'id': ingredient[0],
-            'name': ingredient[1],
-            'quantity': ingredient[2],
-            'unit': ingredient[3],
-            'category': ingredient[4],
-            'expiry_date': ingredient[5]
-        })
-    
-    # Get existing meal plan for this month
-    start_date = datetime(year, month, 1).date()
-    end_date = (datetime(year, month + 1, 1) - timedelta(days=1)).date()
-    
+    # The page only shows counts of the user's ingredients
     cursor.execute('''
-        SELECT mp.date, mp.meal_type, m.name 
-        FROM meal_plan mp 
-        JOIN meals m ON mp.meal_id = m.id 
-        WHERE mp.date BETWEEN ? AND ? AND mp.user_id = ?
-        ORDER BY mp.date
-    ''', (start_date, end_date, session['user_id']))
-    meal_plan = cursor.fetchall()
-    conn.close()
-    
-    # Organize meal plan by date
-    meal_plan_dict = {}
-    for plan in meal_plan:
-        date_str = plan[0]
-        if date_str not in meal_plan_dict:
-            meal_plan_dict[date_str] = {}
-        meal_plan_dict[date_str][plan[1]] = plan[2]
+        SELECT COUNT(*), COUNT(DISTINCT COALESCE(category, '')), COUNT(expiry_date)
+        FROM ingredients WHERE user_id = ?
+    ''', (session['user_id'],))
+    total, categories, expiring = cursor.fetchone()
+    ingredient_stats = {'total': total, 'categories': categories, 'expiring': expiring}
     
+    # The month's plan is fetched by the page from /api/plan/<year>/<month>
     return render_template('calendar.html', 
                          calendar=cal, 
                          month_name=month_name, 
@@ -574,14 +875,58 @@ def calendar_view():
                          meals=meals,
                          personal_meals=personal_meals,
                          community_meals=community_meals,
-                         ingredients=ingredients_list,
-                         meal_plan=meal_plan_dict)
+                         ingredient_stats=ingredient_stats)
+
+def plan_etag(cursor, user_id, year, month):
+    """Strong ETag for a user's month plan.
+    
+    Triggers bump plan_versions on every change to the user's meal_plan rows
+    and cache_versions on every change to meals, so the tag changes whenever
+    the plan or the names of its meals could have.
+    """
+    cursor.execute('''
+        SELECT COALESCE((SELECT version FROM plan_versions WHERE user_id = ?), 0),
+               COALESCE((SELECT version FROM cache_versions WHERE name = 'meals'), 0)
+    ''', (user_id,))
+    plan_version, meals_version = cursor.fetchone()
+    return f'{user_id}-{year}-{month:02d}-p{plan_version}-m{meals_version}'
+
+@app.route('/api/plan/<int:year>/<int:month>')
+@login_required
+def api_plan(year, month):
+    """The user's meal plan for a month as JSON, answering 304 when unchanged"""
+    if not 1 <= month <= 12 or not 1 <= year <= 9999:
+        return jsonify({'success': False, 'message': 'Invalid month'}), 404
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    etag = plan_etag(cursor, session['user_id'], year, month)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        start_date, end_date = month_bounds(year, month)
+        cursor.execute('''
+            SELECT mp.date, mp.meal_type, m.id, m.name 
+            FROM meal_plan mp 
+            JOIN meals m ON mp.meal_id = m.id 
+            WHERE mp.user_id = ? AND mp.date BETWEEN ? AND ?
+        ''', (session['user_id'], start_date.isoformat(), end_date.isoformat()))
+        plan = {}
+        for date_str, meal_type, meal_id, name in cursor.fetchall():
+            plan.setdefault(date_str, {})[meal_type] = {'id': meal_id, 'name': name}
+        response = jsonify({'success': True, 'year': year, 'month': month, 'plan': plan})
+    
+    # Browsers revalidate on every view and get an empty 304 while the plan is unchanged
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/get_day_meals/<date>')
 @login_required
 def get_day_meals(date):
     """Get detailed meal information for a specific day"""
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get meal plan for the specific date
@@ -609,26 +954,25 @@ def get_day_meals(date):
             'category': meal[8]
         }
     
-    conn.close()
     return jsonify(day_meals)
 
 @app.route('/get_meal_details/<int:meal_id>')
 @login_required
 def get_meal_details(meal_id):
     """Get detailed meal information"""
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT id, name, ingredients, instructions, prep_time, cook_time, servings, category, user_id, is_community
-        FROM meals 
-        WHERE id = ?
-    ''', (meal_id,))
-    meal = cursor.fetchone()
-    conn.close()
-    
-    if meal:
-        return jsonify({
+    def load_meal():
+        cursor.execute('''
+            SELECT id, name, ingredients, instructions, prep_time, cook_time, servings, category, user_id, is_community
+            FROM meals 
+            WHERE id = ?
+        ''', (meal_id,))
+        meal = cursor.fetchone()
+        if not meal:
+            return None
+        return {
             'id': meal[0],
             'name': meal[1],
             'ingredients': meal[2],
@@ -639,7 +983,11 @@ def get_meal_details(meal_id):
             'category': meal[7],
             'user_id': meal[8],
             'is_community': meal[9]
-        })
+        }
+    meal = meal_details_cache.get_or_load(cursor, meal_id, load_meal)
+    
+    if meal:
+        return jsonify(meal)
     else:
         return jsonify({'error': 'Meal not found'}), 404
 
@@ -648,31 +996,91 @@ def get_meal_details(meal_id):
 def save_meal_plan():
     data = request.get_json()
     
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Clear existing meal plan for this specific meal type, date and user
-    cursor.execute('DELETE FROM meal_plan WHERE date = ? AND meal_type = ? AND user_id = ?', 
-                   (data['date'], data['meal_type'], session['user_id']))
-    
-    # Add new meal plan
     if data['meal_id']:
+        # Fill or replace the slot in a single write
         cursor.execute('''
-            INSERT INTO meal_plan (date, meal_id, meal_type, user_id)
+            INSERT INTO meal_plan (user_id, date, meal_type, meal_id)
             VALUES (?, ?, ?, ?)
-        ''', (data['date'], data['meal_id'], data['meal_type'], session['user_id']))
+            ON CONFLICT (user_id, date, meal_type) DO UPDATE SET meal_id = excluded.meal_id
+        ''', (session['user_id'], data['date'], data['meal_type'], data['meal_id']))
+    else:
+        # Clear the slot
+        cursor.execute('DELETE FROM meal_plan WHERE user_id = ? AND date = ? AND meal_type = ?', 
+                       (session['user_id'], data['date'], data['meal_type']))
     
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True})
 
+@app.route('/save_meal_plan_batch', methods=['POST'])
+@login_required
+def save_meal_plan_batch():
+    """Apply any number of slot changes in one transaction.
+    
+    Expects {"slots": [{"date": "YYYY-MM-DD", "meal_type": "lunch", "meal_id": 3}, ...]},
+    where a missing or empty meal_id clears the slot. Returns the saved slots
+    with meal names so the calendar can update without reloading.
+    """
+    data = request.get_json(silent=True) or {}
+    slots = data.get('slots')
+    if not isinstance(slots, list) or not slots:
+        return jsonify({'success': False, 'message': 'No slots to save'}), 400
+    
+    # Later changes to the same slot win
+    changes = {}
+    for slot in slots:
+        if not isinstance(slot, dict):
+            return jsonify({'success': False, 'message': 'Invalid slot'}), 400
+        date_str = slot.get('date')
+        meal_type = slot.get('meal_type')
+        try:
+            datetime.strptime(date_str or '', '%Y-%m-%d')
+            meal_id = int(slot['meal_id']) if slot.get('meal_id') else None
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Invalid slot'}), 400
+        if meal_type not in MEAL_TYPES:
+            return jsonify({'success': False, 'message': f'Invalid meal type: {meal_type}'}), 400
+        changes[(date_str, meal_type)] = meal_id
+    
+    user_id = session['user_id']
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    cursor.executemany('''
+        INSERT INTO meal_plan (user_id, date, meal_type, meal_id)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id, date, meal_type) DO UPDATE SET meal_id = excluded.meal_id
+    ''', [(user_id, date_str, meal_type, meal_id)
+          for (date_str, meal_type), meal_id in changes.items() if meal_id])
+    cursor.executemany('DELETE FROM meal_plan WHERE user_id = ? AND date = ? AND meal_type = ?',
+                       [(user_id, date_str, meal_type)
+                        for (date_str, meal_type), meal_id in changes.items() if not meal_id])
+    
+    # Read back what the changed slots now hold
+    keys = json.dumps([[date_str, meal_type] for date_str, meal_type in changes])
+    cursor.execute('''
+        SELECT json_extract(k.value, '$[0]'), json_extract(k.value, '$[1]'), mp.meal_id, m.name
+        FROM json_each(?) k
+        LEFT JOIN meal_plan mp ON mp.user_id = ? AND mp.date = json_extract(k.value, '$[0]')
+            AND mp.meal_type = json_extract(k.value, '$[1]')
+        LEFT JOIN meals m ON m.id = mp.meal_id
+    ''', (keys, user_id))
+    saved = [{'date': date_str, 'meal_type': meal_type, 'meal_id': meal_id, 'meal_name': name}
+             for date_str, meal_type, meal_id, name in cursor.fetchall()]
+    
+    conn.commit()
+    
+    return jsonify({'success': True, 'slots': saved})
+
 @app.route('/delete_planned_meal', methods=['POST'])
 @login_required
 def delete_planned_meal():
     data = request.get_json()
     
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Delete the specific planned meal
@@ -680,78 +1088,76 @@ def delete_planned_meal():
                    (data['date'], data['meal_type'], session['user_id']))
     
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True})
 
 @app.route('/toggle_favorite/<int:meal_id>', methods=['POST'])
 @login_required
 def toggle_favorite(meal_id):
-    conn = sqlite3.connect('meal_planner.db')
+    """Favorite or unfavorite a meal and report the resulting state.
+    
+    A JSON body of {"favorited": true/false} sets the state, which is safe to
+    repeat; without it the current state is flipped.
+    """
+    data = request.get_json(silent=True) or {}
+    wanted = data.get('favorited')
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Check if meal exists
-    cursor.execute('SELECT id FROM meals WHERE id = ?', (meal_id,))
-    if not cursor.fetchone():
-        conn.close()
-        return jsonify({'success': False, 'message': 'Meal not found'})
+    # Adds the favorite if the meal exists and it is not there yet
+    is_favorited = None
+    if wanted is None or wanted:
+        cursor.execute('''
+            INSERT INTO favorites (user_id, meal_id)
+            SELECT ?, id FROM meals WHERE id = ?
+            ON CONFLICT (user_id, meal_id) DO NOTHING
+            RETURNING meal_id
+        ''', (session['user_id'], meal_id))
+        if cursor.fetchone():
+            is_favorited = True
     
-    # Check if already favorited
-    cursor.execute('SELECT id FROM favorites WHERE user_id = ? AND meal_id = ?', (session['user_id'], meal_id))
-    existing_favorite = cursor.fetchone()
+    # Nothing was added: remove it when toggling, or when asked to
+    if is_favorited is None and not wanted:
+        cursor.execute('''
+            DELETE FROM favorites WHERE user_id = ? AND meal_id = ?
+            RETURNING meal_id
+        ''', (session['user_id'], meal_id))
+        if cursor.fetchone():
+            is_favorited = False
     
-    if existing_favorite:
-        # Remove from favorites
-        cursor.execute('DELETE FROM favorites WHERE user_id = ? AND meal_id = ?', (session['user_id'], meal_id))
-        message = 'Meal removed from favorites'
-        message_type = 'error'
-        is_favorited = False
-    else:
-        # Add to favorites
-        cursor.execute('INSERT INTO favorites (user_id, meal_id) VALUES (?, ?)', (session['user_id'], meal_id))
-        message = 'Meal added to favorites'
-        message_type = 'success'
-        is_favorited = True
+    if is_favorited is None:
+        # Already in the requested state, or the meal does not exist
+        cursor.execute('''
+            SELECT EXISTS (SELECT 1 FROM favorites WHERE user_id = ? AND meal_id = ?)
+            FROM meals WHERE id = ?
+        ''', (session['user_id'], meal_id, meal_id))
+        row = cursor.fetchone()
+        if not row:
+            return jsonify({'success': False, 'message': 'Meal not found'})
+        is_favorited = bool(row[0])
     
     conn.commit()
-    conn.close()
     
+    if is_favorited:
+        message, message_type = 'Meal added to favorites', 'success'
+    else:
+        message, message_type = 'Meal removed from favorites', 'error'
     return jsonify({'success': True, 'message': message, 'message_type': message_type, 'is_favorited': is_favorited})
 
 @app.route('/get_favorites')
 @login_required
 def get_favorites():
-    conn = sqlite3.connect('meal_planner.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT m.*, COALESCE(u.username, 'System') as username 
-        FROM favorites f
-        JOIN meals m ON f.meal_id = m.id
-        LEFT JOIN users u ON m.user_id = u.id
-        WHERE f.user_id = ?
-        ORDER BY m.name
-    ''', (session['user_id'],))
+    try:
+        fields = parse_fields(request.args.get('fields'), default=FAVORITE_FIELDS)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     
-    favorites = cursor.fetchall()
-    conn.close()
+    conn = get_db()
+    cursor = conn.cursor()
     
-    favorites_list = []
-    for meal in favorites:
-        favorites_list.append({
-            'id': meal[0],
-            'name': meal[1],
-            'ingredients': meal[2],
-            'instructions': meal[3],
-            'prep_time': meal[4],
-            'cook_time': meal[5],
-            'servings': meal[6],
-            'category': meal[7],
-            'user_id': meal[8],
-            'is_community': meal[9],
-            'username': meal[10],
-            'type': 'favorite'
-        })
+    favorites_list = list_user_meals(cursor, session['user_id'], 'favorites', fields)
+    for meal in favorites_list:
+        meal['type'] = 'favorite'
     
     return jsonify(favorites_list)
 
@@ -762,7 +1168,7 @@ def get_meal_details_by_name():
     meal_name = data.get('meal_name')
     user_id = data.get('user_id')
     
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -775,7 +1181,6 @@ def get_meal_details_by_name():
     ''', (meal_name, user_id))
     
     meal = cursor.fetchone()
-    conn.close()
     
     if meal:
         return jsonify({
@@ -797,11 +1202,10 @@ def get_meal_details_by_name():
 @app.route('/shopping_list')
 @login_required
 def shopping_list():
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM shopping_list WHERE user_id = ? ORDER BY category, name', (session['user_id'],))
     shopping_data = cursor.fetchall()
-    conn.close()
     
     shopping_items = []
     for item in shopping_data:
@@ -822,7 +1226,7 @@ def generate_shopping_list():
     data = request.get_json()
     period = data.get('period', 'week')  # 'week' or 'month'
     
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Calculate date range
@@ -834,111 +1238,123 @@ def generate_shopping_list():
         start_date = today
         end_date = today + timedelta(days=29)
     
-    # Get planned meals for the period
+    # Aggregate the canonical quantities of every planned meal in the period,
+    # so cups and grams of the same ingredient end up on one line
     cursor.execute('''
-        SELECT mp.date, mp.meal_type, m.ingredients
+        SELECT MIN(mi.name), SUM(mi.base_quantity), mi.base_unit
         FROM meal_plan mp 
-        JOIN meals m ON mp.meal_id = m.id 
-        WHERE mp.date BETWEEN ? AND ? AND mp.user_id = ?
-        ORDER BY mp.date
-    ''', (start_date, end_date, session['user_id']))
-    
-    planned_meals = cursor.fetchall()
-    
-    # Parse ingredients and aggregate them
-    ingredient_counts = {}
-    
-    for meal in planned_meals:
-        ingredients_str = meal[2]
-        if ingredients_str:
-            # Parse ingredients (assuming format like "2 cups flour, 1 lb chicken, etc.")
-            ingredients = [ing.strip() for ing in ingredients_str.split(',')]
-            for ingredient in ingredients:
-                if ingredient:
-                    # Try to parse quantity and unit
-                    parts = ingredient.split(' ', 2)
-                    if len(parts) >= 2:
-                        try:
-                            quantity = float(parts[0])
-                            unit = parts[1]
-                            name = parts[2] if len(parts) > 2 else ''
-                        except ValueError:
-                            quantity = 1
-                            unit = ''
-                            name = ingredient
-                    else:
-                        quantity = 1
-                        unit = ''
-                        name = ingredient
-                    
-                    # Aggregate ingredients
-                    key = f"{name} ({unit})".strip()
-                    if key in ingredient_counts:
-                        ingredient_counts[key]['quantity'] += quantity
-                    else:
-                        ingredient_counts[key] = {
-                            'name': name,
-                            'quantity': quantity,
-                            'unit': unit,
-                            'category': 'General'  # Default category
-                        }
-    
-    # Clear existing shopping list
-    cursor.execute('DELETE FROM shopping_list WHERE user_id = ?', (session['user_id'],))
-    
-    # Add items to shopping list
-    for key, item in ingredient_counts.items():
-        cursor.execute('''
-            INSERT INTO shopping_list (name, quantity, unit, category, user_id)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (item['name'], item['quantity'], item['unit'], item['category'], session['user_id']))
-    
+        JOIN meal_ingredients mi ON mi.meal_id = mp.meal_id 
+        WHERE mp.user_id = ? AND mp.date BETWEEN ? AND ?
+        GROUP BY mi.name_key, mi.base_unit
+    ''', (session['user_id'], start_date, end_date))
+    
+    new_items = {}
+    for name, quantity, unit in cursor.fetchall():
+        new_items[(normalize_name(name), unit)] = (name,) + humanize(quantity, unit)
+    
+    # Diff against the stored list so unchanged rows keep their id and purchased flag
+    cursor.execute('SELECT id, name, quantity, unit FROM shopping_list WHERE user_id = ?', (session['user_id'],))
+    updates = []
+    deletes = []
+    for item_id, name, quantity, unit in cursor.fetchall():
+        new_item = new_items.pop((normalize_name(name), canonical_unit(unit)), None)
+        if new_item is None:
+            deletes.append((item_id,))
+        elif new_item[0] != name or new_item[1] != quantity or new_item[2] != unit:
+            updates.append((new_item[0], new_item[1], new_item[2], item_id))
+    inserts = [(name, quantity, unit, 'General', session['user_id'])
+               for name, quantity, unit in new_items.values()]
+    
+    cursor.executemany('DELETE FROM shopping_list WHERE id = ?', deletes)
+    cursor.executemany('UPDATE shopping_list SET name = ?, quantity = ?, unit = ? WHERE id = ?', updates)
+    cursor.executemany('''
+        INSERT INTO shopping_list (name, quantity, unit, category, user_id)
+        VALUES (?, ?, ?, ?, ?)
+    ''', inserts)
     conn.commit()
-    conn.close()
     
-    return jsonify({'success': True, 'message': f'Shopping list generated for {period}'})
+    return jsonify({'success': True, 'message': f'Shopping list generated for {period}',
+                    'added': len(inserts), 'updated': len(updates), 'removed': len(deletes)})
 
 @app.route('/add_shopping_item', methods=['POST'])
 @login_required
 def add_shopping_item():
     data = request.get_json()
     
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         INSERT INTO shopping_list (name, quantity, unit, category, user_id)
         VALUES (?, ?, ?, ?, ?)
     ''', (data['name'], data['quantity'], data['unit'], data['category'], session['user_id']))
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True, 'id': cursor.lastrowid})
 
 @app.route('/toggle_purchased/<int:item_id>', methods=['POST'])
 @login_required
 def toggle_purchased(item_id):
-    conn = sqlite3.connect('meal_planner.db')
+    """Flip an item's purchased flag, or set it from {"is_purchased": bool}"""
+    data = request.get_json(silent=True) or {}
+    wanted = data.get('is_purchased')
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Get current status
-    cursor.execute('SELECT is_purchased FROM shopping_list WHERE id = ? AND user_id = ?', (item_id, session['user_id']))
+    if wanted is None:
+        new_status = 'NOT COALESCE(is_purchased, FALSE)'
+        params = (item_id, session['user_id'])
+    else:
+        new_status = '?'
+        params = (bool(wanted), item_id, session['user_id'])
+    cursor.execute(f'''
+        UPDATE shopping_list SET is_purchased = {new_status}
+        WHERE id = ? AND user_id = ?
+        RETURNING is_purchased
+    ''', params)
     result = cursor.fetchone()
     
     if result:
-        new_status = not result[0]
-        cursor.execute('UPDATE shopping_list SET is_purchased = ? WHERE id = ? AND user_id = ?', 
-                      (new_status, item_id, session['user_id']))
         conn.commit()
-        conn.close()
-        return jsonify({'success': True, 'is_purchased': new_status})
+        return jsonify({'success': True, 'is_purchased': bool(result[0])})
     else:
-        conn.close()
         return jsonify({'success': False, 'message': 'Item not found'})
 
+@app.route('/set_purchased', methods=['POST'])
+@login_required
+def set_purchased():
+    """Set the purchased flag of many shopping items in one statement.
+    
+    JSON body: {"is_purchased": bool, "item_ids": [...]}. Without item_ids
+    every item on the user's list is updated.
+    """
+    data = request.get_json(silent=True) or {}
+    item_ids = data.get('item_ids')
+    if not isinstance(data.get('is_purchased'), bool) or (
+            item_ids is not None and not (isinstance(item_ids, list)
+                                          and all(type(item_id) is int for item_id in item_ids))):
+        return jsonify({'success': False, 'message': 'Expected is_purchased and a list of item ids'}), 400
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    params = [data['is_purchased'], session['user_id']]
+    selection = ''
+    if item_ids is not None:
+        selection = 'AND id IN (SELECT value FROM json_each(?))'
+        params.append(json.dumps(item_ids))
+    cursor.execute(f'''
+        UPDATE shopping_list SET is_purchased = ?
+        WHERE user_id = ? {selection}
+        RETURNING id
+    ''', params)
+    updated = sorted(row[0] for row in cursor.fetchall())
+    conn.commit()
+    
+    return jsonify({'success': True, 'is_purchased': data['is_purchased'], 'item_ids': updated})
+
 @app.route('/mark_as_purchased/<int:item_id>', methods=['POST'])
 @login_required
 def mark_as_purchased(item_id):
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get shopping item details
@@ -957,70 +1373,76 @@ def mark_as_purchased(item_id):
         cursor.execute('DELETE FROM shopping_list WHERE id = ? AND user_id = ?', (item_id, session['user_id']))
         
         conn.commit()
-        conn.close()
         return jsonify({'success': True, 'message': 'Item added to ingredients inventory'})
     else:
-        conn.close()
         return jsonify({'success': False, 'message': 'Item not found'})
 
 @app.route('/delete_shopping_item/<int:item_id>', methods=['DELETE'])
 @login_required
 def delete_shopping_item(item_id):
-    conn = sqlite3.connect('meal_planner.db')
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('DELETE FROM shopping_list WHERE id = ? AND user_id = ?', (item_id, session['user_id']))
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True})
 
 @app.route('/auto_generate_plan', methods=['POST'])
 @login_required
 def auto_generate_plan():
-    data = request.get_json()
-    year = data['year']
-    month = data['month']
-    
-    conn = sqlite3.connect('meal_planner.db')
+    """Fill a month with a generated plan, replacing what was planned.
+    
+    Optional JSON fields: seed (same seed, same plan) and no_repeat_days.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        year = int(data['year'])
+        month = int(data['month'])
+        date(year, month, 1)
+        no_repeat_days = min(max(int(data.get('no_repeat_days', NO_REPEAT_DAYS)), 0), 31)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid month'}), 400
+    seed = data.get('seed')
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, (int, str))):
+        return jsonify({'success': False, 'message': 'Seed must be a number or a string'}), 400
+    
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Get available meals (personal + community + default)
-    cursor.execute('''
-        SELECT id FROM meals 
-        WHERE (user_id = ? AND is_community = FALSE) 
-           OR (is_community = TRUE) 
-           OR (user_id IS NULL)
-    ''', (session['user_id'],))
-    meal_ids = [row[0] for row in cursor.fetchall()]
-    
-    if not meal_ids:
-        conn.close()
+    # Community meals are the same for every user, so their categories come from the cache
+    shared = community_meals_cache.get_or_load(cursor, ('plan_candidates',),
+                                               lambda: load_shared_candidates(cursor))
+    planned = generate_plan(cursor, session['user_id'], year, month, shared,
+                            seed=seed, no_repeat_days=no_repeat_days)
+    if not planned:
         return jsonify({'success': False, 'message': 'No meals available'})
     
-    # Clear existing meal plan for this month and user
-    start_date = datetime(year, month, 1).date()
-    end_date = (datetime(year, month + 1, 1) - timedelta(days=1)).date()
-    cursor.execute('DELETE FROM meal_plan WHERE date BETWEEN ? AND ? AND user_id = ?', (start_date, end_date, session['user_id']))
-    
-    # Generate meal plan
-    current_date = start_date
-    meal_types = ['breakfast', 'lunch', 'dinner']
-    
-    while current_date <= end_date:
-        for meal_type in meal_types:
-            # Randomly select a meal
-            import random
-            meal_id = random.choice(meal_ids)
-            cursor.execute('''
-                INSERT INTO meal_plan (date, meal_id, meal_type, user_id)
-                VALUES (?, ?, ?, ?)
-            ''', (current_date, meal_id, meal_type, session['user_id']))
-        current_date += timedelta(days=1)
-    
     conn.commit()
-    conn.close()
     
-    return jsonify({'success': True})
+    return jsonify({'success': True, 'planned': planned})
+
+@app.errorhandler(sqlite3.OperationalError)
+def database_busy(e):
+    """Answer 503 when the database stays locked past busy_timeout, or no pooled
+    connection frees up in time, so clients can retry"""
+    if not is_busy_error(e):
+        raise
+    response = jsonify({'success': False, 'message': 'The database is busy, please try again'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@app.route('/db_stats')
+@login_required
+def db_stats():
+    """Connection pool statistics for this worker"""
+    return jsonify(get_pool().stats())
+
+@app.route('/cache_stats')
+@login_required
+def cache_stats_view():
+    """Meal cache hit/miss statistics for this worker"""
+    return jsonify(cache_stats())
 
 if __name__ == '__main__':
     # Create templates directory if it doesn't exist
@@ -0,0 +1,140 @@
+"""
+Meal popularity counters for the Meal Planner app.
+meal_stats keeps running totals per meal (favorites, planned slots, copies)
+and meal_activity keeps the same counts per day for the trending window.
+Triggers on favorites and meal_plan keep both up to date; copies are
+recorded by the add_to_my_meals write path. Bulk plan generation takes its
+own slots back out of the trending activity.
+"""
+
+from datetime import date, timedelta
+
+# Popularity score, used by the meal_stats.score column and for trending
+SCORE_SQL = 'favorites * 3 + copied * 2 + planned'
+
+TRENDING_DAYS = 7
+ACTIVITY_RETENTION_DAYS = 90
+
+
+def _bump(column, delta, meal_id_sql):
+    """SQL adding delta to one counter in meal_stats and today's meal_activity row"""
+    return f'''
+        INSERT INTO meal_stats (meal_id, {column}) VALUES ({meal_id_sql}, {delta})
+        ON CONFLICT (meal_id) DO UPDATE SET {column} = {column} + {delta};
+        INSERT INTO meal_activity (day, meal_id, {column}) VALUES (date('now'), {meal_id_sql}, {delta})
+        ON CONFLICT (day, meal_id) DO UPDATE SET {column} = {column} + {delta};
+    '''
+
+
+# Triggers that keep the counters in step with favorites and meal_plan
+TRIGGERS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS favorites_stats_insert AFTER INSERT ON favorites
+    BEGIN
+        {_bump('favorites', 1, 'NEW.meal_id')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS favorites_stats_delete AFTER DELETE ON favorites
+    BEGIN
+        {_bump('favorites', -1, 'OLD.meal_id')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS meal_plan_stats_insert AFTER INSERT ON meal_plan
+    WHEN NEW.meal_id IS NOT NULL
+    BEGIN
+        {_bump('planned', 1, 'NEW.meal_id')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS meal_plan_stats_delete AFTER DELETE ON meal_plan
+    WHEN OLD.meal_id IS NOT NULL
+    BEGIN
+        {_bump('planned', -1, 'OLD.meal_id')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS meal_plan_stats_update AFTER UPDATE OF meal_id ON meal_plan
+    WHEN OLD.meal_id IS NOT NEW.meal_id
+    BEGIN
+        {_bump('planned', -1, 'OLD.meal_id')}
+        {_bump('planned', 1, 'NEW.meal_id')}
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS meals_stats_insert AFTER INSERT ON meals
+    BEGIN
+        INSERT OR IGNORE INTO meal_stats (meal_id) VALUES (NEW.id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS meals_stats_delete AFTER DELETE ON meals
+    BEGIN
+        DELETE FROM meal_stats WHERE meal_id = OLD.id;
+    END
+    ''',
+]
+
+
+def record_copy(cursor, meal_id):
+    """Count one copy of a meal into someone's personal meals"""
+    cursor.execute('''
+        INSERT INTO meal_stats (meal_id, copied) VALUES (?, 1)
+        ON CONFLICT (meal_id) DO UPDATE SET copied = copied + 1
+    ''', (meal_id,))
+    cursor.execute('''
+        INSERT INTO meal_activity (day, meal_id, copied) VALUES (date('now'), ?, 1)
+        ON CONFLICT (day, meal_id) DO UPDATE SET copied = copied + 1
+    ''', (meal_id,))
+
+
+def trending_since(days=TRENDING_DAYS):
+    """First day (ISO string) of a trending window of the given length"""
+    return (date.today() - timedelta(days=days - 1)).isoformat()
+
+
+def refresh_popularity(cursor, retention_days=ACTIVITY_RETENTION_DAYS):
+    """Recount favorites and planned slots from their tables and prune old activity.
+
+    Meant for a nightly job or after bulk imports that bypassed the triggers.
+    Copies cannot be recounted, so they are kept. Returns a summary dict.
+    The caller commits.
+    """
+    cursor.execute('INSERT OR IGNORE INTO meal_stats (meal_id) SELECT id FROM meals')
+    cursor.execute('DELETE FROM meal_stats WHERE meal_id NOT IN (SELECT id FROM meals)')
+    cursor.execute('UPDATE meal_stats SET favorites = 0, planned = 0')
+    cursor.execute('''
+        UPDATE meal_stats SET favorites = f.total
+        FROM (SELECT meal_id, COUNT(*) AS total FROM favorites GROUP BY meal_id) f
+        WHERE meal_stats.meal_id = f.meal_id
+    ''')
+    cursor.execute('''
+        UPDATE meal_stats SET planned = p.total
+        FROM (SELECT meal_id, COUNT(*) AS total FROM meal_plan WHERE meal_id IS NOT NULL GROUP BY meal_id) p
+        WHERE meal_stats.meal_id = p.meal_id
+    ''')
+    cursor.execute('SELECT COUNT(*) FROM meal_stats')
+    meals = cursor.fetchone()[0]
+
+    cutoff = (date.today() - timedelta(days=retention_days)).isoformat()
+    cursor.execute('DELETE FROM meal_activity WHERE day < ?', (cutoff,))
+    return {'meals': meals, 'pruned_activity': cursor.rowcount}
+
+
+def discount_plan_activity(cursor, planned):
+    """Take planned slots counted by the triggers back out of today's activity.
+
+    For bulk writes whose slots are not user activity: meal_stats keeps
+    counting them, but trending does not. planned maps meal ids to the net
+    number of slots the write added. The caller commits, in the same
+    transaction as the write.
+    """
+    cursor.executemany('''
+        UPDATE meal_activity SET planned = planned - ?
+        WHERE day = date('now') AND meal_id = ?
+    ''', [(count, meal_id) for meal_id, count in planned.items() if count])
+    cursor.execute('''
+        DELETE FROM meal_activity
+        WHERE day = date('now') AND favorites = 0 AND planned = 0 AND copied = 0
+    ''')
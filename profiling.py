@@ -0,0 +1,183 @@
+"""
+On-demand request profiling for the Meal Planner app.
+An admin can profile one request by sending the "X-Profile" header or the
+"_profile" query argument. "1" runs the request under cProfile; "memory"
+also tracks allocations with tracemalloc. Results are written to
+PROFILE_DIR, keeping the newest PROFILE_KEEP profiles, and can be listed
+and downloaded from /admin/profiles. Admins are the users named in
+ADMIN_USERS; the flag is ignored for everyone else.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import re
+import time
+import tracemalloc
+from datetime import datetime
+from functools import wraps
+
+from flask import abort, g, jsonify, request, send_from_directory, session
+
+# Comma-separated usernames; nobody can profile until this is set
+ADMIN_USERS = {name.strip() for name in os.environ.get('ADMIN_USERS', '').split(',') if name.strip()}
+PROFILE_DIR = os.path.abspath(os.environ.get('PROFILE_DIR', 'profiles'))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+TOP_ENTRIES = 20
+PROFILE_MODES = ('1', 'memory')
+
+
+def is_admin():
+    return session.get('username') in ADMIN_USERS
+
+
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not is_admin():
+            abort(403)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def start_profile():
+    mode = request.headers.get('X-Profile') or request.args.get('_profile')
+    if mode not in PROFILE_MODES or not is_admin():
+        return
+    g.profile_started = time.perf_counter()
+    # tracemalloc is process-wide, so it is left alone if already running
+    g.profile_tracemalloc = mode == 'memory' and not tracemalloc.is_tracing()
+    if g.profile_tracemalloc:
+        tracemalloc.start(25)
+    g.profile_memory = mode == 'memory'
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+
+def finish_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    duration = time.perf_counter() - g.profile_started
+    snapshot = None
+    if g.profile_memory:
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        ])
+    if g.pop('profile_tracemalloc', False):
+        tracemalloc.stop()
+
+    profile_id = save_profile(profiler, snapshot, {
+        'endpoint': request.endpoint,
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'user': session.get('username'),
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+    })
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+def abandon_profile(exc):
+    """Stop a profile that finish_profile never got to, so a failed request
+    cannot leave its thread profiled or tracemalloc running"""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+    if g.pop('profile_tracemalloc', False):
+        tracemalloc.stop()
+
+
+def save_profile(profiler, snapshot, meta):
+    """Write the pstats file, the allocation snapshot and a JSON summary; return the profile id"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now()
+    endpoint = re.sub(r'[^A-Za-z0-9_]', '_', meta['endpoint'] or 'unmatched')
+    profile_id = f"{stamp:%Y%m%d_%H%M%S_%f}_{endpoint}"
+    base = os.path.join(PROFILE_DIR, profile_id)
+
+    profiler.dump_stats(f'{base}.prof')
+    stats = pstats.Stats(profiler).sort_stats('cumulative')
+    top_functions = []
+    for func in stats.fcn_list[:TOP_ENTRIES]:
+        primitive_calls, calls, total_time, cumulative_time, _ = stats.stats[func]
+        top_functions.append({
+            'function': pstats.func_std_string(func),
+            'calls': calls,
+            'total_ms': round(total_time * 1000, 3),
+            'cumulative_ms': round(cumulative_time * 1000, 3),
+        })
+
+    files = [f'{profile_id}.prof']
+    top_allocations = []
+    if snapshot is not None:
+        snapshot.dump(f'{base}.tracemalloc')
+        files.append(f'{profile_id}.tracemalloc')
+        for stat in snapshot.statistics('lineno')[:TOP_ENTRIES]:
+            frame = stat.traceback[0]
+            top_allocations.append({'line': f'{frame.filename}:{frame.lineno}',
+                                    'size_kb': round(stat.size / 1024, 1), 'count': stat.count})
+
+    summary = dict(meta, id=profile_id, created=stamp.isoformat(timespec='seconds'), files=files,
+                   top_functions=top_functions, top_allocations=top_allocations)
+    with open(f'{base}.json', 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    rotate_profiles()
+    return profile_id
+
+
+def rotate_profiles(keep=PROFILE_KEEP):
+    """Delete all but the newest keep profiles"""
+    profile_ids = sorted(name[:-5] for name in os.listdir(PROFILE_DIR) if name.endswith('.json'))
+    for profile_id in profile_ids[:-keep] if keep else profile_ids:
+        for extension in ('.json', '.prof', '.tracemalloc'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile_id + extension))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    """Summaries of the stored profiles, newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        summary.pop('top_functions', None)
+        summary.pop('top_allocations', None)
+        profiles.append(summary)
+    return profiles
+
+
+@admin_required
+def profiles_view():
+    """Stored request profiles"""
+    return jsonify(list_profiles())
+
+
+@admin_required
+def profile_file(filename):
+    """Download a profile file, or view its JSON summary"""
+    as_attachment = not filename.endswith('.json')
+    return send_from_directory(PROFILE_DIR, filename, as_attachment=as_attachment)
+
+
+def init_app(app):
+    """Register the profiling hooks and the admin endpoints with a Flask app"""
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(abandon_profile)
+    app.add_url_rule('/admin/profiles', 'profiles', profiles_view)
+    app.add_url_rule('/admin/profiles/<filename>', 'profile_file', profile_file)
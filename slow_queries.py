@@ -0,0 +1,144 @@
+"""
+Opt-in slow-query log for the Meal Planner app.
+When SLOW_QUERY_MS is set, every statement a request runs for longer than
+that many milliseconds (execute plus fetching its rows) is appended to
+SLOW_QUERY_LOG as one JSON line. Each line holds the SQL, the types of its
+parameters (never their values), the duration, the route and the output of
+EXPLAIN QUERY PLAN, with tables read by a full scan called out.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from flask import has_request_context, request
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', 'slow_queries.jsonl')
+PLAN_CACHE_SIZE = 512
+
+# "SCAN meals" reads the whole table; "SCAN meals USING INDEX ..." does not
+FULL_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)([^\s(]+)$')
+SUBQUERY = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\S+)')
+TABLE_ALIAS = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)', re.IGNORECASE)
+SQL_KEYWORDS = {'on', 'where', 'join', 'left', 'inner', 'cross', 'group', 'order', 'limit', 'using', 'natural'}
+
+_plans = {}
+_lock = threading.Lock()
+
+
+def normalize_sql(sql):
+    """Collapse whitespace so the same statement always logs the same text"""
+    return ' '.join(sql.split())
+
+
+def parameter_shape(parameters):
+    """Type names of bound parameters, keeping their positions or names"""
+    def type_name(value):
+        return 'null' if value is None else type(value).__name__
+    if isinstance(parameters, dict):
+        return {name: type_name(value) for name, value in parameters.items()}
+    return [type_name(value) for value in parameters]
+
+
+def explain(conn, sql, parameters):
+    """EXPLAIN QUERY PLAN lines (indented by depth) and the fully scanned tables"""
+    key = normalize_sql(sql)
+    with _lock:
+        cached = _plans.get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        # A plain cursor, so that explaining is not counted or logged itself
+        cursor = conn.cursor(sqlite3.Cursor)
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parameters)
+        rows = cursor.fetchall()
+    except sqlite3.Error as e:
+        return [f'(no plan: {e})'], []
+
+    # Plans name tables by their alias, and subqueries are scanned like tables
+    aliases = {alias: table for table, alias in TABLE_ALIAS.findall(sql)
+               if alias.lower() not in SQL_KEYWORDS}
+    subqueries = set()
+    depth = {0: -1}
+    plan, full_scans = [], []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append('  ' * depth[node_id] + detail)
+        match = SUBQUERY.match(detail)
+        if match:
+            subqueries.add(match.group(1))
+        match = FULL_SCAN.match(detail)
+        if match and match.group(1) not in subqueries:
+            full_scans.append(aliases.get(match.group(1), match.group(1)))
+
+    with _lock:
+        if len(_plans) >= PLAN_CACHE_SIZE:
+            _plans.clear()
+        _plans[key] = (plan, full_scans)
+    return plan, full_scans
+
+
+def record(conn, sql, parameters, seconds, many=False):
+    """Append one slow statement to the log"""
+    # executemany may have been given a one-shot iterator, so its plan and
+    # parameter shapes are not available
+    plan, full_scans = ([], []) if many else explain(conn, sql, parameters)
+    entry = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'duration_ms': round(seconds * 1000, 3),
+        'sql': normalize_sql(sql),
+        'params': None if many else parameter_shape(parameters),
+        'executemany': many,
+        'endpoint': request.endpoint if has_request_context() else None,
+        'method': request.method if has_request_context() else None,
+        'path': request.path if has_request_context() else None,
+        'plan': plan,
+        'full_scans': full_scans,
+    }
+    try:
+        with _lock, open(SLOW_QUERY_LOG, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+    except OSError:
+        pass
+
+
+def summarize(path=SLOW_QUERY_LOG):
+    """Group logged statements by SQL text, worst total time first"""
+    groups = defaultdict(lambda: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                  'endpoints': set(), 'full_scans': set(), 'plan': []})
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            group = groups[entry['sql']]
+            group['count'] += 1
+            group['total_ms'] += entry['duration_ms']
+            if entry['duration_ms'] >= group['max_ms']:
+                group['max_ms'] = entry['duration_ms']
+                group['plan'] = entry.get('plan') or []
+            if entry.get('endpoint'):
+                group['endpoints'].add(entry['endpoint'])
+            group['full_scans'].update(entry.get('full_scans') or [])
+
+    report = []
+    for sql, group in groups.items():
+        report.append({
+            'sql': sql,
+            'count': group['count'],
+            'total_ms': round(group['total_ms'], 3),
+            'avg_ms': round(group['total_ms'] / group['count'], 3),
+            'max_ms': group['max_ms'],
+            'endpoints': sorted(group['endpoints']),
+            'full_scans': sorted(group['full_scans']),
+            'plan': group['plan'],
+        })
+    report.sort(key=lambda item: item['total_ms'], reverse=True)
+    return report
@@ -0,0 +1,130 @@
+"""
+Unit conversion for ingredient quantities.
+Maps recipe and pantry units onto canonical mass (g), volume (ml) and count
+dimensions so that quantities such as '2 cups flour' and '250g flour' can be
+added together.
+"""
+
+MASS = 'g'
+VOLUME = 'ml'
+COUNT = ''
+
+# Factor to the canonical unit of each dimension, with every spelling we accept
+_UNIT_GROUPS = [
+    (MASS, 1.0, ['g', 'gram', 'grams', 'gr']),
+    (MASS, 1000.0, ['kg', 'kgs', 'kilogram', 'kilograms']),
+    (MASS, 0.001, ['mg', 'milligram', 'milligrams']),
+    (MASS, 28.349523125, ['oz', 'ounce', 'ounces']),
+    (MASS, 453.59237, ['lb', 'lbs', 'pound', 'pounds']),
+    (VOLUME, 1.0, ['ml', 'milliliter', 'milliliters', 'millilitre', 'millilitres']),
+    (VOLUME, 10.0, ['cl']),
+    (VOLUME, 1000.0, ['l', 'liter', 'liters', 'litre', 'litres']),
+    (VOLUME, 4.92892159375, ['tsp', 'tsps', 'teaspoon', 'teaspoons']),
+    (VOLUME, 14.78676478125, ['tbsp', 'tbsps', 'tablespoon', 'tablespoons']),
+    (VOLUME, 29.5735295625, ['fl oz', 'floz', 'fluid ounce', 'fluid ounces']),
+    (VOLUME, 236.5882365, ['cup', 'cups']),
+    (VOLUME, 473.176473, ['pint', 'pints']),
+    (VOLUME, 946.352946, ['quart', 'quarts']),
+    (VOLUME, 3785.411784, ['gallon', 'gallons']),
+    (COUNT, 1.0, ['pc', 'pcs', 'piece', 'pieces', 'each', 'whole']),
+    (COUNT, 12.0, ['dozen']),
+]
+
+# Precomputed lookup: unit spelling -> (canonical unit, factor)
+UNIT_TABLE = {alias: (canonical, factor)
+              for canonical, factor, aliases in _UNIT_GROUPS
+              for alias in aliases}
+
+# Units with no fixed size. They are recognised when parsing but only
+# aggregate with the same unit.
+OTHER_UNITS = {
+    'can': 'can', 'cans': 'can',
+    'bottle': 'bottle', 'bottles': 'bottle',
+    'clove': 'clove', 'cloves': 'clove',
+    'bunch': 'bunch', 'bunches': 'bunch',
+    'head': 'head', 'heads': 'head',
+    'slice': 'slice', 'slices': 'slice',
+    'package': 'package', 'packages': 'package', 'pack': 'package', 'packs': 'package',
+    'pinch': 'pinch', 'pinches': 'pinch',
+    'handful': 'handful', 'handfuls': 'handful',
+    'stalk': 'stalk', 'stalks': 'stalk',
+    'sprig': 'sprig', 'sprigs': 'sprig',
+}
+
+# Grams per millilitre, used to store measured-by-volume ingredients by mass
+DENSITIES = {
+    'flour': 0.53,
+    'all-purpose flour': 0.53,
+    'bread flour': 0.55,
+    'sugar': 0.85,
+    'white sugar': 0.85,
+    'brown sugar': 0.93,
+    'powdered sugar': 0.56,
+    'butter': 0.96,
+    'rice': 0.85,
+    'white rice': 0.85,
+    'oat': 0.41,
+    'salt': 1.2,
+    'honey': 1.42,
+    'water': 1.0,
+    'milk': 1.03,
+    'cream': 1.01,
+    'olive oil': 0.92,
+    'vegetable oil': 0.92,
+    'oil': 0.92,
+    'soy sauce': 1.15,
+    'parmesan': 0.42,
+    'parmesan cheese': 0.42,
+    'breadcrumb': 0.45,
+    'cocoa powder': 0.42,
+}
+
+
+def _clean(unit):
+    return (unit or '').strip().lower().rstrip('.')
+
+
+def lookup_unit(unit):
+    """Return (canonical unit, factor) for a unit spelling, or None if unknown"""
+    return UNIT_TABLE.get(_clean(unit))
+
+
+def is_unit(unit):
+    """True if the spelling is a unit we recognise, convertible or not"""
+    unit = _clean(unit)
+    return unit in UNIT_TABLE or unit in OTHER_UNITS
+
+
+def to_canonical(quantity, unit, name_key=''):
+    """Convert a quantity to its canonical unit.
+
+    Volumes of ingredients with a known density are stored as mass so that
+    cups and grams of the same ingredient merge. Units without a fixed size
+    such as 'cloves' are kept (singular) and only aggregate with themselves.
+    """
+    if quantity is None:
+        quantity = 1.0
+    known = lookup_unit(unit)
+    if known is None:
+        unit = _clean(unit)
+        return quantity, OTHER_UNITS.get(unit, unit)
+
+    canonical, factor = known
+    quantity = quantity * factor
+    if canonical == VOLUME and name_key in DENSITIES:
+        return quantity * DENSITIES[name_key], MASS
+    return quantity, canonical
+
+
+def canonical_unit(unit):
+    """Return the canonical unit a spelling converts to, e.g. 'kg' -> 'g'"""
+    return to_canonical(1.0, unit)[1]
+
+
+def humanize(quantity, canonical_unit):
+    """Pick a readable unit for a canonical quantity, e.g. 1500 g -> 1.5 kg"""
+    if canonical_unit == MASS and quantity >= 1000:
+        return round(quantity / 1000, 2), 'kg'
+    if canonical_unit == VOLUME and quantity >= 1000:
+        return round(quantity / 1000, 2), 'l'
+    return round(quantity, 2), canonical_unit